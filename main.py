@@ -1,15 +1,12 @@
-import os
-import pickle
 import sys
 
 import numpy as np
 import random
-import copy
-import pprint
 from src.board import Board
 from src.map import Map
 from src.utils import *
 from src.algos import flat, UCB, best_move_UCT, best_move_RAVE, best_move_GRAVE, best_move_UCT_pas_MAST
+from src.tournament import Agent, run_tournament
 
 MAX_DICE = 3
 BLOCK = 0
@@ -26,16 +23,7 @@ INT2STRING = {RED: 'RED', BLUE: 'BLUE'}
 
 
 def generate_hash_structures(map_reference: str):
-    b = Board(mapp=Map(map_reference))
-    keys = list(b.board.nodes)
-    nb_cases = len(keys)
-    table = dict(zip(keys, np.random.randint(0, 2 ** 31, (nb_cases, b.map.nb_players + 1))))
-
-    turn = {RED: np.random.randint(0, 2 ** 31),
-            BLUE: np.random.randint(0, 2 ** 31),
-            GREEN: np.random.randint(0, 2 ** 31)}
-
-    return table, turn
+    return Map(map_reference).draw_zobrist_keys()
 
 
 def flat_game(board, nb_playouts, game_time_limit=100):
@@ -116,63 +104,12 @@ def play_vs_UCT(nb_playouts):
     return figures
 
 
-def UCT_vs_UCT(board: Board, nb_playouts, nb_games, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-
-    red_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    red_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    blue_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    blue_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    if board.map.nb_players == 3:
-        sum_wins[GREEN] = 0
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1))
-        start_time = time.perf_counter()
-        if save_gif is True and g <= 4:
-            figures.append(b_cop.display('names'))
-        print("Game_time : ", end="")
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-
-            dice_score = random.randint(1, board.map.max_dice)
-            b_cop.transposition_table.playouts_MAST = red_MAST_playouts
-            b_cop.transposition_table.win_MAST = red_MAST_wins
-            chosen_move_red = best_move_UCT(b_cop, dice_score, nb_playouts, mode=1, c=0.4, mast_param=0.25)
-            b_cop.play(chosen_move_red)
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            dice_score = random.randint(1, board.map.max_dice)
-            b_cop.transposition_table.playouts_MAST = blue_MAST_playouts
-            b_cop.transposition_table.win_MAST = blue_MAST_wins
-            chosen_move_blue = best_move_UCT(b_cop, dice_score, nb_playouts, mode=1, c=0.4, mast_param=0.5)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-        end_time = time.perf_counter()
-
-        sum_wins[b_cop.winner] += 1
-        print(f"- game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE")
-        pprint.pprint(sum_wins)
-        if save_gif is True and g <= 4:
-            figs2gif(figures, name=f"2p_{nb_playouts}plyt_game{g + 1}.gif")
-
-
-        with open(f"sum_wins_{nb_playouts}plyt_{g}games.pkl", "wb") as f:
-            pickle.dump(sum_wins, f)
-        # with open(f"transposition_table.pkl", "wb") as f:
-        #     pickle.dump(board.transposition_table, f)
+def UCT_vs_UCT(board: Board, nb_playouts, nb_games, save_gif=False, nb_workers=1, mast_store=None):
+    agents = [Agent('UCT', nb_playouts, name='UCT_RED', mode=1, c=0.4, mast_param=0.25),
+              Agent('UCT', nb_playouts, name='UCT_BLUE', mode=1, c=0.4, mast_param=0.5)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=5 if save_gif else 0,
+                          name=f"UCTxUCT_{nb_playouts}plyt", results_path=f"results_{nb_playouts}plyt_UCTxUCT.jsonl")
 
 
 def RAVE_game(board: Board, nb_playouts, game_time_limit, mode, save_gif=False):
@@ -192,187 +129,31 @@ def RAVE_game(board: Board, nb_playouts, game_time_limit, mode, save_gif=False):
     if save_gif is True:
         return figures
 
-def RAVE_vs_RAVE(board: Board, nb_playouts, nb_games, beta1, beta2, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-    red_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    red_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    blue_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    blue_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1) + f" RAVE{beta1}_vs_RAVE{beta2}")
-        start_time = time.perf_counter()
-        if save_gif is True:
-            figures.append(b_cop.display('names'))
-
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-")
-
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = red_MAST_playouts
-            board.transposition_table.win_MAST = red_MAST_wins
-            chosen_move_red = best_move_RAVE(b_cop, dice_score,
-                                             nb_playouts,
-                                             mode=1,
-                                             mast_param=0.25,
-                                             beta_param=beta1)
-            b_cop.play(chosen_move_red)
-
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-")
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = blue_MAST_playouts
-            board.transposition_table.win_MAST = blue_MAST_wins
-            chosen_move_blue = best_move_RAVE(b_cop,
-                                              dice_score,
-                                              nb_playouts,
-                                              mode=1,
-                                              mast_param=0.25,
-                                              beta_param=beta2)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-
-        end_time = time.perf_counter()
-
-        sum_wins[b_cop.winner] += 1
-        print(f" game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE")
-        pprint.pprint(sum_wins)
-        if save_gif is True:
-            figs2gif(figures,
-                     name=f"RAVExRAVE_{nb_playouts}plyt_game{g + 1}_pid{os.getpid()}.gif")
-
-        with open(f"sum_wins_{nb_playouts}plyt_RAVExRAVE_{g + 1}games_pid{os.getpid()}.pkl",
-                  "wb") as f:
-            pickle.dump(sum_wins, f)
-
-def RAVE_vs_UCT(board: Board, nb_playouts, nb_games, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-
-    red_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    red_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    blue_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    blue_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1))
-        start_time = time.perf_counter()
-        if save_gif is True and g <= 4:
-            figures.append(b_cop.display('names'))
-        print("Game_time : ", end="")
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-
-            dice_score = random.randint(1, board.map.max_dice)
-            b_cop.transposition_table.playouts_MAST = red_MAST_playouts
-            b_cop.transposition_table.win_MAST = red_MAST_wins
-            chosen_move_red = best_move_RAVE(b_cop, dice_score, nb_playouts, mode=1, mast_param=0.2)
-            b_cop.play(chosen_move_red)
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            dice_score = random.randint(1, board.map.max_dice)
-            b_cop.transposition_table.playouts_MAST = blue_MAST_playouts
-            b_cop.transposition_table.win_MAST = blue_MAST_wins
-            chosen_move_blue = best_move_UCT(b_cop, dice_score, nb_playouts, mode=1, c=0.4, mast_param=0.2)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-        end_time = time.perf_counter()
-
-        sum_wins[b_cop.winner] += 1
-        print(f"- game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE")
-        pprint.pprint(sum_wins)
-        if save_gif is True and g <= 4:
-            figs2gif(figures, name=f"RAVExUCT_{nb_playouts}plyt_game{g + 1}_pid{os.getpid()}.gif")
-
-        with open(f"sum_wins_{nb_playouts}plyt_{g}games_pid{os.getpid()}.pkl", "wb") as f:
-            pickle.dump(sum_wins, f)
-        # with open(f"transposition_table.pkl", "wb") as f:
-        #     pickle.dump(board.transposition_table, f)
-
-def RAVE_vs_UCT_vs_UCT(board, nb_playouts, nb_games, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-    if board.map.nb_players == 3:
-        sum_wins[GREEN] = 0
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1) + " RAVE_vs_UCT_vs_UCT")
-        start_time = time.perf_counter()
-        if save_gif is True:
-            figures.append(b_cop.display('names'))
-
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            dice_score = random.randint(1, board.map.max_dice)
-            chosen_move_red = best_move_RAVE(b_cop, dice_score, nb_playouts, mode=1)
-            b_cop.play(chosen_move_red)
-
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            dice_score = random.randint(1, board.map.max_dice)
-            chosen_move_blue = best_move_UCT(b_cop, dice_score, nb_playouts, mode=1)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            dice_score = random.randint(1, board.map.max_dice)
-            chosen_move_blue = best_move_UCT(b_cop, dice_score, nb_playouts, mode=1)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True and g <= 4:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
+def RAVE_vs_RAVE(board: Board, nb_playouts, nb_games, beta1, beta2, save_gif=False, nb_workers=1, mast_store=None):
+    agents = [Agent('RAVE', nb_playouts, name=f'RAVE{beta1}', mode=1, mast_param=0.25, beta_param=beta1),
+              Agent('RAVE', nb_playouts, name=f'RAVE{beta2}', mode=1, mast_param=0.25, beta_param=beta2)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=nb_games if save_gif else 0,
+                          name=f"RAVExRAVE_{nb_playouts}plyt",
+                          results_path=f"results_{nb_playouts}plyt_RAVExRAVE.jsonl")
 
-        end_time = time.perf_counter()
 
-        sum_wins[b_cop.winner] += 1
-        print(f" game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE  -  GREEN")
-        pprint.pprint(sum_wins)
-        if save_gif is True and g <= 4:
-            figs2gif(figures, name=f"RAVE-UCT-UCT_{nb_playouts}plyt_game{g + 1}.gif")
+def RAVE_vs_UCT(board: Board, nb_playouts, nb_games, save_gif=False, nb_workers=1, mast_store=None):
+    agents = [Agent('RAVE', nb_playouts, mode=1, mast_param=0.2),
+              Agent('UCT', nb_playouts, mode=1, c=0.4, mast_param=0.2)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=5 if save_gif else 0,
+                          name=f"RAVExUCT_{nb_playouts}plyt", results_path=f"results_{nb_playouts}plyt_RAVExUCT.jsonl")
 
-        board.transposition_table.win_MAST = b_cop.transposition_table.win_MAST
-        board.transposition_table.playouts_MAST = b_cop.transposition_table.playouts_MAST
 
-        with open(f"sum_wins_{nb_playouts}plyt_{g}games.pkl", "wb") as f:
-            pickle.dump(sum_wins, f)
-        with open(f"transposition_table.pkl", "wb") as f:
-            pickle.dump(board.transposition_table, f)
+def RAVE_vs_UCT_vs_UCT(board, nb_playouts, nb_games, save_gif=False, nb_workers=1, mast_store=None):
+    agents = [Agent('RAVE', nb_playouts, mode=1, mast_param=0.25),
+              Agent('UCT', nb_playouts, mode=1),
+              Agent('UCT', nb_playouts, mode=1)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=5 if save_gif else 0,
+                          name=f"RAVE-UCT-UCT_{nb_playouts}plyt",
+                          results_path=f"results_{nb_playouts}plyt_RAVE-UCT-UCT.jsonl")
 
 
 def GRAVE_game(board: Board, nb_playouts, game_time_limit, treshold, mode, save_gif=False):
@@ -392,113 +173,25 @@ def GRAVE_game(board: Board, nb_playouts, game_time_limit, treshold, mode, save_
     if save_gif is True:
         return figures
 
-def GRAVE_vs_GRAVE(board: Board, nb_playouts, nb_games, treshold1, treshold2, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-    red_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    red_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    blue_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    blue_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1) + f" GRAVE{treshold1}_vs_GRAVE{treshold2}")
-        start_time = time.perf_counter()
-        if save_gif is True:
-            figures.append(b_cop.display('names'))
-
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-")
-
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = red_MAST_playouts
-            board.transposition_table.win_MAST = red_MAST_wins
-            chosen_move_red = best_move_GRAVE(b_cop, dice_score, nb_playouts, treshold=treshold1, mode=1, mast_param=0.25)
-            b_cop.play(chosen_move_red)
-
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-")
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = blue_MAST_playouts
-            board.transposition_table.win_MAST = blue_MAST_wins
-            chosen_move_blue = best_move_GRAVE(b_cop, dice_score, nb_playouts, treshold=treshold2, mode=1, mast_param=0.25)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-
-        end_time = time.perf_counter()
-
-        sum_wins[b_cop.winner] += 1
-        print(f" game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE")
-        pprint.pprint(sum_wins)
-        if save_gif is True:
-            figs2gif(figures, name=f"GRAVE{treshold1}xGRAVE{treshold2}_{nb_playouts}plyt_game{g + 1}_pid{os.getpid()}.gif")
-
-        with open(f"sum_wins_{nb_playouts}plyt_GRAVE{treshold1}xGRAVE{treshold2}_{g+1}games_pid{os.getpid()}.pkl", "wb") as f:
-            pickle.dump(sum_wins, f)
-
-def RAVE_vs_GRAVE(board, nb_playouts, nb_games, treshold, save_gif=False):
-    sum_wins = {RED: 0, BLUE: 0}
-    red_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    red_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    blue_MAST_wins = copy.deepcopy(board.transposition_table.win_MAST)
-    blue_MAST_playouts = copy.deepcopy(board.transposition_table.playouts_MAST)
-
-    for g in range(nb_games):
-        figures = []
-        b_cop = board.copy()
-        print("Game " + str(g + 1) + " RAVE_vs_GRAVE")
-        start_time = time.perf_counter()
-        if save_gif is True:
-            figures.append(b_cop.display('names'))
-
-        while not b_cop.over:
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = red_MAST_playouts
-            board.transposition_table.win_MAST = red_MAST_wins
-            chosen_move_red = best_move_RAVE(b_cop, dice_score, nb_playouts, mode=1, mast_param=0.25)
-            b_cop.play(chosen_move_red)
-
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-            if b_cop.over:
-                break
-
-            if b_cop.game_time % 5 == 0:
-                print(f"{b_cop.game_time}-", end="")
-            dice_score = random.randint(1, board.map.max_dice)
-            board.transposition_table.playouts_MAST = blue_MAST_playouts
-            board.transposition_table.win_MAST = blue_MAST_wins
-            chosen_move_blue = best_move_GRAVE(b_cop, dice_score, nb_playouts, treshold=treshold, mode=1, mast_param=0.25)
-            b_cop.play(chosen_move_blue)
-            if save_gif is True:
-                figures.append(b_cop.display('names'))
-
-        end_time = time.perf_counter()
-
-        sum_wins[b_cop.winner] += 1
-        print(f" game_time : {b_cop.game_time} - ({round((end_time - start_time) / 60, 0)}min)")
-        print("WINS : ")
-        print("RED  -  BLUE")
-        pprint.pprint(sum_wins)
-        if save_gif is True:
-            figs2gif(figures, name=f"RAVE-UCT-UCT_{nb_playouts}plyt_game{g+1}_pid{os.getpid()}.gif")
-
-        with open(f"sum_wins_{nb_playouts}plyt_RAVExGRAVE_{g+1}games_pid{os.getpid()}.pkl", "wb") as f:
-            pickle.dump(sum_wins, f)
+def GRAVE_vs_GRAVE(board: Board, nb_playouts, nb_games, treshold1, treshold2, save_gif=False, nb_workers=1,
+                   mast_store=None):
+    agents = [Agent('GRAVE', nb_playouts, name=f'GRAVE{treshold1}', treshold=treshold1, mode=1, mast_param=0.25,
+                    beta_param=1e-5),
+              Agent('GRAVE', nb_playouts, name=f'GRAVE{treshold2}', treshold=treshold2, mode=1, mast_param=0.25,
+                    beta_param=1e-5)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=nb_games if save_gif else 0,
+                          name=f"GRAVE{treshold1}xGRAVE{treshold2}_{nb_playouts}plyt",
+                          results_path=f"results_{nb_playouts}plyt_GRAVE{treshold1}xGRAVE{treshold2}.jsonl")
+
+
+def RAVE_vs_GRAVE(board, nb_playouts, nb_games, treshold, save_gif=False, nb_workers=1, mast_store=None):
+    agents = [Agent('RAVE', nb_playouts, mode=1, mast_param=0.25),
+              Agent('GRAVE', nb_playouts, treshold=treshold, mode=1, mast_param=0.25, beta_param=1e-5)]
+    return run_tournament(board, agents, nb_games, nb_workers=nb_workers, mast_store=mast_store,
+                          save_gif=nb_games if save_gif else 0,
+                          name=f"RAVExGRAVE_{nb_playouts}plyt",
+                          results_path=f"results_{nb_playouts}plyt_RAVExGRAVE.jsonl")
 
 
 if __name__ == '__main__':
@@ -1,9 +1,13 @@
 import math
 import random
+import time
+from functools import partial
+from multiprocessing import Pool
 
 import numpy as np
 
 from src.board import Board
+from src.playout import run_playout
 from typing import List
 
 BLOCK = 0
@@ -30,17 +34,15 @@ def flat(board: Board, dice_score: int, nb_playout: int):
     for move in valid_moves:  # Pour chaque move, on fait un certain nombre de playout
         # et on va faire des stats sur ces derniers
         print("Evalutation de", move, end=" ")
-        sum_wins = 0
+        # Les playouts d'un même coup partent tous du même état : on les joue en parallèle
+        undo = board.play(move)
+        winners, played_sets = board.playout_batch(nb_playout, exploration_parameter=0.22)
+        board.unplay(undo)
 
-        for p in range(nb_playout):
-            b = board.copy()
-            b.play(move)
-            played = []
-            winner = b.playout_MAST(played, exploration_parameter=0.22)
-            board.update_MAST(winner, played)
+        for winner, played in zip(winners, played_sets):
+            board.update_MAST(int(winner), played)
 
-            if winner == move.player:
-                sum_wins += 1
+        sum_wins = int(np.sum(winners == move.player))
 
         score = sum_wins / nb_playout
 
@@ -53,7 +55,9 @@ def flat(board: Board, dice_score: int, nb_playout: int):
     return best_move
 
 
-def UCB(board: Board, dice_score, nb_playouts):  # Ici nb_playouts est le nombre TOTAL de playouts qu'on va faire
+def UCB(board: Board, dice_score, nb_playouts, batch_size=1):
+    # Ici nb_playouts est le nombre TOTAL de playouts qu'on va faire. Avec batch_size > 1, chaque coup choisi par UCB
+    # est évalué par batch_size playouts joués en parallèle (Board.playout_batch).
     valid_moves = board.valid_moves(dice_score)  # On veut faire des statistiques sur chacun de ces coups
 
     # Il faut faire une extension des coups pour pouvoir faire des stats sur les coups qui bougent des blocs.
@@ -61,7 +65,8 @@ def UCB(board: Board, dice_score, nb_playouts):  # Ici nb_playouts est le nombre
     sums = [0 for i in range(len(valid_moves))]
     nb_visits = [0 for i in range(len(valid_moves))]
 
-    for p in range(nb_playouts):
+    p = 0  # Nombre de playouts déjà faits
+    while p < nb_playouts:
         best_score = -1
         best_moves = []
 
@@ -86,18 +91,26 @@ def UCB(board: Board, dice_score, nb_playouts):  # Ici nb_playouts est le nombre
 
         chosen_move = random.choice(best_moves)
 
-        b = board.copy()
-        b.play(valid_moves[chosen_move])
+        undo = board.play(valid_moves[chosen_move])
+
+        # Puis faire les playouts et récupérer les résultats
+        size = min(batch_size, nb_playouts - p)
+        if size == 1:
+            played = []
+            winners = [run_playout(board, played, exploration_parameter=0.2)]
+            played_sets = [played]
+        else:
+            winners, played_sets = board.playout_batch(size, exploration_parameter=0.2)
+        board.unplay(undo)
 
-        # Puis faire un playout et récupérer le résultat
-        played = []
-        winner = b.playout_MAST(played, exploration_parameter=0.2)
-        board.update_MAST(winner, played)  # On met à jour la table pour les prochains playouts
+        for winner, played in zip(winners, played_sets):
+            board.update_MAST(int(winner), played)  # On met à jour la table pour les prochains playouts
 
-        # Et save les stats
-        if winner == board.turn:
-            sums[chosen_move] += 1
-        nb_visits[chosen_move] += 1
+            # Et save les stats
+            if winner == board.turn:
+                sums[chosen_move] += 1
+        nb_visits[chosen_move] += size
+        p += size
 
     print(nb_visits)
     print(sums)
@@ -109,75 +122,276 @@ def UCB(board: Board, dice_score, nb_playouts):  # Ici nb_playouts est le nombre
     return valid_moves[np.argmax(nb_visits)]
 
 
-# Algorithme UCT
-def UCT(board: Board, dice_score, played_moves_codes, mode=1, c=0.4, mast_param=0.5):
-    if board.over:  # Si l'état est terminal on renvoie le score.
-        return board.winner
-
-    # sinon on récupère l'entrée dans la table de transposition.
-    t = board.look_table()
-
-    if t != None:  # Si différent de None alors l'entrée est déjà présente. On va faire UCB dessus
-        best_score = -1
-        # print(f"Etat déja vu {t[0]} fois")
-        # On récupère la liste des coups légaux
-        moves = board.valid_moves(dice_score)
-
-        if len(moves) == 0:
-            board.play(None)
-            winner = UCT(board, random.randint(1, board.map.max_dice), played_moves_codes, mode, c)
-            t[0] += 1  # On a bien vu l'etat mais on a joué aucun coup
-            return winner
-
+def roll_dice(board: Board, stratified_dice=False):
+    """
+    Lancer de dé au noeud de hasard de board, avant le coup du joueur qui a le trait. Chaque lancer mène à son propre
+    noeud de décision dans la table (voir Table.key).
+    :param stratified_dice : Si True, on tire parmi les lancers dont le noeud de décision a été le moins visité :
+    sur plusieurs simulations, chaque valeur du dé est explorée à sa fréquence (uniforme) au lieu d'être tirée au
+    hasard.
+    """
+    if not stratified_dice:
+        return random.randint(1, board.map.max_dice)
+    visits = [board.transposition_table.visits(board, dice) for dice in range(1, board.map.max_dice + 1)]
+    least = min(visits)
+    return random.choice([dice + 1 for dice in range(len(visits)) if visits[dice] == least])
+
+
+def widened_moves(board: Board, moves, t, widening):
+    """
+    Indices des coups de moves (noeud de décision t) que la sélection peut considérer.
+    Avec l'élargissement progressif (widening = (pw_c, pw_alpha)), les coups qui déplacent un même block (même case
+    de départ et d'arrivée, un coup par placement possible) forment un groupe dont seuls les
+    max(1, pw_c * n ** pw_alpha) premiers placements sont candidats, n étant le nombre de passages par le groupe.
+    Les placements déjà essayés passent en premier, puis les autres par taux de victoire MAST décroissant du joueur.
+    Les coups sans block sont toujours candidats.
+    """
+    if widening is None:
+        return np.arange(len(moves))
+    pw_c, pw_alpha = widening
+
+    candidates = []
+    groups = {}
+    for m, move in enumerate(moves):
+        if move.block:
+            groups.setdefault((move.start_node, move.end_node), []).append(m)
         else:
-            player = moves[0].player
-            best_moves = []
-            # On va choisir le move qui maximise UCB, sauf s'il y a des coups non essayés.
-            for m in range(len(moves)):
-                score = 1000000.0
-
-                if t[1][m] > 0:  # Si le nombre de fois que le coup a été joué est supérieur à 0
-                    Q = t[2][m][player] / t[1][m]  # Calcul du nombre de victoires moyenne du joueur actuel
-
-                    score = Q + c * math.sqrt(math.log(t[0]) / t[1][m])  # Formule UCB
-
-                if score > best_score:
-                    best_score = score
-                    best_moves = [m]
-                elif score == best_score:
-                    best_moves.append(m)
-
-            # On joue un des meilleurs coups selon UCB
-            choice = random.choice(best_moves)
-            board.play(moves[choice])
-            played_moves_codes.append(moves[choice].code(board.map))
-
-            # Puis on fait un appel récursif pour le nouveau board avec un lancer de dé aléatoire
+            candidates.append(m)
+
+    player = moves[0].player
+    for group in groups.values():
+        n = sum(t[1][m] for m in group)
+        width = max(1, int(pw_c * n ** pw_alpha))
+        if width >= len(group):
+            candidates += group
+            continue
+        rates = board.transposition_table.mast_rates([moves[m].code(board.map) for m in group], player)
+        order = sorted(range(len(group)), key=lambda i: (t[1][group[i]] == 0, -rates[i]))
+        candidates += [group[i] for i in order[:width]]
+    return np.array(candidates)
+
+
+def select_UCB(t, candidates, player, c):
+    """
+    Indice du coup choisi par UCB parmi candidates (tableau d'indices de coups du noeud t), en une seule expression
+    vectorisée sur les statistiques du noeud. Les coups jamais essayés ont le score 1000000, ils passent en premier.
+    Les meilleurs scores sont départagés au hasard.
+    """
+    visits = t[1][candidates]
+    tried = visits > 0
+    scores = np.full(len(candidates), 1000000.0)
+    if tried.any():  # Taux de victoire du joueur + terme d'exploration
+        scores[tried] = t[2][candidates[tried], player] / visits[tried] + c * np.sqrt(math.log(t[0]) / visits[tried])
+    return int(candidates[random.choice(np.flatnonzero(scores == scores.max()))])
+
+
+def select_RAVE(t, candidates, player, beta_param, n_amaf, win_amaf):
+    """
+    Indice du coup choisi par RAVE parmi candidates (tableau d'indices de coups du noeud t) : le score
+    (1 - beta) * Q + beta * Q2 mélange le taux de victoire Q du coup (1 s'il n'a jamais été joué) et son taux de
+    victoire AMAF Q2 = win_amaf / n_amaf, avec le beta du papier de RAVE. Les coups sans statistique AMAF ont le score
+    100000. Les meilleurs scores sont départagés au hasard.
+    :param n_amaf, win_amaf : nombre de playouts AMAF de chaque candidat et victoires AMAF de player
+    """
+    scores = np.full(len(candidates), 100000.0)
+    seen = n_amaf > 0
+    moves, n_amaf, win_amaf = candidates[seen], n_amaf[seen], win_amaf[seen]
+    visits = t[1][moves]
+    beta = n_amaf / (visits + n_amaf + beta_param * visits * n_amaf)
+    Q = np.ones(len(moves))  # Valeur par défaut pour t[2] / t[1]
+    tried = visits > 0
+    Q[tried] = t[2][moves[tried], player] / visits[tried]  # Le taux de victoire "réel"
+    scores[seen] = (1.0 - beta) * Q + beta * (win_amaf / n_amaf)
+    return int(candidates[random.choice(np.flatnonzero(scores == scores.max()))])
+
+
+# Coeur de recherche commun à UCT, UCT_pas_MAST, RAVE et GRAVE : une simulation descend l'arbre sans récursion en
+# enregistrant son chemin, puis remonte le résultat le long de ce chemin. Les algorithmes ne diffèrent que par leur
+# politique de sélection (ucb_policy, rave_policy, grave_policy) et par les statistiques AMAF.
+
+
+def ucb_policy(board: Board, t, moves, codes, tref, c=0.4, widening=None):
+    # Sélection UCT : le coup qui maximise UCB, sauf s'il y a des coups non essayés
+    return select_UCB(t, widened_moves(board, moves, t, widening), moves[0].player, c)
+
+
+def rave_policy(board: Board, t, moves, codes, tref, beta_param=1e-5, widening=None):
+    # Sélection RAVE avec les statistiques AMAF du noeud
+    candidates = widened_moves(board, moves, t, widening)
+    player = moves[0].player
+    amaf = board.transposition_table.amaf_stats(t, codes[candidates])
+    return select_RAVE(t, candidates, player, beta_param, amaf[:, 0], amaf[:, player])
+
+
+def grave_policy(board: Board, t, moves, codes, tref, beta_param=1e-5, widening=None):
+    # Sélection GRAVE : comme RAVE, mais le nombre de playouts AMAF est lu dans le noeud de référence tref
+    candidates = widened_moves(board, moves, t, widening)
+    player = moves[0].player
+    n_amaf_ref = board.transposition_table.amaf_stats(tref, codes[candidates])[:, 0]
+    win_amaf_ref = board.transposition_table.amaf_stats(t, codes[candidates])[:, player]
+    return select_RAVE(t, candidates, player, beta_param, n_amaf_ref, win_amaf_ref)
+
+
+def descend(board: Board, dice_score, played_moves_codes, policy, amaf, mode, mast_param, stratified_dice=False,
+            tref=None, treshold=None):
+    """
+    Descente d'une simulation, sans récursion : à chaque noeud de décision déjà dans la table, policy choisit le coup
+    joué, puis on lance le dé du joueur suivant. Au premier noeud absent de la table, on ajoute son entrée et on finit
+    la partie par un playout. Les coups joués sont annulés à la fin : board retrouve son état.
+    :param policy : fonction (board, t, moves, codes, tref) -> indice du coup choisi dans moves
+    :param amaf : Si True, les entrées ajoutées ont des statistiques AMAF (RAVE, GRAVE)
+    :param mast_param : température de la politique MAST du playout (None pour un playout uniforme)
+    :param tref, treshold : noeud de référence de GRAVE, remplacé par le noeud courant dès que celui-ci a été visité
+    plus de treshold fois (treshold None : tref n'est jamais remplacé)
+    :return : (vainqueur, chemin) où le chemin est la liste des (entrée, indice du coup, code du coup) des noeuds
+    traversés, avec None comme indice et comme code quand le joueur n'avait aucun coup et a passé son tour
+    """
+    table = board.transposition_table
+    table.start_descent()
+    path = []
+    undos = []
+    while not board.over:
+        t = board.look_table(dice_score)
+        if t is None:  # Noeud jamais visité : on l'ajoute à la table et on termine par un playout
+            board.new_table_entry(amaf=amaf, dice_score=dice_score)
+            # Le noyau de playout ne modifie pas le board, pas besoin de le copier
+            winner = run_playout(board, played_moves_codes, exploration_parameter=mast_param, mode=mode)
+            break
+
+        if treshold is not None and t[0] > treshold:
+            tref = t
+        moves, codes = table.valid_moves(board, dice_score, with_codes=True)  # Coups légaux, calculés une seule fois
+        table.grow(t, len(moves))  # Les stats de l'entrée doivent couvrir tous les coups
+        if len(moves) == 0:  # On a bien vu l'état mais on ne joue aucun coup
+            undos.append(board.play(None))
+            path.append((t, None, None))
+        else:
+            choice = policy(board, t, moves, codes, tref)
+            undos.append(board.play(moves[choice]))
+            played_moves_codes.append(int(codes[choice]))
+            path.append((t, choice, int(codes[choice])))
+        dice_score = roll_dice(board, stratified_dice)
+    else:  # Etat terminal
+        winner = board.winner
+
+    for undo in reversed(undos):  # Le board retrouve son état, on peut réutiliser la même instance
+        board.unplay(undo)
+    return winner, path
+
+
+def backup(table, path, winner, played_moves_codes, amaf):
+    """
+    Remonte le résultat d'une simulation le long de son chemin (voir descend), du noeud le plus profond à la racine.
+    """
+    for t, choice, code in reversed(path):
+        t[0] += 1  # Nb de fois qu'on a vu l'état
+        if choice is not None:
+            t[1][choice] += 1  # Nb de playouts qui commencent par ce coup
+            t[2][choice, winner] += 1  # Nb de victoires du vainqueur pour ce coup
+            if amaf:
+                table.update_AMAF(t, winner, played_moves_codes)  # On met à jour les statistiques AMAF
 
-            winner = UCT(board, random.randint(1, board.map.max_dice), played_moves_codes, mode,
-                         c)  # On obtiendra un résultat sur ce board
 
-            # On l'utilise pour mettre à jour les statistiques du meilleur coup.
+def simulate(board: Board, dice_score, played_moves_codes, policy, amaf, mode, mast_param, stratified_dice=False,
+             tref=None, treshold=None):
+    # Une simulation complète (descend puis backup), qui retourne le vainqueur
+    winner, path = descend(board, dice_score, played_moves_codes, policy, amaf, mode, mast_param, stratified_dice,
+                           tref, treshold)
+    backup(board.transposition_table, path, winner, played_moves_codes, amaf)
+    return winner
 
-            t[0] += 1  # Nb de fois qu'on a vu l'état
-            t[1][choice] += 1  # Nb de playouts qui commencent par ce coup
-            t[2][choice][winner] += 1  # Nb de victoires de RED pour ce coup
-            # Et on le remonte aux étapes récursives précédentes.
-            return winner
 
-    else:  # Si l'etat n'a jamais été visité, on ajoute juste l'état dans la table et on retourne le résultat d'un
-        # playout
-        board.new_table_entry(amaf=False)
-        winner = board.playout_MAST(played_moves_codes, exploration_parameter=mast_param, mode=mode)
-        return winner
+# Algorithme UCT
+def UCT(board: Board, dice_score, played_moves_codes, mode=1, c=0.4, mast_param=0.5, stratified_dice=False,
+        widening=None):
+    return simulate(board, dice_score, played_moves_codes, partial(ucb_policy, c=c, widening=widening), False, mode,
+                    mast_param, stratified_dice)
+
+
+def budget_left(board: Board, nb_simulations, nb_playouts, deadline, max_nodes):
+    """
+    Indique s'il reste du budget pour une simulation de plus.
+    :param nb_playouts : nombre maximum de simulations (None pour ne pas limiter)
+    :param deadline : instant (time.perf_counter) après lequel on ne lance plus de simulation (None pour ne pas limiter)
+    :param max_nodes : nombre maximum d'entrées dans la table de transposition (None pour ne pas limiter)
+    """
+    if nb_playouts is not None and nb_simulations >= nb_playouts:
+        return False
+    if deadline is not None and time.perf_counter() >= deadline:
+        return False
+    if max_nodes is not None and len(board.transposition_table.table) >= max_nodes:
+        return False
+    return True
+
+
+def check_budget(board: Board, nb_playouts, time_budget, max_nodes):
+    """
+    Vérifie que les simulations s'arrêteront (voir budget_left) : il faut nb_playouts ou time_budget, ou à défaut un
+    max_nodes que la table de board peut atteindre. Une table bornée supprime des entrées quand elle est pleine : son
+    nombre d'entrées reste sous max_entries (et sous ce que permet max_bytes), max_nodes ne suffit donc pas avec une
+    table bornée par max_bytes ou avec max_nodes >= max_entries.
+    """
+    if nb_playouts is not None or time_budget is not None:
+        return True
+    if max_nodes is None:
+        print("Il faut un budget pour la recherche : nb_playouts, time_budget ou max_nodes")
+        return False
+    table = board.transposition_table
+    if table.max_bytes is not None or (table.max_entries is not None and max_nodes >= table.max_entries):
+        print("La table bornée n'atteindra jamais max_nodes entrées : il faut nb_playouts ou time_budget")
+        return False
+    return True
+
+
+def most_simulated_move(board: Board, moves, stats, nb_simulations, start_time):
+    """
+    Retourne le coup le plus simulé à la racine (en départageant au hasard) et remplit stats s'il n'est pas None :
+    nombre de simulations, durée, nombre d'entrées de la table, visites et victoires de chaque coup de la racine,
+    compteurs de la table (Table.counters).
+    """
+    dice_score = moves[0].dice_score
+    t = board.look_table(dice_score)  # On récup la racine de l'arbre dans la table
+    if t is None:  # Le budget a été épuisé avant que la racine soit ajoutée
+        board.new_table_entry(amaf=False, nb_moves=len(moves), dice_score=dice_score)
+        t = board.look_table(dice_score)
+    board.transposition_table.grow(t, len(moves))
+
+    # Et on va prendre le coup le plus simulé c'est à dire celui qui a le nombre de playouts le plus grand !
+    best_value = max(t[1][:len(moves)])
+    best_moves = [m for m in range(len(moves)) if t[1][m] == best_value]
+
+    if stats is not None:
+        stats['simulations'] = nb_simulations
+        stats['time'] = time.perf_counter() - start_time
+        stats['nodes'] = len(board.transposition_table.table)
+        stats['visits'] = t[1][:len(moves)].tolist()
+        stats['wins'] = board.transposition_table.wins_by_color(t, len(moves))
+        stats['table'] = board.transposition_table.counters()
+    return moves[random.choice(best_moves)]
 
 
 # La fonction prend en paramètre un état et un nombre de simulations et qui va renvoyer
 # le meilleur coup calculé grâce à UCT
 
 
-def best_move_UCT(board: Board, dice_score, nb_playouts, mode=1, c=0.4, mast_param=0.5):
-    board.transposition_table.table = {}
+def best_move_UCT(board: Board, dice_score, nb_playouts, mode=1, c=0.4, mast_param=0.5, nb_workers=1, pool=None,
+                  seed=None, time_budget=None, max_nodes=None, stats=None, reuse_tree=False, max_age=2,
+                  stratified_dice=False, widening=None):
+    """
+    Avec nb_workers > 1, la recherche est parallélisée à la racine (voir root_parallel).
+    Les simulations s'arrêtent dès qu'un des budgets est épuisé (voir budget_left) : nb_playouts simulations (None pour
+    ne pas limiter), time_budget secondes ou max_nodes entrées dans la table. Il faut au moins un budget qui sera
+    atteint, sinon la fonction affiche un message et retourne None (voir check_budget). Si stats est un dictionnaire, il est
+    rempli avec les statistiques de la recherche (voir most_simulated_move).
+    Avec reuse_tree, la table de la recherche précédente est conservée (voir Table.new_search, max_age est l'âge
+    au-delà duquel une entrée est supprimée). La recherche parallèle à la racine repart toujours d'une table vide.
+    Avec stratified_dice, les lancers de dé des noeuds de hasard sont équilibrés (voir roll_dice).
+    Avec widening = (pw_c, pw_alpha), les placements de block sont ajoutés progressivement (voir widened_moves).
+    """
+    start_time = time.perf_counter()
+    if not check_budget(board, nb_playouts, time_budget, max_nodes):
+        return None
+    board.transposition_table.new_search(reuse_tree and nb_workers == 1, max_age)
     # Les coups sont toujours retournés dans le même ordre pour un état de plateau donné.
     moves = board.valid_moves(dice_score)
 
@@ -185,103 +399,38 @@ def best_move_UCT(board: Board, dice_score, nb_playouts, mode=1, c=0.4, mast_par
         print("Pas de coups possibles")
         return None
     elif len(moves) == 1:
-        return moves[0]
+        return most_simulated_move(board, moves, stats, 0, start_time)
 
-    for i in range(nb_playouts):  # On fait n simulations
-        b1 = board.copy()
+    deadline = None if time_budget is None else start_time + time_budget
+    if nb_workers > 1:
+        return root_parallel(best_move_UCT, board, dice_score, moves, nb_playouts, nb_workers, pool, seed,
+                             mode=mode, c=c, mast_param=mast_param, stratified_dice=stratified_dice, widening=widening,
+                             deadline=deadline, max_nodes=max_nodes, stats=stats)
+
+    nb_simulations = 0
+    # On fait des simulations tant qu'il reste du budget, toutes sur la même instance de board
+    while budget_left(board, nb_simulations, nb_playouts, deadline, max_nodes):
         played_moves_codes = []
-        winner = UCT(b1, dice_score, played_moves_codes, mode, c, mast_param)  # On obtient un résultat.
+        # On obtient un résultat.
+        winner = UCT(board, dice_score, played_moves_codes, mode, c, mast_param, stratified_dice, widening)
         board.update_MAST(winner, played_moves_codes)
+        nb_simulations += 1
 
-    # Donc là on a fait n playout en ajoutant à chaque fois un état dans l'abre c'est à dire dans la table
-    # de transposition.
-
-    # Il faut maintenant récupérer le coup le plus simulé
-
-    t = board.look_table()  # On récup la racine de l'arbre dans la table
-
-    # Et on va prendre le coup le plus simulé c'est à dire celui qui a le nombre de playouts
-    # le plus grand !
-
-    best_moves = []
-    best_value = 0
-
-    for m in range(len(moves)):
-        # print('Pour', moves[m], ':', t[1][m], 'playout')
-        if t[1][m] > best_value:
-            best_value = t[1][m]
-            best_moves = [m]
-
-        if t[1][m] == best_value:
-            best_moves.append(m)
-    # print("La table contient :", len(board.transposition_table.table))
-    return moves[random.choice(best_moves)]
-
+    return most_simulated_move(board, moves, stats, nb_simulations, start_time)
 
-def UCT_pas_MAST(board: Board, dice_score, played_moves_codes, mode=1, c=0.4):
-    if board.over:  # Si l'état est terminal on renvoie le score.
-        return board.winner
 
-    # sinon on récupère l'entrée dans la table de transposition.
-    t = board.look_table()
-
-    if t != None:  # Si différent de None alors l'entrée est déjà présente. On va faire UCB dessus
-        best_score = -1
-        # print(f"Etat déja vu {t[0]} fois")
-        # On récupère la liste des coups légaux
-        moves = board.valid_moves(dice_score)
-
-        if len(moves) == 0:
-            board.play(None)
-            winner = UCT(board, random.randint(1, board.map.max_dice), played_moves_codes, mode, c)
-            t[0] += 1  # On a bien vu l'etat mais on a joué aucun coup
-            return winner
-
-        else:
-            player = moves[0].player
-            best_moves = []
-            # On va choisir le move qui maximise UCB, sauf s'il y a des coups non essayés.
-            for m in range(len(moves)):
-                score = 1000000.0
-
-                if t[1][m] > 0:  # Si le nombre de fois que le coup a été joué est supérieur à 0
-                    Q = t[2][m][player] / t[1][m]  # Calcul du nombre de victoires moyenne du joueur actuel
-
-                    score = Q + c * math.sqrt(math.log(t[0]) / t[1][m])  # Formule UCB
-
-                if score > best_score:
-                    best_score = score
-                    best_moves = [m]
-                elif score == best_score:
-                    best_moves.append(m)
-
-            # On joue un des meilleurs coups selon UCB
-            choice = random.choice(best_moves)
-            board.play(moves[choice])
-            played_moves_codes.append(moves[choice].code(board.map))
-
-            # Puis on fait un appel récursif pour le nouveau board avec un lancer de dé aléatoire
-
-            winner = UCT(board, random.randint(1, board.map.max_dice), played_moves_codes, mode,
-                         c)  # On obtiendra un résultat sur ce board
-
-            # On l'utilise pour mettre à jour les statistiques du meilleur coup.
-
-            t[0] += 1  # Nb de fois qu'on a vu l'état
-            t[1][choice] += 1  # Nb de playouts qui commencent par ce coup
-            t[2][choice][winner] += 1  # Nb de victoires de RED pour ce coup
-            # Et on le remonte aux étapes récursives précédentes.
-            return winner
-
-    else:  # Si l'etat n'a jamais été visité, on ajoute juste l'état dans la table et on retourne le résultat d'un
-        # playout
-        board.new_table_entry(amaf=False)
-        winner = board.playout(mode=mode)
-        return winner
+def UCT_pas_MAST(board: Board, dice_score, played_moves_codes, mode=1, c=0.4, stratified_dice=False):
+    # UCT avec des playouts uniformes
+    return simulate(board, dice_score, played_moves_codes, partial(ucb_policy, c=c), False, mode, None,
+                    stratified_dice)
 
 
-def best_move_UCT_pas_MAST(board: Board, dice_score, nb_playouts, mode=1, c=0.4):
-    board.transposition_table.table = {}
+def best_move_UCT_pas_MAST(board: Board, dice_score, nb_playouts, mode=1, c=0.4, time_budget=None, max_nodes=None,
+                           stats=None, reuse_tree=False, max_age=2, stratified_dice=False):
+    start_time = time.perf_counter()
+    if not check_budget(board, nb_playouts, time_budget, max_nodes):
+        return None
+    board.transposition_table.new_search(reuse_tree, max_age)
     # Les coups sont toujours retournés dans le même ordre pour un état de plateau donné.
     moves = board.valid_moves(dice_score)
 
@@ -289,264 +438,195 @@ def best_move_UCT_pas_MAST(board: Board, dice_score, nb_playouts, mode=1, c=0.4)
         print("Pas de coups possibles")
         return None
     elif len(moves) == 1:
-        return moves[0]
+        return most_simulated_move(board, moves, stats, 0, start_time)
 
-    for i in range(nb_playouts):  # On fait n simulations
-        b1 = board.copy()
+    deadline = None if time_budget is None else start_time + time_budget
+    nb_simulations = 0
+    # On fait des simulations tant qu'il reste du budget, toutes sur la même instance de board
+    while budget_left(board, nb_simulations, nb_playouts, deadline, max_nodes):
         played_moves_codes = []
-        winner = UCT(b1, dice_score, played_moves_codes, mode, c)  # On obtient un résultat.
-
-    # Donc là on a fait n playout en ajoutant à chaque fois un état dans l'abre c'est à dire dans la table
-    # de transposition.
-
-    # Il faut maintenant récupérer le coup le plus simulé
-
-    t = board.look_table()  # On récup la racine de l'arbre dans la table
+        # On obtient un résultat.
+        winner = UCT_pas_MAST(board, dice_score, played_moves_codes, mode, c, stratified_dice)
+        nb_simulations += 1
 
-    # Et on va prendre le coup le plus simulé c'est à dire celui qui a le nombre de playouts
-    # le plus grand !
-
-    best_moves = []
-    best_value = 0
-
-    for m in range(len(moves)):
-        # print('Pour', moves[m], ':', t[1][m], 'playout')
-        if t[1][m] > best_value:
-            best_value = t[1][m]
-            best_moves = [m]
-
-        if t[1][m] == best_value:
-            best_moves.append(m)
-    # print("La table contient :", len(board.transposition_table.table))
-    return moves[random.choice(best_moves)]
+    return most_simulated_move(board, moves, stats, nb_simulations, start_time)
 
 
-def RAVE(board: Board, dice_score, played_moves_codes: List[int], mode, mast_param, beta_param=1e-5):
-    if board.over:
-        return board.winner
-
-    t = board.look_table()
-
-    if t is not None:
-        best_score = -1
-        moves = board.valid_moves(dice_score)
-
-        if len(moves) == 0:
-            board.play(None)
-            winner = RAVE(board, random.randint(1, board.map.max_dice), played_moves_codes, mode, mast_param, beta_param)
-            t[0] += 1
-            return winner
-
-        else:
-            player = moves[0].player
-            best_moves = []
-
-            for m in range(len(moves)):
-                score = 100000
-                move_code = moves[m].code(board.map)
+def RAVE(board: Board, dice_score, played_moves_codes: List[int], mode, mast_param, beta_param=1e-5,
+         stratified_dice=False, widening=None):
+    return simulate(board, dice_score, played_moves_codes, partial(rave_policy, beta_param=beta_param,
+                                                                    widening=widening),
+                    True, mode, mast_param, stratified_dice)
 
-                n_amaf = t[3][move_code]
-                win_amaf = t[4][move_code][player]
 
-                if n_amaf > 0:
-                    # C'est la formule du beta donnée dans le papier de RAVE
-
-                    beta = n_amaf / (t[1][m] + n_amaf + beta_param * t[1][m] * n_amaf)
-                    # print("beta :",beta)
-                    # print("nb de fois qu'il a été joué",t[1][m])
-                    # print("n_amaf :",n_amaf)
-
-                    Q = 1  # Valeur par défaut pour t[2] / t[1]
-                    if t[1][m] > 0:
-                        Q = t[2][m][player] / t[1][m]  # Le taux de victoire "réel"
-
-                    Q2 = win_amaf / n_amaf
-
-                    score = (1.0 - beta) * Q + beta * Q2
-
-                    # print("score :", score)
-
-                # if score == 100000:
-                #     print("stop")
-
-                if score > best_score:
-                    best_score = score
-                    best_moves = [m]
-                elif score == best_score:
-                    best_moves.append(m)
-
-            # On joue un des meilleurs coups en choisissant au hasard.
-            choice = random.choice(best_moves)
-            board.play(moves[choice])
-            played_moves_codes.append(moves[choice].code(board.map))
-
-            # On fait ensuite l'appel récursif comme dans UCT
-            winner = RAVE(board, random.randint(1, board.map.max_dice), played_moves_codes, mode, mast_param, beta_param)
-
-            # Et enfin on met à jour les statistiques avec le résultat
-
-            t[0] += 1  # Nb de fois qu'on a vu l'état
-            t[1][choice] += 1  # Nb de playouts qui commencent par ce coup
-            t[2][choice][winner] += 1  # Nb de victoires de RED pour ce coup
-            board.update_AMAF(t, winner, played_moves_codes)  # On met à jour les statistiques AMAF
-
-            return winner
-
-    else:  # Dans le cas ou l'état n'a jamais été vu :
-        board.new_table_entry(amaf=True)
-        winner = board.playout_MAST(played_moves_codes, exploration_parameter=mast_param, mode=mode)
-        return winner
-
-
-def best_move_RAVE(board, dice_score, nb_playouts, mode, mast_param, beta_param=1e-5):
-    board.transposition_table.table = {}
+def best_move_RAVE(board, dice_score, nb_playouts, mode, mast_param, beta_param=1e-5, nb_workers=1, pool=None,
+                   seed=None, time_budget=None, max_nodes=None, stats=None, reuse_tree=False, max_age=2,
+                   stratified_dice=False, widening=None):
+    start_time = time.perf_counter()
+    if not check_budget(board, nb_playouts, time_budget, max_nodes):
+        return None
+    board.transposition_table.new_search(reuse_tree and nb_workers == 1, max_age)
 
     moves = board.valid_moves(dice_score)
     if len(moves) == 0:
         print("Pas de coups possibles")
         return None
     elif len(moves) == 1:
-        return moves[0]
-
-    for i in range(nb_playouts):
-        b_cop = board.copy()  # La table de transposition est copiée par référence.
-        played_moves_codes = []
-        winner = RAVE(b_cop, dice_score, played_moves_codes, mode, mast_param, beta_param)
-        b_cop.update_MAST(winner, played_moves_codes)
-
-    t = board.look_table()
-
-    best_moves = []
-    best_value = 0
-
-    for m in range(len(moves)):
-        # print('Pour', moves[m], ':', t[1][m], 'playout')
-        if t[1][m] > best_value:
-            best_value = t[1][m]
-            best_moves = [m]
-
-        if t[1][m] == best_value:
-            best_moves.append(m)
-
-    best_move = moves[random.choice(best_moves)]
-    # print("Coup choisi : ", best_move)
-    return best_move
-
-
-def GRAVE(board: Board, dice_score, played_moves_codes: List[int], tref, treshold, mode, mast_param, beta_param):
-    if board.over:
-        return board.winner
-
-    t = board.look_table()
-
-    if t is not None:
-
-        tr = tref
-        if t[0] > treshold:
-            # Si dans l'entrée il y a déjà eu assez de playouts, alors on l'utilisera pour les stats et on le passera
-            # dans l'appel récursif.
-            tr = t
-        # Sinon, on utilisera tref
+        return most_simulated_move(board, moves, stats, 0, start_time)
 
-        # Ensuite c'est la même chose que pour RAVE sauf qu'au lieu d'utiliser les statistiques de t,
-        # on utilise les statistiques de tr
+    deadline = None if time_budget is None else start_time + time_budget
+    if nb_workers > 1:
+        return root_parallel(best_move_RAVE, board, dice_score, moves, nb_playouts, nb_workers, pool, seed,
+                             mode=mode, mast_param=mast_param, beta_param=beta_param, stratified_dice=stratified_dice,
+                             widening=widening, deadline=deadline, max_nodes=max_nodes, stats=stats)
 
-        best_score = -1
-        moves = board.valid_moves(dice_score)
-
-        if len(moves) == 0:
-            board.play(None)
-            winner = GRAVE(board, random.randint(1, board.map.max_dice), played_moves_codes,
-                           tr, treshold, mode, mast_param, beta_param)
-            t[0] += 1
-            return winner
-
-        else:
-            player = moves[0].player
-            best_moves = []
-
-            for m in range(len(moves)):
-                score = 100000
-                move_code = moves[m].code(board.map)
-
-                n_amaf_ref = tr[3][move_code]
-                win_amaf_ref = t[4][move_code][player]
-
-                if n_amaf_ref > 0:
-                    # C'est la formule du beta donnée dans le papier de RAVE
-
-                    beta = n_amaf_ref / (t[1][m] + n_amaf_ref + beta_param * t[1][m] * n_amaf_ref)
-
-                    Q = 1  # Valeur par défaut pour t[2] / t[1]
-                    if t[1][m] > 0:
-                        Q = t[2][m][player] / t[1][m]  # Le taux de victoire "réel"
-
-                    Q2 = win_amaf_ref / n_amaf_ref
-
-                    score = (1.0 - beta) * Q + beta * Q2
-
-                if score > best_score:
-                    best_score = score
-                    best_moves = [m]
-                elif score == best_score:
-                    best_moves.append(m)
-
-            # On joue un des meilleurs coups en choisissant au hasard.
-            choice = random.choice(best_moves)
-            board.play(moves[choice])
-            played_moves_codes.append(moves[choice].code(board.map))
-
-            # On fait ensuite l'appel récursif comme dans UCT
-            winner = GRAVE(board, random.randint(1, board.map.max_dice),played_moves_codes,
-                           tr, treshold, mode, mast_param, beta_param)
-
-            # Et enfin on met à jour les statistiques avec le résultat
+    nb_simulations = 0
+    while budget_left(board, nb_simulations, nb_playouts, deadline, max_nodes):
+        # RAVE annule les coups joués pendant la descente, on peut donc réutiliser board à chaque simulation.
+        played_moves_codes = []
+        winner = RAVE(board, dice_score, played_moves_codes, mode, mast_param, beta_param, stratified_dice, widening)
+        board.update_MAST(winner, played_moves_codes)
+        nb_simulations += 1
 
-            t[0] += 1  # Nb de fois qu'on a vu l'état
-            t[1][choice] += 1  # Nb de playouts qui commencent par ce coup
-            t[2][choice][winner] += 1  # Nb de victoires de RED pour ce coup
-            board.update_AMAF(t, winner, played_moves_codes)  # On met à jour les statistiques AMAF
+    return most_simulated_move(board, moves, stats, nb_simulations, start_time)
 
-            return winner
 
-    else:  # Dans le cas ou l'état n'a jamais été vu :
-        board.new_table_entry(amaf=True)
-        winner = board.playout_MAST(played_moves_codes, exploration_parameter=mast_param, mode=mode)
-        return winner
+def GRAVE(board: Board, dice_score, played_moves_codes: List[int], tref, treshold, mode, mast_param, beta_param,
+          stratified_dice=False, widening=None):
+    # Les statistiques AMAF utilisées sont celles de tref tant que le noeud n'a pas été visité plus de treshold fois
+    return simulate(board, dice_score, played_moves_codes, partial(grave_policy, beta_param=beta_param,
+                                                                    widening=widening),
+                    True, mode, mast_param, stratified_dice, tref, treshold)
 
 
-def best_move_GRAVE(board, dice_score, nb_playouts, treshold, mode, mast_param, beta_param):
-    board.transposition_table.table = {}
+def best_move_GRAVE(board, dice_score, nb_playouts, treshold, mode, mast_param, beta_param, nb_workers=1, pool=None,
+                    seed=None, time_budget=None, max_nodes=None, stats=None, reuse_tree=False, max_age=2,
+                    stratified_dice=False, widening=None):
+    start_time = time.perf_counter()
+    if not check_budget(board, nb_playouts, time_budget, max_nodes):
+        return None
+    board.transposition_table.new_search(reuse_tree and nb_workers == 1, max_age)
     moves = board.valid_moves(dice_score)
     if len(moves) == 0:
         print("Pas de coups possibles")
         return None
     elif len(moves) == 1:
-        return moves[0]
-
-    board.new_table_entry(amaf=True)
-    t = board.look_table()
-
-    for i in range(nb_playouts):
-        b_cop = board.copy()  # La table de transposition est copiée par référence.
+        return most_simulated_move(board, moves, stats, 0, start_time)
+
+    deadline = None if time_budget is None else start_time + time_budget
+    if nb_workers > 1:
+        return root_parallel(best_move_GRAVE, board, dice_score, moves, nb_playouts, nb_workers, pool, seed,
+                             treshold=treshold, mode=mode, mast_param=mast_param, beta_param=beta_param,
+                             stratified_dice=stratified_dice, widening=widening, deadline=deadline,
+                             max_nodes=max_nodes, stats=stats)
+
+    t = board.look_table(dice_score)
+    if t is None:
+        board.new_table_entry(amaf=True, nb_moves=len(moves), dice_score=dice_score)
+        t = board.look_table(dice_score)
+
+    nb_simulations = 0
+    while budget_left(board, nb_simulations, nb_playouts, deadline, max_nodes):
+        # GRAVE annule les coups joués pendant la descente, on peut donc réutiliser board à chaque simulation.
         played_moves_codes = []
-        winner = GRAVE(b_cop, dice_score, played_moves_codes, t, treshold, mode, mast_param, beta_param)
-        b_cop.update_MAST(winner, played_moves_codes)
-
-    t = board.look_table()
-
-    best_moves = []
-    best_value = 0
-
-    for m in range(len(moves)):
-        # print('Pour', moves[m], ':', t[1][m], 'playout')
-        if t[1][m] > best_value:
-            best_value = t[1][m]
-            best_moves = [m]
-
-        if t[1][m] == best_value:
-            best_moves.append(m)
-
-    best_move = moves[random.choice(best_moves)]
-    # print("Coup choisi : ", best_move)
-    return best_move
+        winner = GRAVE(board, dice_score, played_moves_codes, t, treshold, mode, mast_param, beta_param,
+                       stratified_dice, widening)
+        board.update_MAST(winner, played_moves_codes)
+        nb_simulations += 1
+
+    return most_simulated_move(board, moves, stats, nb_simulations, start_time)
+
+
+# Temps réservé (en secondes) au retour des résultats des processus et à leur fusion, avant l'échéance d'un coup
+MERGE_TIME = 0.05
+
+# Parallélisation à la racine : chaque processus construit son propre arbre à partir du même état et du même dé, puis
+# on additionne les statistiques de la racine pour choisir le coup le plus simulé.
+
+
+def root_parallel_worker(job):
+    """
+    Fait tourner best_move dans un processus et renvoie les statistiques de la racine et les incréments MAST (codes des
+    coups joués et incréments de playouts_MAST et win_MAST pour ces codes).
+    Doit rester une fonction du module pour pouvoir être envoyée aux processus du pool.
+    """
+    best_move, board, dice_score, nb_playouts, seed, time_budget, params = job
+    random.seed(seed)
+    np.random.seed(seed)
+    if time_budget is not None:  # Temps qui restait avant l'échéance du processus principal quand il a envoyé le job
+        params = dict(params, time_budget=time_budget)
+
+    table = board.transposition_table
+    playouts_MAST = table.playouts_MAST.copy()
+    win_MAST = table.win_MAST.copy()
+
+    stats = {}
+    best_move(board, dice_score, nb_playouts, stats=stats, **params)
+
+    # Seuls les coups joués pendant la recherche sont renvoyés : les tableaux MAST complets sont longs à transmettre
+    codes = np.flatnonzero(table.playouts_MAST != playouts_MAST)
+    t = board.look_table(dice_score)
+    return (t[1], t[2], codes, table.playouts_MAST[codes] - playouts_MAST[codes],
+            table.win_MAST[codes] - win_MAST[codes], stats['simulations'])
+
+
+def root_parallel(best_move, board: Board, dice_score, moves, nb_playouts, nb_workers, pool=None, seed=None,
+                  deadline=None, stats=None, **params):
+    """
+    Répartit nb_playouts simulations de best_move (best_move_UCT, best_move_RAVE ou best_move_GRAVE) entre nb_workers
+    processus et renvoie le coup le plus simulé d'après les statistiques de racine additionnées.
+    Les statistiques MAST apprises par les processus sont ajoutées à la table de board, et l'entrée de la racine
+    contient les statistiques fusionnées.
+    :param moves : les coups légaux de board pour dice_score (dans l'ordre de board.valid_moves)
+    :param pool : un multiprocessing.Pool à réutiliser d'un coup à l'autre, sinon un pool est créé pour l'appel
+    :param seed : graine à partir de laquelle sont tirées les graines des processus (tirée avec random si None)
+    :param deadline : instant (time.perf_counter de ce processus) auquel le coup doit être choisi (None pour ne pas
+    limiter). Le démarrage du pool est pris sur ce temps : les processus reçoivent comme budget le temps qui reste au
+    moment de l'envoi des jobs (les horloges de time.perf_counter ne sont pas comparables d'un processus à l'autre),
+    moins MERGE_TIME secondes pour laisser le temps de renvoyer et fusionner les résultats.
+    :param params : paramètres de best_move, dont le budget max_nodes qui s'applique à chaque processus
+    """
+    start_time = time.perf_counter()
+    if nb_playouts is not None:
+        nb_workers = min(nb_workers, nb_playouts)  # Chaque processus doit faire au moins une simulation
+    if seed is None:
+        seed = random.getrandbits(32)
+    seeds = np.random.SeedSequence(seed).generate_state(nb_workers)
+
+    def run_jobs(pool):
+        time_budget = None if deadline is None else max(0.0, deadline - MERGE_TIME - time.perf_counter())
+        # Chaque processus fait nb_playouts // nb_workers simulations, les premiers en font une de plus s'il en reste
+        jobs = [(best_move, board, dice_score,
+                 None if nb_playouts is None else nb_playouts // nb_workers + (i < nb_playouts % nb_workers),
+                 int(seeds[i]), time_budget, params) for i in range(nb_workers)]
+        return pool.map(root_parallel_worker, jobs)
+
+    if pool is None:
+        with Pool(nb_workers) as pool:
+            results = run_jobs(pool)
+    else:
+        results = run_jobs(pool)
+
+    table = board.transposition_table
+    board.new_table_entry(amaf=False, nb_moves=len(moves), dice_score=dice_score)
+    t = board.look_table(dice_score)
+    nb_simulations = 0
+    for nplayouts, nwins, codes, playouts_MAST, win_MAST, simulations in results:
+        nb_simulations += simulations
+        t[1] += nplayouts[:len(moves)]
+        t[2] += nwins[:len(moves)]
+        table.playouts_MAST[codes] += playouts_MAST
+        table.win_MAST[codes] += win_MAST
+    t[0] = t[1].sum()
+
+    best_value = max(t[1])
+    best_moves = [m for m in range(len(moves)) if t[1][m] == best_value]
+
+    if stats is not None:
+        stats['simulations'] = nb_simulations
+        stats['time'] = time.perf_counter() - start_time
+        stats['nodes'] = len(table.table)
+        stats['visits'] = t[1].tolist()
+        stats['wins'] = table.wins_by_color(t)
+        stats['table'] = table.counters()  # Compteurs de la table de ce processus, qui ne reçoit que la racine
+    return moves[random.Random(seed).choice(best_moves)]  # Le départage dépend aussi de la graine
@@ -1,6 +1,6 @@
 import copy
-import math
 import time
+from array import array
 
 import numpy as np
 
@@ -8,6 +8,7 @@ from src.map import Map
 from src.move import Move
 from src.utils import timeit, figs2gif
 from src.table import Table
+from src.playout import run_playout, run_playout_batch
 import networkx as nx
 import random
 import matplotlib.pyplot as plt
@@ -30,22 +31,15 @@ MAX_DICE = 3
 
 class Board:
 
-    def __init__(self, hash_table=None, hash_turn=None, mapp=Map("P22-D3-S34-v1")):
+    def __init__(self, hash_table=None, hash_turn=None, mapp=None):
 
-        self.hashcode = 0
+        if mapp is None:
+            mapp = Map(REF2)
 
-        if mapp.reference == "P22-D3-S34-v1":
-            self.piece_pools = {RED: ['a0', 2], BLUE: ['i0', 2]}
-            self.opponents = {RED: [BLUE],
+        self.hashcode = 0
 
-                              BLUE: [RED]}
-        elif mapp.reference == "P32-D3-S48-v1":
-            self.piece_pools = {RED: ['a0', 2], BLUE: ['i0', 2], GREEN: ['e0', 2]}
-            self.opponents = {
-                RED: [GREEN, BLUE],
-                GREEN: [RED, BLUE],
-                BLUE: [GREEN, RED]
-            }
+        self.piece_pools = {color: [node, mapp.nb_pieces] for color, node in mapp.pool_nodes.items()}
+        self.opponents = mapp.opponents
 
         self.turn = RED
 
@@ -55,98 +49,161 @@ class Board:
 
         self.winner = None  # On utilisera un dictionnaire pour stocker les victoires des joueurs
 
+        # Par défaut, on utilise les clés de Zobrist de la map
+        if hash_table is None or hash_turn is None:
+            hash_table, hash_turn = mapp.zobrist_keys()
         self.hash_table = hash_table
         self.hash_turn = hash_turn
 
         self.transposition_table = Table(mapp)
 
         self.map = mapp
-        self.board = mapp.get_board()
+        # Contenu des cases sous forme de vecteur d'entiers, indexé par mapp.node2index
+        self.contents = array('b', mapp.initial_contents)
+
+    @property
+    def board(self):
+        """
+        Graphe networkx reconstruit à partir du contenu actuel des cases (affichage, tests).
+        Les modifications faites sur ce graphe ne sont pas répercutées sur le plateau.
+        """
+        g = self.map.graph.copy()
+        for node, content in zip(self.map.nodes, self.contents):
+            g.nodes[node]['content'] = content
+        return g
 
     def next(self):
-        if self.map.reference == "P22-D3-S34-v1":
-            if self.turn == RED:
-                return BLUE
-            elif self.turn == BLUE:
-                return RED
-
-        elif self.map.reference == "P32-D3-S48-v1":
-            if self.turn == RED:
-                return GREEN
-            elif self.turn == GREEN:
-                return BLUE
-            elif self.turn == BLUE:
-                return RED
+        return self.map.next_player[self.turn]
 
     def get_content(self, node_name):
-        return self.board.nodes[node_name]['content']
+        return self.contents[self.map.node2index[node_name]]
 
     def change_content(self, node_name, new_content):
         if new_content not in [RED, BLUE, GREEN, BLOCK, GOAL, EMPTY]:
             print("Mauvaise valeur pour 'content' !, vous avez placé : ", new_content)
             raise BaseException
         else:
-            self.board.nodes[node_name]['content'] = new_content
+            self.contents[self.map.node2index[node_name]] = new_content
 
-    def look_table(self):
-        return self.transposition_table.look(self)
+    def signature(self):
+        """
+        Description compacte et exacte de l'état (contenu des cases, pools, tour), que la table peut comparer à celle
+        de l'entrée trouvée pour détecter les collisions de hashcode.
+        """
+        return self.contents.tobytes() + bytes([pool[1] for pool in self.piece_pools.values()] + [self.turn])
+
+    def look_table(self, dice_score=None):
+        return self.transposition_table.look(self, dice_score)
 
-    def new_table_entry(self, amaf: bool):
-        self.transposition_table.add(self, amaf)
+    def new_table_entry(self, amaf: bool, nb_moves=0, dice_score=None):
+        self.transposition_table.add(self, amaf, nb_moves, dice_score)
 
     def valid_moves(self, dice_score):
         """
         En fonction du score obtenu au dé, on veut récupérer l'ensemble des actions possibles. (le plus rapidement possible)
         """
-        # On a un ensemble d'actions possibles par pion de la couleur à qui c'est le tour de jouer
-
-        # On commence par récupérer les cases contenant un pion de la couleur
-        nodes_containing_pieces = [node for node, data in self.board.nodes(data=True) if data['content'] == self.turn]
+        # On a un ensemble d'actions possibles par pion de la couleur à qui c'est le tour de jouer.
+        # Les chemins sont précalculés par la map, il suffit de les filtrer selon les blocks et les occupants.
+        turn = self.turn
+        contents = self.contents
+        nodes = self.map.nodes
+        rows = self.map.rows
+        dice_paths = self.map.dice_paths
+        cell2start = self.map.cell2start
+        cell2end = self.map.cell2end
+        cell2placement = self.map.cell2placement
+        node2index = self.map.node2index
+        content2code = self.map.content2code
+        start_stride = self.map.start_stride
+        end_stride = self.map.end_stride
+        player_base = self.map.player2code[turn] * self.map.player_stride
 
         valid_moves = []
-        for piece in nodes_containing_pieces:
-            # Récupération de tous les chemins de taille <= dice_score qui partent de piece
-            target_paths = nx.single_source_shortest_path(self.board, piece, cutoff=dice_score)
-
-            for (target, path) in target_paths.items():
-                if len(path) == dice_score + 1:
-                    move = Move(player=self.turn,
-                                start_node=path[0],
-                                end_node=target,
-                                content_end_node=self.board.nodes[target]['content'],
-                                path=path,
-                                dice_score=dice_score)
-
-                    if move.is_valid(self):
-                        # Une fois que le move est validé, il faut spécifier où envoyer le block si c'est nécessaire
-
-                        if move.block is False:
-                            valid_moves.append(move)
-                        else:
-                            for placement in move.block_placements:
-                                cop = move.copy()
-                                cop.chosen_placement = placement
-                                valid_moves.append(cop)
+        block_placements = None  # Calculées seulement si un coup tombe sur un block
+
+        for start in range(self.map.nb_cells):
+            if contents[start] != turn:
+                continue
+
+            for end, path, path_names in dice_paths[start][dice_score]:
+                content_end = contents[end]
+
+                # On ne peut ni arriver sur un de ses pions, ni retourner dans les pools
+                if content_end == turn or rows[end] == 0:
+                    continue
+
+                # Le chemin ne doit pas être bloqué par un BLOCK
+                blocked = False
+                for i in path[1:-1]:
+                    if contents[i] == BLOCK:
+                        blocked = True
+                        break
+                if blocked:
+                    continue
+
+                base_code = player_base + cell2start[start] * start_stride + cell2end[end] * end_stride
+                move = Move(player=turn,
+                            start_node=nodes[start],
+                            end_node=nodes[end],
+                            content_end_node=content_end,
+                            path=path_names,
+                            dice_score=dice_score,
+                            code=base_code + content2code.get(content_end, 0))
+
+                if content_end != BLOCK:
+                    move.block = False
+                    valid_moves.append(move)
+                else:
+                    # Il faut spécifier où envoyer le block : toutes les cases vides sauf les 2 premières lignes,
+                    # plus la case de départ du pion (seulement s'il est sur la troisième ligne ou plus)
+                    if block_placements is None:
+                        block_placements = [nodes[i] for i in self.map.placement_cells if contents[i] == EMPTY]
+                    move.block = True
+                    move.block_placements = block_placements + [nodes[start]] if rows[start] >= 2 \
+                        else block_placements
+
+                    # Une variante légère par placement, qui partage le chemin et la liste des placements
+                    for placement in move.block_placements:
+                        valid_moves.append(move.with_placement(placement,
+                                                               base_code + cell2placement[node2index[placement]]))
 
         return valid_moves
 
-    def play(self, move: Union[Move, None]):  # On joue le coup et on modifie le hashcode en fonction.
+    def play(self, move: Union[Move, None]):
+        """
+        On joue le coup et on modifie le hashcode en fonction.
+        Retourne un enregistrement d'annulation à passer à Board.unplay pour revenir à l'état précédent
+        (None si le coup n'a pas pu être joué).
+        """
+        # Etat à restaurer : (index, ancien contenu) pour chaque case modifiée et (couleur, ancien nombre de pièces)
+        # pour chaque pool modifié.
+        changed_cells = []
+        changed_pools = []
+        undo = (changed_cells, changed_pools, self.turn, self.game_time, self.over, self.winner, self.hashcode)
 
         if move is not None:  # le move peut valoir None lorsqu'il n'y a pas de coup possible.
             # On commence par enlever la pièce qui bouge de sa place de départ.
             if move.block and move.chosen_placement is None:
                 print("Erreur : pas de destination spécifiée pour le block")
-                return 1
+                return None
+
+            contents = self.contents
+            node2index = self.map.node2index
+            start_index = node2index[move.start_node]
+            end_index = node2index[move.end_node]
 
-            if move.start_node[1] == '0':  # Si le move est initié d'un pool
+            if self.map.rows[start_index] == 0:  # Si le move est initié d'un pool
                 # On met d'abord correctement à jour le hashcode avec le nombre de pièce présentes dans le pool.
                 self.hashcode = self.hashcode ^ self.hash_table[move.start_node][self.piece_pools[self.turn][1]]
+                changed_pools.append((self.turn, self.piece_pools[self.turn][1]))
                 self.piece_pools[self.turn][1] -= 1  # Qu'on décrémente ensuite
 
                 if self.piece_pools[self.turn][1] == 0:
-                    self.change_content(move.start_node, EMPTY)
+                    changed_cells.append((start_index, contents[start_index]))
+                    contents[start_index] = EMPTY
             else:
-                self.change_content(move.start_node, EMPTY)
+                changed_cells.append((start_index, contents[start_index]))
+                contents[start_index] = EMPTY
 
                 # On retire donc le hashcode de la pièce de départ
                 self.hashcode = self.hashcode ^ self.hash_table[move.start_node][move.player]
@@ -161,13 +218,11 @@ class Board:
 
             if move.content_end_node in opponent_color:
                 opponent_pool_node = self.piece_pools[move.content_end_node][0]
-                # On enlève la pièce
-                self.change_content(move.end_node, EMPTY)  # Ligne possiblement inutile
+                opponent_pool_index = node2index[opponent_pool_node]
                 # On actualise le hash_code
                 self.hashcode = self.hashcode ^ self.hash_table[move.end_node][move.content_end_node]
-                if move.content_end_node not in opponent_color:
-                    print("Bizarre, la valeur de move.content_end_node a changé")
                 # Puis on replace la pièce dans son pool
+                changed_pools.append((move.content_end_node, self.piece_pools[move.content_end_node][1]))
                 self.piece_pools[move.content_end_node][
                     1] += 1  # On incrémente le nombre de pièces présentes dans le pool
                 # On actualise le hashcode en utilisant cette valeur
@@ -175,24 +230,25 @@ class Board:
                 self.hashcode = self.hashcode ^ self.hash_table[opponent_pool_node][
                     self.piece_pools[move.content_end_node][1]]
 
-                self.change_content(opponent_pool_node, move.content_end_node)  # On met une pièce sur la case.
+                changed_cells.append((opponent_pool_index, contents[opponent_pool_index]))
+                contents[opponent_pool_index] = move.content_end_node  # On met une pièce sur la case.
 
             if move.block:  # Si c'est un coup qui déplace un block.
 
                 # On enlève le BLOCK
-                self.change_content(move.end_node, EMPTY)  # Ligne possiblement inutile également
                 self.hashcode = self.hashcode ^ self.hash_table[move.end_node][BLOCK]
 
                 # Ensuite il faut replacer le block quelque part
-
-                self.change_content(move.chosen_placement, BLOCK)
-
                 # Cette case sera forcément vide, on peut mettre directement un BLOCK dedans
+                placement_index = node2index[move.chosen_placement]
+                changed_cells.append((placement_index, contents[placement_index]))
+                contents[placement_index] = BLOCK
                 self.hashcode = self.hashcode ^ self.hash_table[move.chosen_placement][BLOCK]
 
             # Enfin, il faut placer la pièce du joueur et actualiser une dernière fois le hashcode
 
-            self.change_content(move.end_node, move.player)
+            changed_cells.append((end_index, contents[end_index]))
+            contents[end_index] = move.player
             self.hashcode = self.hashcode ^ self.hash_table[move.end_node][move.player]
 
         # On termine le tour en changeant de tour et en modifiant le hash_turn correctement
@@ -205,7 +261,20 @@ class Board:
 
         self.game_time += 1
 
-        return 0
+        return undo
+
+    def unplay(self, undo):
+        """
+        Annule le coup correspondant à l'enregistrement undo renvoyé par Board.play.
+        Les coups doivent être annulés dans l'ordre inverse de celui dans lequel ils ont été joués.
+        """
+        changed_cells, changed_pools, self.turn, self.game_time, self.over, self.winner, self.hashcode = undo
+
+        contents = self.contents
+        for index, content in reversed(changed_cells):
+            contents[index] = content
+        for color, nb_pieces in reversed(changed_pools):
+            self.piece_pools[color][1] = nb_pieces
 
     def playout(self, mode=1):
         """
@@ -214,46 +283,26 @@ class Board:
         dans un premier temps le déplacement du pion et dans un second temps la destination de la barricade
         s'il y en a une qui a été prise.
         """
-        if mode == 1:
-            while not self.over:
-                valid_moves = self.valid_moves(random.randint(1, self.map.max_dice))  # Récupération des moves valides
-                if len(valid_moves) != 0:
-                    chosen_move = random.choice(valid_moves)
-                    self.play(chosen_move)
-                else:
-                    # Dans ce cas, il n'y a pas de coup jouable
-                    self.play(None)  # On passe son tour.
-
-            return self.winner
-        elif mode == 2:
-            lost_time = 0
-            while not self.over:
-                valid_moves = self.valid_moves(random.randint(1, self.map.max_dice))
-                start = time.perf_counter()
-                grouped_moves = self.get_grouped_moves(valid_moves)
-                end = time.perf_counter()
-                lost_time += (end - start)
-                if len(valid_moves) != 0:
-                    chosen_group = random.choice(grouped_moves[0] + grouped_moves[1:])
-                    if type(chosen_group) is list:
-                        chosen_move = random.choice(chosen_group)
-                    else:
-                        chosen_move = chosen_group
-                    self.play(chosen_move)
-                else:
-                    self.play(None)
-            # print(round(lost_time, 3))
-            return self.winner
+        return run_playout(self, mode=mode, apply=True)
+
+    def playout_batch(self, nb_playouts, exploration_parameter=None, mode=1):
+        """
+        Joue nb_playouts playouts indépendants à partir de l'état actuel, en parallèle (voir run_playout_batch).
+        Le board n'est pas modifié.
+        :return : (tableau des gagnants, liste des ensembles de codes joués par chaque playout)
+        """
+        return run_playout_batch(self, nb_playouts, exploration_parameter, mode)
 
     def playout_MAST(self, played_moves_codes=None, exploration_parameter=1, mode=1, save_gif=False):
 
         if played_moves_codes is None:
             print("Pas de liste transmise pour le playout MAST")
-            played_moves = []
 
-        figs = []
-        if save_gif is True:
-            figs = [self.display('names')]
+        if save_gif is False:
+            return run_playout(self, played_moves_codes, exploration_parameter, mode, apply=True)
+
+        # Pour sauvegarder un gif, on a besoin du board à chaque coup : on joue donc les Move un par un.
+        figs = [self.display('names')]
 
         while not self.over:
 
@@ -264,12 +313,10 @@ class Board:
 
                 if mode == 1:
                     policy = self.get_policy(valid_moves, exploration_parameter=exploration_parameter)
-                    # print("Policy :", policy,"sum:",policy.sum())
                     chosen_move = random.choices(valid_moves, policy)[0]
                 elif mode == 2:
                     grouped_moves = self.get_grouped_moves(valid_moves)
                     policy = self.get_policy(grouped_moves, exploration_parameter=exploration_parameter)
-                    # print("Policy :", policy,"sum:",policy.sum())
 
                     chosen_group = random.choices(grouped_moves[0] + grouped_moves[1:], policy)[0]
                     if type(chosen_group) is list:
@@ -281,70 +328,44 @@ class Board:
                     print("Mauvais mode pour playout MAST")
                     chosen_move = None
 
-                played_moves_codes.append(chosen_move.code(self.map))
+                if played_moves_codes is not None:
+                    played_moves_codes.append(chosen_move.code(self.map))
                 self.play(chosen_move)
 
             else:
                 self.play(None)
 
-            if save_gif is True:
-                figs.append(self.display('names'))
+            figs.append(self.display('names'))
 
-        if save_gif is True:
-            figs2gif(figs, "new_playout_gt" + str(self.game_time) + ".gif")
+        figs2gif(figs, "new_playout_gt" + str(self.game_time) + ".gif")
 
         return self.winner
 
-
     def get_policy(self, move_list, exploration_parameter=1):
-
+        """
+        Politique de tirage MAST : softmax des taux de victoire MAST (calculée en une fois sur les codes des coups).
+        Si move_list est une liste de groupes (voir get_grouped_moves), les coups qui ne déplacent pas de block sont
+        considérés individuellement et chaque groupe de coups qui déplacent un block reçoit la moyenne de leurs taux.
+        """
         if type(move_list[0]) is list:  # Pour le premier tirage (sans le tirage du placement du Block)
-            # move_list[0] contient tous les coups qui ne déplacent pas de blocks
-            policy = np.zeros(len(move_list[0]) + len(move_list) - 1)
-            for i in range(len(move_list)):
-                if i == 0:  # On considère chaque coup où Block==False individuellement
-                    for j, move in enumerate(move_list[0]):
-                        move_code = move.code(self.map)
-                        if self.transposition_table.playouts_MAST[move_code] == 0:
-                            amaf_victory_rate = 0
-                        else:
-                            amaf_victory_rate = (self.transposition_table.win_MAST[move_code][move.player] /
-                                                 self.transposition_table.playouts_MAST[move_code])
-                        policy[j] = math.exp(amaf_victory_rate / exploration_parameter)
-                else:  # Et on groupe tous les coups qui déplacent une barricade entre eux en faisant la moyenne de leurs
-                    # stats
-                    sum = 0
-                    amaf_victory_rate = 0
-                    for j, move in enumerate(move_list[i]):
-                        move_code = move.code(self.map)
-                        if self.transposition_table.playouts_MAST[move_code] == 0:
-                            amaf_victory_rate = 0
-                        else:
-                            amaf_victory_rate = (self.transposition_table.win_MAST[move_code][move.player] /
-                                                 self.transposition_table.playouts_MAST[move_code])
-                        sum += amaf_victory_rate
-                    mean = sum / len(move_list[i])
-                    policy[len(move_list[0]) + i - 1] = math.exp(mean / exploration_parameter)
-            return policy / policy.sum()
-
+            moves = [move for group in move_list for move in group]
+            # Indice du tirage auquel appartient chaque coup : chaque coup de move_list[0], puis chaque groupe
+            draw_index = np.concatenate([np.arange(len(move_list[0]))] +
+                                        [np.full(len(group), len(move_list[0]) + i)
+                                         for i, group in enumerate(move_list[1:])]).astype(np.int64)
         else:  # Si c'est simplement une liste de moves qui est fournie, on retourne juste la policy sur ces coups
+            moves = move_list
+            draw_index = None
 
-            policy = np.zeros(len(move_list))
+        codes = np.fromiter((move.code(self.map) for move in moves), dtype=np.int64, count=len(moves))
+        rates = self.transposition_table.mast_rates(codes, moves[0].player)
 
-            for i, move in enumerate(move_list):
-                move_code = move.code(self.map)
-                # On fait la somme des exp des taux de victoire AMAF pour préparer
-                # la politique de tirage des coups
-                if self.transposition_table.playouts_MAST[move_code] == 0:
-                    amaf_victory_rate = 0
-                else:
-                    amaf_victory_rate = self.transposition_table.win_MAST[move_code][move.player]
-                    amaf_victory_rate /= self.transposition_table.playouts_MAST[move_code]
-
-                policy[i] = math.exp(amaf_victory_rate / exploration_parameter)
+        if draw_index is not None:
+            rates = np.bincount(draw_index, weights=rates) / np.bincount(draw_index)
 
-            # On crée ensuite le vecteur qui servira de politique pour tirer le coup dans le playout
-            return policy / policy.sum()
+        # On crée ensuite le vecteur qui servira de politique pour tirer le coup dans le playout
+        policy = np.exp((rates - rates.max()) / exploration_parameter)
+        return policy / policy.sum()
 
     def display(self, display_mode=None, figsize=(6,6), infos=True):
         """
@@ -399,55 +420,35 @@ class Board:
         return fig
 
     def copy(self):
-        cop = Board(mapp=self.map)
+        """
+        Copie légère du plateau : seul l'état modifiable (contenu des cases, pools, tour, hashcode, game_time...)
+        est dupliqué. La map, les structures de hash, les adversaires et la table de transposition sont partagés
+        par référence, on ne passe donc pas par Board.__init__ (qui allouerait une nouvelle Table).
+        """
+        cop = Board.__new__(Board)
 
         cop.map = self.map
-
-        for n, data in self.board.nodes(data=True):
-            cop.change_content(n, new_content=data['content'])
+        cop.contents = self.contents[:]
 
         cop.hashcode = self.hashcode
         cop.hash_table = self.hash_table
         cop.hash_turn = self.hash_turn
         cop.transposition_table = self.transposition_table
+        cop.opponents = self.opponents
 
         cop.game_time = self.game_time
-
-        if self.map.reference == REF2:
-            cop.piece_pools = {RED: ['a0', self.piece_pools[RED][1]],
-                               BLUE: ['i0', self.piece_pools[BLUE][1]]}
-        if self.map.reference == REF3:
-            cop.piece_pools = {
-                RED: ['a0', self.piece_pools[RED][1]],
-                BLUE: ['i0', self.piece_pools[BLUE][1]],
-                GREEN: ['e0', self.piece_pools[GREEN][1]]
-            }
+        cop.piece_pools = {color: [pool[0], pool[1]] for color, pool in self.piece_pools.items()}
 
         cop.over = self.over
-        cop.winner = copy.deepcopy(self.winner)
+        cop.winner = self.winner
         cop.turn = self.turn
         return cop
 
     def update_MAST(self, winner, played_moves_codes: List[int]):
-        treated_moves = set()
-        for move_code in played_moves_codes:
-            if move_code in treated_moves:
-                continue
-            self.transposition_table.playouts_MAST[move_code] += 1
-            self.transposition_table.win_MAST[move_code][winner] += 1
-            treated_moves.add(move_code)
+        self.transposition_table.update_MAST(winner, played_moves_codes)
 
     def update_AMAF(self, table_entry: List, winner, played_moves_codes: List[int]):
-        treated_moves = set()
-        for move_code in played_moves_codes:
-            # On va devoir vérifier que le code a pas déjà été compté dans les statistiques
-            if move_code in treated_moves:
-                # Si c'est le cas, on passe au coup suivant directement
-                continue
-            # Sinon, on met à jour les statistiques AMAF de la table.
-            table_entry[3][move_code] += 1  # Nb de fois que le coup a été joué
-            table_entry[4][move_code][winner] += 1  # mise à jour du nb de victoires.
-            treated_moves.add(move_code)
+        self.transposition_table.update_AMAF(table_entry, winner, played_moves_codes)
 
     def get_grouped_moves(self, move_list):
         grouped_moves = [[]]
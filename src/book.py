@@ -0,0 +1,133 @@
+# Livre d'ouverture : les entrées d'une Table (statistiques UCT de chaque état) enregistrées dans un fichier binaire
+# trié par hashcode, qu'on ouvre avec mmap. Rien n'est chargé à l'ouverture : une entrée n'est lue (et convertie en
+# tableaux NumPy) que quand la recherche consulte son état, et plusieurs processus qui ouvrent le même livre se
+# partagent les mêmes pages en mémoire.
+#
+# Format du fichier (petit-boutiste) :
+#   MAGIC (8 octets), taille de l'en-tête (uint64), en-tête JSON complété par des espaces jusqu'à un multiple de 8,
+#   puis les tableaux :
+#       keys[nb_entries] (uint64) : hashcodes triés
+#       offsets[nb_entries + 1] (int64) : les coups de l'entrée i sont les coups offsets[i] à offsets[i + 1]
+#       visits[nb_entries] (int64) : nombre de passages dans l'état
+#       nplayouts[nb_moves] (float64) : nombre de playouts de chaque coup
+#       nwins[nb_moves, nb_colors] (int64) : nombre de victoires de chaque couleur pour chaque coup
+#   L'en-tête donne la version du format, la map, les couleurs, les tailles et les clés de Zobrist utilisées pour les
+#   hashcodes : le livre n'est valable que pour des plateaux qui utilisent ces clés.
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'MCTSBOOK'
+# Version 2 : les entrées sont rangées sous la clé des noeuds de décision (Table.key, hashcode ^ DICE_KEYS[dé]). Les
+# livres de la version 1, indexés par le hashcode seul, ne seraient jamais consultés : ils sont refusés.
+VERSION = 2
+
+
+def write_book(table, board, path, min_visits=1):
+    """
+    Enregistre les entrées de table dans le livre path (les statistiques AMAF ne sont pas enregistrées).
+    :param board : plateau dont les clés de Zobrist ont servi à calculer les hashcodes de la table
+    :param min_visits : nombre minimal de passages pour qu'un état soit enregistré
+    :return : nombre d'entrées enregistrées
+    """
+    hashcodes = sorted(hashcode for hashcode, entry in table.table.items() if entry[0] >= min_visits)
+    entries = [table.table[hashcode] for hashcode in hashcodes]
+
+    keys = np.array(hashcodes, dtype=np.uint64)
+    offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(entry[1]) for entry in entries])
+    visits = np.array([entry[0] for entry in entries], dtype=np.int64)
+    nplayouts = np.concatenate([entry[1] for entry in entries] + [np.zeros(0)])
+    nwins = np.concatenate([entry[2][:, table.colors] for entry in entries] +
+                           [np.zeros((0, len(table.colors)), dtype=np.int64)])
+
+    header = json.dumps({'version': VERSION,
+                         'reference': board.map.reference,
+                         'colors': table.colors,
+                         'nb_entries': len(entries),
+                         'nb_moves': int(offsets[-1]),
+                         'hash_table': board.hash_table,
+                         'hash_turn': {str(color): key for color, key in board.hash_turn.items()}}).encode()
+    header += b' ' * (-len(header) % 8)
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for array in [keys, offsets, visits, nplayouts, nwins]:
+            f.write(array.astype(array.dtype.newbyteorder('<'), copy=False).tobytes())
+    return len(entries)
+
+
+class Book:
+    def __init__(self, path):
+        """
+        Ouvre le livre path en lecture seule.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} n'est pas un livre d'ouverture")
+            header_size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size))
+        if header['version'] != VERSION:
+            raise ValueError(f"Version de livre non supportée : {header['version']}")
+
+        self.reference = header['reference']
+        self.colors = header['colors']
+        self.hash_table = header['hash_table']
+        self.hash_turn = {int(color): key for color, key in header['hash_turn'].items()}
+
+        nb_entries = header['nb_entries']
+        nb_moves = header['nb_moves']
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        position = len(MAGIC) + 8 + header_size
+        arrays = []
+        for dtype, shape in [('<u8', (nb_entries,)), ('<i8', (nb_entries + 1,)), ('<i8', (nb_entries,)),
+                             ('<f8', (nb_moves,)), ('<i8', (nb_moves, len(self.colors)))]:
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(self.buffer, dtype=dtype, count=count, offset=position).reshape(shape))
+            position += count * 8
+        self.keys, self.offsets, self.visits, self.nplayouts, self.nwins = arrays
+
+    def __getstate__(self):
+        # Envoyé à un autre processus, le livre est rouvert à partir du fichier au lieu d'être copié
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, hashcode):
+        # Position de hashcode dans le livre (-1 s'il n'y est pas), par recherche dichotomique
+        i = int(np.searchsorted(self.keys, np.uint64(hashcode)))
+        if i < len(self.keys) and self.keys[i] == hashcode:
+            return i
+        return -1
+
+    def __contains__(self, hashcode):
+        return self.index(hashcode) != -1
+
+    def get(self, hashcode):
+        """
+        Entrée de la table pour hashcode ([n, nplayouts, nwins, amaf_codes, amaf_stats], avec des statistiques
+        AMAF vides pour que l'entrée serve aussi à RAVE et GRAVE), ou None si l'état n'est pas dans le livre.
+        """
+        i = self.index(hashcode)
+        if i == -1:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        nb_columns = max(self.colors) + 1
+        nwins = np.zeros((end - start, nb_columns), dtype=np.int64)
+        nwins[:, self.colors] = self.nwins[start:end]
+        return [int(self.visits[i]), self.nplayouts[start:end].copy(), nwins, np.zeros(0, dtype=np.int64),
+                np.zeros((0, nb_columns), dtype=np.int64)]
+
+    def matches(self, board):
+        # Le livre a-t-il été construit avec la map et les clés de Zobrist de board ?
+        return (self.reference == board.map.reference and self.hash_table == board.hash_table
+                and self.hash_turn == board.hash_turn)
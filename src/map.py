@@ -1,4 +1,5 @@
 import networkx as nx
+import numpy as np
 
 BLOCK = 0
 RED = 1
@@ -7,10 +8,24 @@ GREEN = 3
 EMPTY = 4
 GOAL = -1
 
+MAPS = {}  # Registre des maps déjà construites, par référence
+
 
 class Map:
+    """
+    Définition d'une map et de toutes les données qui en dérivent (graphe, index des cases, chemins, codes des coups,
+    clés de Zobrist). Une map n'est construite qu'une fois par référence : Map(reference) renvoie ensuite l'objet du
+    registre MAPS, qui est partagé par tous les plateaux et ne doit pas être modifié.
+    """
+
+    def __new__(cls, reference="P22-D3-S34-v1"):
+        if reference in MAPS:
+            return MAPS[reference]
+        return super().__new__(cls)
 
     def __init__(self, reference="P22-D3-S34-v1"):
+        if MAPS.get(reference) is self:  # Déjà construite
+            return
 
         if reference == "P22-D3-S34-v1":
 
@@ -31,6 +46,10 @@ class Map:
 
             self.content2code = {EMPTY: 0, RED: 1, BLUE: 1, GOAL: 2}
             self.player2code = {RED: 0, BLUE: 1}
+            self.next_player = {RED: BLUE, BLUE: RED}
+            self.pool_nodes = {RED: 'a0', BLUE: 'i0'}
+            self.opponents = {RED: [BLUE],
+                              BLUE: [RED]}
 
         elif reference == "P32-D3-S48-v1":
             self.reference = reference
@@ -54,6 +73,11 @@ class Map:
 
             self.content2code = {EMPTY: 0, RED: 1, BLUE: 1, GREEN: 1, GOAL: 2}
             self.player2code = {RED: 0, BLUE: 1, GREEN: 2}
+            self.next_player = {RED: GREEN, GREEN: BLUE, BLUE: RED}
+            self.pool_nodes = {RED: 'a0', BLUE: 'i0', GREEN: 'e0'}
+            self.opponents = {RED: [GREEN, BLUE],
+                              GREEN: [RED, BLUE],
+                              BLUE: [GREEN, RED]}
 
 
         else:
@@ -65,7 +89,167 @@ class Map:
                                          self.nb_players * len(self.possible_start_nodes) * len(
                                      self.possible_end_nodes) * len(self.possible_block_placements))
 
+        # Représentation compacte du plateau : chaque case reçoit un indice entier (dans l'ordre des noeuds du graphe)
+        # et l'adjacence est précalculée une seule fois au format CSR.
+        self.graph = self.build_graph()  # Topologie statique, le contenu des cases est stocké dans les Board
+        self.nodes = tuple(self.graph.nodes)
+        self.nb_cells = len(self.nodes)
+        self.node2index = {node: i for i, node in enumerate(self.nodes)}
+        self.initial_contents = tuple(data['content'] for _, data in self.graph.nodes(data=True))
+        # Ligne de chaque case : 0 pour les pools, 1 pour la ligne de départ. Les blocks ne peuvent être replacés
+        # qu'à partir de la ligne 2 (placement_cells, ou placement_mask sous forme de tableau).
+        self.rows = tuple(int(node[1]) for node in self.nodes)
+        self.placement_cells = tuple(i for i in range(self.nb_cells) if self.rows[i] >= 2)
+        self.placement_mask = np.array([row >= 2 for row in self.rows])
+        self.rows_array = np.array(self.rows)
+
+        indptr = [0]
+        indices = []
+        for node in self.nodes:
+            indices += [self.node2index[neighbour] for neighbour in self.graph.neighbors(node)]
+            indptr.append(len(indices))
+        self.adjacency_indptr = np.array(indptr, dtype=np.int32)
+        self.adjacency_indices = np.array(indices, dtype=np.int32)
+
+        # Index des chemins par (case de départ, score du dé). La topologie ne change jamais, on calcule donc une
+        # seule fois tous les chemins (plus courts) de longueur 1 à max_dice, dans l'ordre du parcours en largeur.
+        # dice_paths[start][dice] est un tuple de (case d'arrivée, indices du chemin, noms des cases du chemin)
+        self.dice_paths = [[() for d in range(self.max_dice + 1)] for i in range(self.nb_cells)]
+        for start, node in enumerate(self.nodes):
+            by_dice = [[] for d in range(self.max_dice + 1)]
+            for target, path in nx.single_source_shortest_path(self.graph, node, cutoff=self.max_dice).items():
+                if len(path) > 1:
+                    by_dice[len(path) - 1].append((self.node2index[target],
+                                                   tuple(self.node2index[n] for n in path),
+                                                   tuple(path)))
+            self.dice_paths[start] = tuple(tuple(paths) for paths in by_dice)
+        self.dice_paths = tuple(self.dice_paths)
+
+        # Même index sous forme de tableaux d'entiers (complétés par -1) pour les traitements vectorisés
+        max_paths = max(len(paths) for by_dice in self.dice_paths for paths in by_dice)
+        self.path_counts = np.zeros((self.nb_cells, self.max_dice + 1), dtype=np.int32)
+        self.path_table = np.full((self.nb_cells, self.max_dice + 1, max_paths, self.max_dice + 1), -1,
+                                  dtype=np.int32)
+        for start in range(self.nb_cells):
+            for dice in range(1, self.max_dice + 1):
+                self.path_counts[start, dice] = len(self.dice_paths[start][dice])
+                for k, (_, path, _) in enumerate(self.dice_paths[start][dice]):
+                    self.path_table[start, dice, k, :dice + 1] = path
+
+        # Pour calculer les codes des coups (voir Move.code) directement à partir des indices des cases :
+        # code = option + end * end_stride + start * start_stride + player * player_stride
+        # avec option = content2code[contenu d'arrivée] ou 3 + indice du placement du block.
+        nb_options = 3
+        self.end_stride = len(self.possible_block_placements) + nb_options
+        self.start_stride = len(self.possible_end_nodes) * self.end_stride
+        self.player_stride = len(self.possible_start_nodes) * self.start_stride
+        self.cell2start = [-1 for i in range(self.nb_cells)]
+        self.cell2end = [-1 for i in range(self.nb_cells)]
+        self.cell2placement = [-1 for i in range(self.nb_cells)]
+        for i, node in enumerate(self.possible_start_nodes):
+            self.cell2start[self.node2index[node]] = i
+        for i, node in enumerate(self.possible_end_nodes):
+            self.cell2end[self.node2index[node]] = i
+        for i, node in enumerate(self.possible_block_placements):
+            self.cell2placement[self.node2index[node]] = i + nb_options
+        self.cell2start = tuple(self.cell2start)
+        self.cell2end = tuple(self.cell2end)
+        self.cell2placement = tuple(self.cell2placement)
+
+        # Mêmes index à partir des noms des cases (utilisés par Move.code)
+        self.start_node2index = {node: i for i, node in enumerate(self.possible_start_nodes)}
+        self.end_node2index = {node: i for i, node in enumerate(self.possible_end_nodes)}
+        self.placement_node2index = {node: i + nb_options for i, node in enumerate(self.possible_block_placements)}
+        self.code2player = {code: player for player, code in self.player2code.items()}
+
+        # Mêmes tables sous forme de tableaux (playouts vectorisés), indexées par case ou par couleur
+        nb_colors = max(self.player2code) + 1
+        self.cell2start_array = np.array(self.cell2start)
+        self.cell2end_array = np.array(self.cell2end)
+        self.cell2placement_array = np.array(self.cell2placement)
+        self.player2code_array = np.zeros(nb_colors, dtype=np.int64)
+        self.next_player_array = np.zeros(nb_colors, dtype=np.int64)
+        self.pool_cells_array = np.zeros(nb_colors, dtype=np.int64)
+        for color in self.player2code:
+            self.player2code_array[color] = self.player2code[color]
+            self.next_player_array[color] = self.next_player[color]
+            self.pool_cells_array[color] = self.node2index[self.pool_nodes[color]]
+        self.content2code_array = np.zeros(EMPTY + 2, dtype=np.int64)  # Indexé par contenu + 1 (GOAL vaut -1)
+        for content, code in self.content2code.items():
+            self.content2code_array[content + 1] = code
+
+        # Les tableaux sont partagés par tous les plateaux : on les protège en écriture
+        for value in vars(self).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+        # Clés de Zobrist, tirées au premier appel de zobrist_keys
+        self.zobrist = None
+        MAPS[reference] = self
+
+    def __reduce__(self):
+        # Une map envoyée à un autre processus y est reprise du registre (ou construite une fois) avec ses clés
+        return Map, (self.reference,), {'zobrist': self.zobrist}
+
+    def __setstate__(self, state):
+        if self.zobrist is None:
+            self.zobrist = state['zobrist']
+
+    def zobrist_keys(self):
+        """
+        Clés de Zobrist de la map (voir draw_zobrist_keys), tirées une seule fois et partagées par tous les plateaux
+        créés sans clés.
+        """
+        if self.zobrist is None:
+            self.zobrist = self.draw_zobrist_keys()
+        return self.zobrist
+
+    def draw_zobrist_keys(self):
+        """
+        Tire de nouvelles clés de Zobrist : (hash_table, hash_turn) avec hash_table[case][contenu ou nombre de pièces
+        du pool] et hash_turn[couleur]. Ce sont des entiers Python de 64 bits (avec des clés de 31 bits, les collisions
+        deviennent probables dès quelques millions d'états dans la table).
+        """
+        keys = np.random.randint(0, 2 ** 64, (self.nb_cells, self.nb_players + 1), dtype=np.uint64).tolist()
+        turn_keys = np.random.randint(0, 2 ** 64, self.nb_players, dtype=np.uint64).tolist()
+        return dict(zip(self.nodes, keys)), dict(zip(self.player2code, turn_keys))
+
+    def encode_move(self, player, start_node, end_node, content_end_node, chosen_placement=None):
+        """
+        Code entier d'un coup, unique pour chaque coup possible sur la map (entre 0 et nb_possible_moves).
+        Sur la case d'arrivée on peut trouver : EMPTY, un adversaire ou GOAL (3 options), ou un block qu'on replace
+        sur une des possible_block_placements.
+        """
+        if content_end_node == BLOCK:
+            option = self.placement_node2index[chosen_placement]
+        else:
+            option = self.content2code[content_end_node]
+
+        return (option + self.end_node2index[end_node] * self.end_stride
+                + self.start_node2index[start_node] * self.start_stride
+                + self.player2code[player] * self.player_stride)
+
+    def decode_move(self, code):
+        """
+        Inverse de encode_move : retourne (player, start_node, end_node, option) où option est soit le code du
+        contenu d'arrivée (content2code), soit le nom de la case où le block est replacé.
+        """
+        player_code, code = divmod(code, self.player_stride)
+        start, code = divmod(code, self.start_stride)
+        end, option = divmod(code, self.end_stride)
+        if option >= 3:
+            option = self.possible_block_placements[option - 3]
+        return self.code2player[player_code], self.possible_start_nodes[start], self.possible_end_nodes[end], option
+
+    def neighbours(self, index):
+        # Indices des cases voisines de la case d'indice index
+        return self.adjacency_indices[self.adjacency_indptr[index]:self.adjacency_indptr[index + 1]]
+
     def get_board(self):
+        # Copie du graphe de la map, que l'appelant peut modifier
+        return self.graph.copy()
+
+    def build_graph(self):
         if self.reference == "P22-D3-S34-v1":
             g = nx.Graph()
 
@@ -0,0 +1,126 @@
+# Stockage persistant des statistiques MAST d'une map : un fichier de tableaux d'entiers, ouvert avec mmap, auquel
+# plusieurs processus (ou plusieurs lancements) ajoutent leurs statistiques. Chaque recherche peut ainsi partir de
+# statistiques MAST déjà rodées, sans avoir à recevoir une Table sérialisée.
+#
+# Format du fichier (petit-boutiste) :
+#   en-tête de HEADER_SIZE octets : MAGIC (8 octets), version du format (uint32), nombre de colonnes de win_MAST
+#   (uint32), nombre de coups possibles de la map (uint64), révision (uint64, incrémentée à chaque fusion), référence
+#   de la map (ASCII complété par des zéros)
+#   puis playouts_MAST[nb_moves] (int64) et win_MAST[nb_moves, nb_columns] (int64)
+
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+try:  # Verrou de fichier pour les fusions concurrentes (non disponible sous Windows)
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b'MASTSTOR'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ32s')
+HEADER_SIZE = HEADER.size
+REVISION_OFFSET = 24  # Position de la révision dans l'en-tête
+
+
+class MastStore:
+    def __init__(self, mapp, directory='.'):
+        """
+        Statistiques MAST de la map mapp, stockées dans directory/mast_<référence de la map>.bin
+        """
+        self.reference = mapp.reference
+        self.nb_moves = mapp.nb_possible_moves
+        self.nb_columns = max(mapp.player2code) + 1  # Colonnes indexées par la couleur, comme Table.win_MAST
+        self.path = os.path.join(directory, f"mast_{mapp.reference}.bin")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self):
+        """
+        Crée le fichier avec des statistiques nulles s'il n'existe pas encore. Le fichier est écrit à côté puis lié
+        à son nom, pour qu'un processus concurrent ne voie jamais un fichier incomplet.
+        """
+        if self.exists():
+            return
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, self.nb_columns, self.nb_moves, 0, self.reference.encode()))
+                f.truncate(HEADER_SIZE + 8 * self.nb_moves * (1 + self.nb_columns))
+            try:
+                os.link(tmp_path, self.path)
+            except FileExistsError:  # Créé entre temps par un autre processus
+                pass
+        finally:
+            os.remove(tmp_path)
+
+    def open(self, mode='r'):
+        """
+        Ouvre le fichier avec mmap et retourne (mémoire du fichier, révision, playouts_MAST, win_MAST), les deux
+        tableaux étant des vues sur le fichier (modifiables avec mode='r+').
+        """
+        memory = np.memmap(self.path, dtype=np.uint8, mode=mode)
+        magic, version, nb_columns, nb_moves, revision, reference = HEADER.unpack(bytes(memory[:HEADER_SIZE]))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} n'est pas un fichier de statistiques MAST")
+        if version != VERSION:
+            raise ValueError(f"Version de fichier MAST non supportée : {version}")
+        if reference.rstrip(b'\0').decode() != self.reference or nb_moves != self.nb_moves \
+                or nb_columns != self.nb_columns:
+            raise ValueError(f"{self.path} ne correspond pas à la map {self.reference}")
+
+        playouts = np.frombuffer(memory, dtype='<i8', count=nb_moves, offset=HEADER_SIZE)
+        wins = np.frombuffer(memory, dtype='<i8', count=nb_moves * nb_columns,
+                             offset=HEADER_SIZE + 8 * nb_moves).reshape(nb_moves, nb_columns)
+        return memory, revision, playouts, wins
+
+    def revision(self):
+        # Nombre de fusions faites dans le fichier (0 s'il n'existe pas)
+        if not self.exists():
+            return 0
+        return self.open()[1]
+
+    def load(self, table):
+        """
+        Remplace les statistiques MAST de table par celles du fichier (en int64 comme celles de la table : les compteurs
+        du fichier s'accumulent d'un lancement à l'autre).
+        :return : révision chargée (None si le fichier n'existe pas, table n'est alors pas modifiée)
+        """
+        if not self.exists():
+            return None
+        memory, revision, playouts, wins = self.open()
+        table.playouts_MAST = playouts.astype(np.int64)
+        table.win_MAST = wins.astype(np.int64)
+        return revision
+
+    def merge(self, playouts, wins):
+        """
+        Ajoute aux statistiques du fichier des statistiques produites ailleurs (en général la différence entre les
+        statistiques MAST d'une table à la fin et au début d'une partie). La fusion se fait sous verrou exclusif du
+        fichier, plusieurs processus peuvent donc fusionner en même temps.
+        :return : nouvelle révision
+        """
+        self.create()
+        with open(self.path, 'r+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                memory, revision, stored_playouts, stored_wins = self.open('r+')
+                stored_playouts += playouts
+                stored_wins[:, :wins.shape[1]] += wins
+                revision += 1
+                memory[REVISION_OFFSET:REVISION_OFFSET + 8] = np.frombuffer(struct.pack('<Q', revision), np.uint8)
+                memory.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return revision
+
+    def merge_table(self, table, start_playouts, start_wins):
+        # Fusionne ce que table a appris depuis que ses statistiques MAST valaient (start_playouts, start_wins)
+        return self.merge(table.playouts_MAST - start_playouts, table.win_MAST - start_wins)
@@ -1,4 +1,3 @@
-import copy
 from typing import List, Union, Tuple, Any
 
 from src.map import Map
@@ -15,19 +14,32 @@ INT2STRING = {RED: 'RED', BLUE: 'BLUE', GREEN:'GREEN'}
 
 
 class Move:
+    # Pas de __dict__ : les coups sont créés par milliers à chaque génération de coups
+    __slots__ = ('player', 'start_node', 'end_node', 'content_end_node', 'path', 'dice_score', 'block',
+                 'block_placements', '_chosen_placement', '_code')
 
-    def __init__(self, player, start_node, end_node, content_end_node, path, dice_score):
+    def __init__(self, player, start_node, end_node, content_end_node, path, dice_score, code=None):
         self.player = player
         self.start_node = start_node
         self.end_node = end_node
         self.content_end_node = content_end_node
-        self.path = path
+        self.path = path  # Partagé entre les coups (tuple précalculé par la map), on ne le modifie jamais
         self.dice_score = dice_score
 
         self.block = None  # Sera à True si le coup déplace un block et à false sinon.
         self.block_placements = []
 
-        self.chosen_placement = None
+        self._chosen_placement = None
+        self._code = code  # Code entier du coup (voir Map.encode_move), donné à la construction quand il est connu
+
+    @property
+    def chosen_placement(self):
+        return self._chosen_placement
+
+    @chosen_placement.setter
+    def chosen_placement(self, placement):
+        self._chosen_placement = placement
+        self._code = None  # Le code dépend de la destination du block
 
     def is_valid(self, board):  # Checke si le coup est valide pour un certain plateau.
         # On aura déjà vérifié que les start_node et end_node sont bien reliés d'un chemin de taille dice_score
@@ -37,7 +49,9 @@ class Move:
         # Il suffit donc de vérifier :
         # 1. Que la case d'arrivée n'est pas de la couleur self.player
 
-        if self.content_end_node == self.player or self.end_node[1] == '0':  # On a pas le droit de retourner dans les pools
+        rows = board.map.rows
+        node2index = board.map.node2index
+        if self.content_end_node == self.player or rows[node2index[self.end_node]] == 0:  # On a pas le droit de retourner dans les pools
             return False
 
         # 2. Que le chemin n'est pas bloqué par un BLOCK.
@@ -51,12 +65,12 @@ class Move:
         if self.content_end_node == BLOCK:
             self.block = True
             # On va sauvegarder dans l'attribut block_placements toutes les positions possibles pour le block
-            self.block_placements = [node for node, data in board.board.nodes(data=True) if
-                                     data['content'] == EMPTY and node[1] != '0' and node[1] != '1']
+            self.block_placements = [board.map.nodes[i] for i in board.map.placement_cells
+                                     if board.contents[i] == EMPTY]
 
             # Il faut également ajouter la case du pion initial car il aura bougé (seulement s'il est sur la troisième ligne ou plus)
 
-            if self.start_node[1] != '0' and self.start_node[1] != '1':
+            if rows[node2index[self.start_node]] >= 2:
                 self.block_placements += [self.start_node]
         else:
             self.block = False
@@ -64,37 +78,35 @@ class Move:
         return True
 
     def code(self, mapp: Map):
-        # Il faut associer à chaque coup possible un code pour pouvoir stocker les statistiques AMAF
-
-        code = 0
-
-        nb_options = 3 # Sur la case d'arrivée du move, on peut arriver sur : Un adversaire, EMPTY, ou GOAL
-        # On traite le cas des blocks à côté
-
-        if self.content_end_node == BLOCK:
-            code += mapp.possible_block_placements.index(self.chosen_placement) + nb_options  # +3 parce qu'il faut la place pour EMPTY, OPPONENT, GOAL
-        else:
-            code += mapp.content2code[self.content_end_node]
-
-        code += mapp.possible_end_nodes.index(self.end_node) * (len(mapp.possible_block_placements) + nb_options)
-
-        code += mapp.possible_start_nodes.index(self.start_node) * len(mapp.possible_end_nodes) * (len(mapp.possible_block_placements) + nb_options)
-
-        code += mapp.player2code[self.player] * len(mapp.possible_start_nodes) * len(mapp.possible_end_nodes) * (len(mapp.possible_block_placements) + nb_options)
-
-        return code
+        # Il faut associer à chaque coup possible un code pour pouvoir stocker les statistiques AMAF.
+        # Le code est calculé une seule fois (en O(1) grâce aux index de la map) puis gardé avec le coup.
+        if self._code is None:
+            self._code = mapp.encode_move(self.player, self.start_node, self.end_node, self.content_end_node,
+                                          self.chosen_placement)
+        return self._code
 
     def copy(self):
-        m = Move(self.player,
-                 self.start_node,
-                 self.end_node,
-                 self.content_end_node,
-                 copy.deepcopy(self.path),
-                 self.dice_score
-                 )
+        m = Move.__new__(Move)
+        m.player = self.player
+        m.start_node = self.start_node
+        m.end_node = self.end_node
+        m.content_end_node = self.content_end_node
+        m.path = self.path  # Pas besoin de copier le chemin ni block_placements, on ne touche jamais à ces listes.
+        m.dice_score = self.dice_score
         m.block = self.block
-        m.block_placements = self.block_placements # Pas besoin de faire une deepcopy, normalement on touchera jamais à cette liste.
-        m.chosen_placement = self.chosen_placement
+        m.block_placements = self.block_placements
+        m._chosen_placement = self._chosen_placement
+        m._code = self._code
+        return m
+
+    def with_placement(self, placement, code=None):
+        """
+        Variante du coup qui replace le block sur placement. Tout le reste est partagé avec le coup de base.
+        :param code : code du coup avec ce placement s'il est déjà connu (sinon il sera calculé par Move.code)
+        """
+        m = self.copy()
+        m._chosen_placement = placement
+        m._code = code
         return m
 
     def __str__(self):
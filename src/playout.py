@@ -0,0 +1,441 @@
+# Noyau de playout : toute la partie se joue sur des entiers (indices de cases, chemins précalculés par la map,
+# codes de coups entiers), sans créer de Move ni modifier le Board de départ.
+
+import math
+import random
+from array import array
+
+import numpy as np
+
+BLOCK = 0
+RED = 1
+BLUE = 2
+GREEN = 3
+EMPTY = 4
+GOAL = -1
+
+
+def run_playout(board, played_moves_codes=None, exploration_parameter=None, mode=1, apply=False):
+    """
+    Joue une partie jusqu'au bout à partir de l'état de board et retourne le gagnant.
+    Les tirages suivent les mêmes lois que Board.playout (exploration_parameter=None) et Board.playout_MAST.
+    :param played_moves_codes : liste à laquelle on ajoute les codes des coups joués (None pour ne rien enregistrer)
+    :param exploration_parameter : None pour un tirage uniforme, sinon la température de la politique MAST
+    :param mode : Si mode=1, on tire sur tous les coups. Si mode=2, on tire d'abord le déplacement du pion puis
+    la destination de la barricade s'il y en a une qui a été prise.
+    :param apply : Si True, l'état final (cases, pools, tour, hashcode...) est recopié dans board.
+    """
+    if board.over:
+        return board.winner
+
+    if mode != 1 and mode != 2:
+        print("Mauvais mode pour le playout")
+        return None
+
+    mapp = board.map
+    rows = mapp.rows
+    dice_paths = mapp.dice_paths
+    max_dice = mapp.max_dice
+    next_player = mapp.next_player
+    cell2start = mapp.cell2start
+    cell2end = mapp.cell2end
+    cell2placement = mapp.cell2placement
+    end_stride = mapp.end_stride
+    start_stride = mapp.start_stride
+    player_stride = mapp.player_stride
+    content2code = mapp.content2code
+    player2code = mapp.player2code
+    cells = range(mapp.nb_cells)
+    placement_cells = mapp.placement_cells
+
+    contents = list(board.contents)
+    pools = {color: pool[1] for color, pool in board.piece_pools.items()}
+    pool_cells = {color: mapp.node2index[pool[0]] for color, pool in board.piece_pools.items()}
+    turn = board.turn
+    game_time = board.game_time
+    winner = board.winner
+
+    # Le hashcode n'est utile que si l'état final est recopié dans le board
+    track_hash = apply and board.hash_table is not None
+    if track_hash:
+        keys = [[int(k) for k in board.hash_table[node]] for node in mapp.nodes]
+        turn_keys = {color: int(k) for color, k in board.hash_turn.items()}
+        hashcode = board.hashcode
+
+    mast = exploration_parameter is not None
+    if mast:
+        win_MAST = board.transposition_table.win_MAST.item
+        playouts_MAST = board.transposition_table.playouts_MAST.item
+        # La table n'est pas modifiée pendant le playout : on garde le taux de chaque code déjà rencontré (le code
+        # détermine le joueur, donc la colonne de win_MAST)
+        mast_cache = {}
+
+    record = played_moves_codes is not None
+    rand = random.random
+    exp = math.exp
+
+    over = False
+    while not over:
+        dice_score = int(rand() * max_dice) + 1
+
+        # Génération des coups : (départ, arrivée, contenu d'arrivée) et (départ, arrivée) pour ceux qui prennent
+        # un block
+        moves = []
+        block_moves = []
+        for start in [i for i in cells if contents[i] == turn]:
+            for end, path, _ in dice_paths[start][dice_score]:
+                content_end = contents[end]
+                if content_end == turn or rows[end] == 0:
+                    continue
+                for i in path[1:-1]:
+                    if contents[i] == BLOCK:
+                        break
+                else:
+                    if content_end == BLOCK:
+                        block_moves.append((start, end))
+                    else:
+                        moves.append((start, end, content_end))
+
+        if moves or block_moves:
+            player_base = player2code[turn] * player_stride
+            empty_cells = None
+            block_placements = []
+            if block_moves:
+                empty_cells = [i for i in placement_cells if contents[i] == EMPTY]
+                block_placements = [empty_cells + [start] if rows[start] >= 2 else empty_cells
+                                    for start, end in block_moves]
+
+            placement = -1
+            if not mast:
+                if mode == 1:  # Tous les coups (y compris chaque placement de block) ont la même probabilité
+                    r = int(rand() * (len(moves) + sum(len(p) for p in block_placements)))
+                    if r < len(moves):
+                        start, end, content_end = moves[r]
+                    else:
+                        r -= len(moves)
+                        for k, placements in enumerate(block_placements):
+                            if r < len(placements):
+                                start, end = block_moves[k]
+                                placement = placements[r]
+                                break
+                            r -= len(placements)
+                else:  # Chaque déplacement a la même probabilité, puis chaque placement du block
+                    r = int(rand() * (len(moves) + len(block_moves)))
+                    if r < len(moves):
+                        start, end, content_end = moves[r]
+                    else:
+                        start, end = block_moves[r - len(moves)]
+                        placements = block_placements[r - len(moves)]
+                        placement = placements[int(rand() * len(placements))]
+            else:
+                # Politique MAST : softmax des taux de victoire du joueur courant pour chaque code de coup
+                weights = []
+                for start, end, content_end in moves:
+                    code = player_base + cell2start[start] * start_stride + cell2end[end] * end_stride + \
+                           content2code[content_end]
+                    rate = mast_cache.get(code)
+                    if rate is None:
+                        n = playouts_MAST(code)
+                        rate = mast_cache[code] = win_MAST(code, turn) / n if n else 0
+                    weights.append(exp(rate / exploration_parameter))
+
+                placement_weights = []
+                for (start, end), placements in zip(block_moves, block_placements):
+                    base = player_base + cell2start[start] * start_stride + cell2end[end] * end_stride
+                    rates = []
+                    for cell in placements:
+                        code = base + cell2placement[cell]
+                        rate = mast_cache.get(code)
+                        if rate is None:
+                            n = playouts_MAST(code)
+                            rate = mast_cache[code] = win_MAST(code, turn) / n if n else 0
+                        rates.append(rate)
+                    if mode == 1:
+                        group = [exp(rate / exploration_parameter) for rate in rates]
+                        weights.append(sum(group))
+                    else:
+                        # Le groupe est tiré selon la moyenne de ses taux, puis le placement avec une température de 1
+                        weights.append(exp(sum(rates) / len(rates) / exploration_parameter))
+                        group = [exp(rate) for rate in rates]
+                    placement_weights.append(group)
+
+                r = rand() * sum(weights)
+                chosen = len(weights) - 1
+                for k, w in enumerate(weights):
+                    if r < w:
+                        chosen = k
+                        break
+                    r -= w
+
+                if chosen < len(moves):
+                    start, end, content_end = moves[chosen]
+                else:
+                    k = chosen - len(moves)
+                    start, end = block_moves[k]
+                    group = placement_weights[k]
+                    r = rand() * sum(group)
+                    placement = block_placements[k][-1]
+                    for cell, w in zip(block_placements[k], group):
+                        if r < w:
+                            placement = cell
+                            break
+                        r -= w
+
+            if placement != -1:
+                content_end = BLOCK
+
+            if record:
+                base = player_base + cell2start[start] * start_stride + cell2end[end] * end_stride
+                played_moves_codes.append(base + (cell2placement[placement] if placement != -1
+                                                  else content2code[content_end]))
+
+            # On joue le coup (même logique que Board.play)
+            if rows[start] == 0:
+                if track_hash:
+                    hashcode ^= keys[start][pools[turn]]
+                pools[turn] -= 1
+                if pools[turn] == 0:
+                    contents[start] = EMPTY
+            else:
+                contents[start] = EMPTY
+                if track_hash:
+                    hashcode ^= keys[start][turn]
+
+            if content_end == GOAL:
+                over = True
+                winner = turn
+            elif content_end == BLOCK:
+                contents[placement] = BLOCK
+                if track_hash:
+                    hashcode ^= keys[end][BLOCK] ^ keys[placement][BLOCK]
+            elif content_end != EMPTY:  # Pion adverse, renvoyé dans son pool
+                pools[content_end] += 1
+                contents[pool_cells[content_end]] = content_end
+                if track_hash:
+                    hashcode ^= keys[end][content_end] ^ keys[pool_cells[content_end]][pools[content_end]]
+
+            contents[end] = turn
+            if track_hash:
+                hashcode ^= keys[end][turn]
+
+        # Changement de tour (on passe son tour s'il n'y a pas de coup possible)
+        if track_hash:
+            hashcode ^= turn_keys[turn] ^ turn_keys[next_player[turn]]
+        turn = next_player[turn]
+        game_time += 1
+
+    if apply:
+        board.contents = array('b', contents)
+        for color, nb_pieces in pools.items():
+            board.piece_pools[color][1] = nb_pieces
+        board.turn = turn
+        board.game_time = game_time
+        board.over = True
+        board.winner = winner
+        if track_hash:
+            board.hashcode = hashcode
+
+    return winner
+
+
+def run_playout_batch(board, nb_playouts, exploration_parameter=None, mode=1, tail_size=16):
+    """
+    Joue nb_playouts parties indépendantes à partir de l'état de board, en parallèle avec NumPy : à chaque pas,
+    tous les playouts encore en cours lancent le dé, génèrent leurs coups et en tirent un en même temps.
+    Les lois de tirage sont celles de run_playout. Avec la politique MAST, les statistiques de la table sont
+    figées au début du lot (elles ne sont mises à jour qu'avec les codes renvoyés).
+    :param tail_size : nombre de parties en cours en dessous duquel on les termine avec run_playout
+    :return : (tableau des gagnants, liste des ensembles de codes joués par chaque playout sous forme de tableaux triés)
+    """
+    mapp = board.map
+    if board.over:
+        return np.full(nb_playouts, board.winner), [np.empty(0, dtype=np.int64) for i in range(nb_playouts)]
+
+    if mode != 1 and mode != 2:
+        print("Mauvais mode pour le playout")
+        return None
+
+    # Tables de la map sous forme de tableaux
+    rows = mapp.rows_array
+    path_table = mapp.path_table
+    path_counts = mapp.path_counts
+    max_dice = mapp.max_dice
+    nb_paths = path_table.shape[2]
+    cell2start = mapp.cell2start_array
+    cell2end = mapp.cell2end_array
+    cell2placement = mapp.cell2placement_array
+    nb_colors = max(mapp.player2code) + 1
+    player2code = mapp.player2code_array
+    next_player = mapp.next_player_array
+    pool_cells = mapp.pool_cells_array
+    content2code = mapp.content2code_array  # Indexé par contenu + 1 (GOAL vaut -1)
+
+    mast = exploration_parameter is not None
+    if mast:
+        rates = mast_rates(board.transposition_table)
+
+    # Etat des playouts en cours (on ne garde que les lignes des parties non terminées)
+    ids = np.arange(nb_playouts)
+    contents = np.tile(np.array(board.contents, dtype=np.int8), (nb_playouts, 1))
+    pools = np.zeros((nb_playouts, nb_colors), dtype=np.int64)
+    for color, pool in board.piece_pools.items():
+        pools[:, color] = pool[1]
+    turn = np.full(nb_playouts, board.turn, dtype=np.int64)
+    winners = np.zeros(nb_playouts, dtype=np.int64)
+
+    played_ids = []
+    played_codes = []
+    k_range = np.arange(nb_paths)
+    inter_range = np.arange(1, max_dice)
+
+    while ids.size > 0:
+        n = ids.size
+        if n <= tail_size:
+            # Les dernières parties sont finies une par une avec run_playout : quand il reste peu de lignes, le coût
+            # fixe d'un pas vectorisé dépasse celui du noyau scalaire.
+            for i in range(n):
+                tail = board.copy()
+                tail.contents = array('b', contents[i].tolist())
+                for color in tail.piece_pools:
+                    tail.piece_pools[color][1] = int(pools[i, color])
+                tail.turn = int(turn[i])
+                codes = []
+                winners[ids[i]] = run_playout(tail, codes, exploration_parameter, mode)
+                played_ids.append(np.full(len(codes), ids[i]))
+                played_codes.append(np.array(codes, dtype=np.int64))
+            break
+
+        dice_scores = np.random.randint(1, max_dice + 1, size=n)
+        row_index = np.arange(n)[:, None, None]
+
+        # Cases de départ : les cases contenant un pion (ou le pool) du joueur courant
+        mine = contents == turn[:, None]
+        nb_starts = max(int(mine.sum(1).max()), 1)
+        starts = np.argsort(~mine, axis=1, kind='stable')[:, :nb_starts]
+        start_ok = np.take_along_axis(mine, starts, 1)
+
+        # Chemins précalculés pour chaque (départ, dé) : (n, nb_starts, nb_paths, max_dice + 1)
+        paths = path_table[starts[:, :, None], dice_scores[:, None, None], k_range[None, None, :]]
+        path_ok = start_ok[:, :, None] & (k_range[None, None, :] < path_counts[starts, dice_scores[:, None]][:, :, None])
+        ends = np.where(path_ok, path_table[starts[:, :, None], dice_scores[:, None, None], k_range[None, None, :],
+                                            dice_scores[:, None, None]], 0)
+        content_end = contents[row_index, ends]
+
+        legal = path_ok & (content_end != turn[:, None, None]) & (rows[ends] != 0)
+        if max_dice > 1:  # Les cases intermédiaires ne doivent pas contenir de BLOCK
+            inter_ok = path_ok[..., None] & (inter_range[None, None, None, :] < dice_scores[:, None, None, None])
+            inter = np.where(inter_ok, paths[..., 1:max_dice], 0)
+            legal &= ~((contents[row_index[..., None], inter] == BLOCK) & inter_ok).any(3)
+        is_block = legal & (content_end == BLOCK)
+
+        base_codes = (player2code[turn][:, None, None] * mapp.player_stride
+                      + cell2start[starts][:, :, None] * mapp.start_stride + cell2end[ends] * mapp.end_stride)
+
+        # Poids de chaque déplacement
+        if mast:
+            codes = np.where(legal, base_codes + content2code[content_end + 1], 0)
+            weights = np.where(legal, np.exp(rates[codes, turn[:, None, None]] / exploration_parameter), 0.0)
+        else:
+            weights = legal.astype(np.float64)
+
+        # Pour les coups qui prennent un block : poids de chaque placement possible
+        block_rows, block_starts, block_paths = np.nonzero(is_block)
+        if block_rows.size > 0:
+            empty = (contents[block_rows] == EMPTY) & (rows >= 2)[None, :]
+            start_cells = starts[block_rows, block_starts]
+            empty[np.arange(block_rows.size), start_cells] |= rows[start_cells] >= 2
+            if mast:
+                placement_codes = base_codes[block_rows, block_starts, block_paths][:, None] + cell2placement[None, :]
+                placement_rates = np.where(empty, rates[np.where(empty, placement_codes, 0),
+                                                        turn[block_rows][:, None]], 0.0)
+                if mode == 1:
+                    placement_weights = np.exp(placement_rates / exploration_parameter) * empty
+                    weights[block_rows, block_starts, block_paths] = placement_weights.sum(1)
+                else:
+                    mean_rates = placement_rates.sum(1) / empty.sum(1)
+                    weights[block_rows, block_starts, block_paths] = np.exp(mean_rates / exploration_parameter)
+                    placement_weights = np.exp(placement_rates) * empty
+            else:
+                placement_weights = empty.astype(np.float64)
+                if mode == 1:
+                    weights[block_rows, block_starts, block_paths] = empty.sum(1)
+            block_id = np.full(is_block.shape, -1)
+            block_id[block_rows, block_starts, block_paths] = np.arange(block_rows.size)
+
+        # Tirage d'un déplacement par playout (ceux qui n'ont aucun coup passent leur tour)
+        weights = weights.reshape(n, -1)
+        totals = weights.sum(1)
+        moving = np.nonzero(totals > 0)[0]
+        if moving.size > 0:
+            cumulated = np.cumsum(weights[moving], 1)
+            r = np.random.random(moving.size) * totals[moving]
+            chosen = np.minimum((cumulated <= r[:, None]).sum(1), weights.shape[1] - 1)
+            s_chosen = chosen // nb_paths
+            k_chosen = chosen % nb_paths
+
+            start = starts[moving, s_chosen]
+            end = ends[moving, s_chosen, k_chosen]
+            content = content_end[moving, s_chosen, k_chosen]
+            player = turn[moving]
+            code = base_codes[moving, s_chosen, k_chosen] + content2code[content + 1]
+
+            # Tirage du placement du block
+            blocks = np.nonzero(content == BLOCK)[0]
+            if blocks.size > 0:
+                group = placement_weights[block_id[moving[blocks], s_chosen[blocks], k_chosen[blocks]]]
+                cumulated = np.cumsum(group, 1)
+                r = np.random.random(blocks.size) * cumulated[:, -1]
+                placement = np.minimum((cumulated <= r[:, None]).sum(1), mapp.nb_cells - 1)
+                code[blocks] = base_codes[moving[blocks], s_chosen[blocks], k_chosen[blocks]] + \
+                    cell2placement[placement]
+
+            played_ids.append(ids[moving])
+            played_codes.append(code)
+
+            # On joue les coups (même logique que Board.play)
+            from_pool = rows[start] == 0
+            pools[moving[from_pool], player[from_pool]] -= 1
+            clear = ~from_pool | (pools[moving, player] == 0)
+            contents[moving[clear], start[clear]] = EMPTY
+
+            captures = np.nonzero((content >= RED) & (content <= GREEN))[0]
+            captured = content[captures].astype(np.int64)
+            pools[moving[captures], captured] += 1
+            contents[moving[captures], pool_cells[captured]] = captured
+
+            if blocks.size > 0:
+                contents[moving[blocks], placement] = BLOCK
+            contents[moving, end] = player
+
+            goals = np.nonzero(content == GOAL)[0]
+            winners[ids[moving[goals]]] = player[goals]
+        else:
+            goals = np.empty(0, dtype=np.int64)
+            moving = goals
+
+        turn = next_player[turn]
+
+        # On retire les parties terminées
+        if goals.size > 0:
+            keep = np.ones(n, dtype=bool)
+            keep[moving[goals]] = False
+            ids, contents, pools, turn = ids[keep], contents[keep], pools[keep], turn[keep]
+
+    # Ensembles des codes joués, playout par playout
+    nb_moves = mapp.nb_possible_moves
+    if played_ids:
+        keys = np.unique(np.concatenate(played_ids).astype(np.int64) * nb_moves + np.concatenate(played_codes))
+    else:
+        keys = np.empty(0, dtype=np.int64)
+    bounds = np.searchsorted(keys // nb_moves, np.arange(nb_playouts + 1))
+    code_sets = [keys[bounds[i]:bounds[i + 1]] % nb_moves for i in range(nb_playouts)]
+
+    return winners, code_sets
+
+
+def mast_rates(table):
+    """
+    Taux de victoire MAST de chaque code de coup pour chaque couleur : tableau (nb_possible_moves, nb_colors)
+    """
+    playouts = table.playouts_MAST[:, None]
+    return np.divide(table.win_MAST, playouts, out=np.zeros(table.win_MAST.shape), where=playouts > 0)
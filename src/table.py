@@ -1,63 +1,428 @@
 # Ce sera la structure qui va stocker les stats pour les versions de MonteCarlo qui contrôlent la descente de l'arbre.
 
+import copy
+
+import numpy as np
+
 from src.map import Map
 
 RED = 1
 BLUE = 2
 GREEN = 3
 
+# Estimation (d'après sys.getsizeof) de la mémoire occupée par une entrée en plus des données de ses tableaux, utilisée
+# pour la limite max_bytes : la liste de l'entrée, les en-têtes de ses tableaux et ses places dans table et last_seen
+ENTRY_BYTES = 700
+
+POLICIES = ('least_visited', 'lru', 'depth')
+
+# Clés des lancers de dé : le noeud de décision (état, dé) est rangé sous hashcode ^ DICE_KEYS[dé]. Elles sont fixes
+# (contrairement aux clés de Zobrist du plateau) pour être les mêmes dans tous les processus.
+DICE_KEYS = (0,) + tuple(np.random.default_rng(1).integers(1, 2 ** 64, 8, dtype=np.uint64).tolist())
+
 class Table:
-    def __init__(self, mapp: Map):
+    def __init__(self, mapp: Map, max_entries=None, max_bytes=None, policy='least_visited', verify=False,
+                 max_cached_moves=20000):
         '''
         On a besoin de pouvoir stocker pour chaque état :
             - Le nombre de playouts qui ont été faits dans cet état
             Pour chaque coup possible DANS CET ETAT :
                 - Le nombre de victoires
                 - Le nombre de fois que le coup a été joué
+
+        La table peut être bornée par un nombre d'entrées (max_entries) et/ou une taille estimée en octets (max_bytes).
+        Quand une borne est atteinte, on supprime d'un coup assez d'entrées pour redescendre à 7/8 de la borne, dans
+        l'ordre donné par policy :
+            - 'least_visited' : les entrées les moins visitées d'abord
+            - 'lru' : les entrées consultées le moins récemment d'abord
+            - 'depth' : les entrées les plus profondes (game_time le plus grand) d'abord, comme le remplacement par
+              profondeur des tables de transposition des moteurs d'échecs
+        Les entrées des recherches précédentes (voir new_search) passent avant celles de la recherche en cours, et les
+        entrées de la descente en cours (voir start_descent) ne sont jamais supprimées. Une politique inconnue lève
+        ValueError.
+
+        Avec verify, chaque entrée est accompagnée de la signature de son état (Board.signature) : une consultation dont
+        la signature ne correspond pas est une collision de hashcode, comptée dans collisions et traitée comme un état
+        absent (l'entrée est alors remplacée par celle du nouvel état).
+
+        Un livre d'ouverture (src/book.py, voir use_book) peut fournir les entrées des états absents de la table.
+
+        Les coups légaux de chaque noeud de décision (état, lancer de dé) sont gardés dans un cache d'au plus
+        max_cached_moves noeuds (voir valid_moves), indépendant des bornes de la table.
         '''
+        if policy not in POLICIES:
+            raise ValueError(f"Politique de remplacement inconnue : {policy}")
 
-        # On aura besoin de listes de la taille du nombre maximum de coups possibles.
+        # Borne sur le nombre de coups possibles dans un état (les entrées sont dimensionnées au nombre réel de coups).
 
         max_different_paths = 9
 
         self.max_moves_for_a_state = max_different_paths * mapp.nb_players * mapp.nb_pieces * len(mapp.possible_block_placements)
 
         self.table = {}
-        if mapp.reference == "P22-D3-S34-v1":
-            self.win_MAST = [{RED: 0, BLUE: 0} for i in range(mapp.nb_possible_moves)]
-        elif mapp.reference == "P32-D3-S48-v1":
-            self.win_MAST = [{RED: 0, BLUE: 0, GREEN: 0} for i in range(mapp.nb_possible_moves)]
-            # self.win_MAST = [[0,0,0,0] for i in range(mapp.nb_possible_moves)]
-
-        self.playouts_MAST = [0 for i in range(mapp.nb_possible_moves)]
-
-    def add(self, board, amaf: bool):
-        nplayouts = [0.0 for i in range(self.max_moves_for_a_state)]
-        nwins_amaf = None
-        nplayouts_amaf = None
-
-        if board.map.reference == "P22-D3-S34-v1":
-            nwins = [{RED: 0, BLUE: 0} for i in range(self.max_moves_for_a_state)]
-            if amaf is True: # Si on utilise l'algorithme RAVE ou GRAVE, il faut stocker également les statistiques AMAF
-                nwins_amaf = [{RED: 0, BLUE: 0} for i in range(board.map.nb_possible_moves)]
-                nplayouts_amaf = [0 for i in range(board.map.nb_possible_moves)]
-
-        elif board.map.reference == "P32-D3-S48-v1":
-            nwins = [{RED: 0, BLUE: 0, GREEN: 0} for i in range(self.max_moves_for_a_state)]
-            if amaf is True:
-                nwins_amaf = [{RED: 0, BLUE: 0, GREEN: 0} for i in range(board.map.nb_possible_moves)]
-                nplayouts_amaf = [0 for i in range(board.map.nb_possible_moves)]
+        self.colors = list(mapp.player2code)
+        self.nb_columns = max(self.colors) + 1  # Colonnes des tableaux de victoires, indexées par la couleur
+
+        # Réutilisation de l'arbre d'une recherche à l'autre : generation est le numéro de la recherche en cours et
+        # last_seen donne, pour chaque entrée, la dernière recherche pendant laquelle elle a été ajoutée ou consultée.
+        self.generation = 0
+        self.last_seen = {}
+
+        # Table bornée
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.nb_bytes = 0  # Taille estimée des entrées
+        self.entry_time = {}  # game_time de l'état de chaque entrée (politique 'depth')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.descent = set()  # hashcodes des entrées consultées ou ajoutées depuis le début de la descente en cours
+
+        # Vérification des collisions
+        self.verify = verify
+        self.signatures = {}
+        self.collisions = 0
+
+        # Livre d'ouverture
+        self.book = None
+        self.book_hits = 0
+
+        # Cache des coups légaux
+        self.max_cached_moves = max_cached_moves
+        self.moves_cache = {}
+        self.moves_hits = 0
+        self.moves_misses = 0
+
+        # Statistiques MAST : win_MAST[code, couleur] est le nombre de victoires de la couleur dans les playouts où le
+        # coup a été joué (les colonnes sont indexées par la couleur, la colonne 0 n'est pas utilisée). Les compteurs
+        # sont en int64, comme ceux de MastStore et de SharedTree, qui s'accumulent sur beaucoup de parties.
+        self.win_MAST = np.zeros((mapp.nb_possible_moves, max(mapp.player2code) + 1), dtype=np.int64)
+        self.playouts_MAST = np.zeros(mapp.nb_possible_moves, dtype=np.int64)
+
+    def __getstate__(self):
+        # Le cache des coups légaux n'est pas envoyé aux autres processus : il se reconstruit vite et peut être gros
+        state = self.__dict__.copy()
+        state['moves_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        # Les plus anciennes tables (comme big_transposition_table.pkl) appellent win_amaf et playouts_amaf les
+        # statistiques MAST
+        if 'win_MAST' not in state and 'win_amaf' in state:
+            state['win_MAST'] = state.pop('win_amaf')
+            state['playouts_MAST'] = state.pop('playouts_amaf')
+        if 'win_MAST' not in state or 'playouts_MAST' not in state or 'table' not in state:
+            raise ValueError("Format de table non supporté : statistiques MAST ou entrées absentes")
+        # Les tables sauvegardées avant le passage à NumPy stockent win_MAST comme une liste de dictionnaires
+        if isinstance(state['win_MAST'], list):
+            colors = list(state['win_MAST'][0].keys())
+            win_MAST = np.zeros((len(state['win_MAST']), max(colors) + 1), dtype=np.int64)
+            win_MAST[:, colors] = [list(stats.values()) for stats in state['win_MAST']]
+            state['win_MAST'] = win_MAST
+            state['colors'] = colors
+        # Les tables sauvegardées avant le passage à int64 ont des statistiques MAST en int32
+        state['win_MAST'] = np.asarray(state['win_MAST'], dtype=np.int64)
+        state['playouts_MAST'] = np.asarray(state['playouts_MAST'], dtype=np.int64)
+        state.setdefault('nb_columns', max(state['colors']) + 1)
+        # Les entrées sauvegardées avant le passage à NumPy stockent leurs statistiques dans des listes et dictionnaires
+        for entry in state['table'].values():
+            if isinstance(entry[1], list):
+                self.convert_entry(entry, state['nb_columns'])
+        state.setdefault('generation', 0)
+        state.setdefault('last_seen', dict.fromkeys(state['table'], 0))
+        for name, value in [('max_entries', None), ('max_bytes', None), ('policy', 'least_visited'),
+                            ('entry_time', {}), ('hits', 0), ('misses', 0), ('evictions', 0), ('descent', set()),
+                            ('verify', False), ('signatures', {}), ('collisions', 0), ('book', None), ('book_hits', 0),
+                            ('max_cached_moves', 20000), ('moves_cache', {}), ('moves_hits', 0), ('moves_misses', 0)]:
+            state.setdefault(name, value)
+        state.setdefault('nb_bytes', sum(self.entry_bytes(entry) for entry in state['table'].values()))
+        self.__dict__.update(state)
+
+    @staticmethod
+    def convert_entry(entry, nb_columns):
+        # Convertit une entrée de l'ancien format (listes de floats et de dictionnaires de victoires) en tableaux
+        nwins = np.zeros((len(entry[2]), nb_columns), dtype=np.int64)
+        for m, wins in enumerate(entry[2]):
+            for color, value in wins.items():
+                nwins[m, color] = value
+        entry[1] = np.array(entry[1], dtype=np.float64)
+        entry[2] = nwins
+        if len(entry) > 3:
+            codes = np.array(sorted(entry[3]), dtype=np.int64)
+            stats = np.zeros((len(codes), nb_columns), dtype=np.int64)
+            for i, code in enumerate(codes.tolist()):
+                stats[i, 0] = entry[3][code]
+                for color, value in entry[4][code].items():
+                    stats[i, color] = value
+            entry[3] = codes
+            entry[4] = stats
+
+    @staticmethod
+    def entry_bytes(entry):
+        # Taille estimée d'une entrée
+        return ENTRY_BYTES + sum(array.nbytes for array in entry[1:])
+
+    def counters(self):
+        """
+        Compteurs de la table : nombre d'entrées, taille estimée, consultations réussies ou non, entrées supprimées,
+        collisions détectées, entrées lues dans le livre d'ouverture, utilisations du cache des coups légaux
+        """
+        return {'entries': len(self.table), 'bytes': self.nb_bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'collisions': self.collisions, 'book_hits': self.book_hits,
+                'moves_hits': self.moves_hits, 'moves_misses': self.moves_misses}
+
+    def full(self):
+        return ((self.max_entries is not None and len(self.table) >= self.max_entries) or
+                (self.max_bytes is not None and self.nb_bytes >= self.max_bytes))
+
+    def evict(self):
+        """
+        Supprime des entrées dans l'ordre de la politique de remplacement jusqu'à redescendre à 7/8 des bornes
+        """
+        max_entries = None if self.max_entries is None else self.max_entries * 7 // 8
+        max_bytes = None if self.max_bytes is None else self.max_bytes * 7 // 8
+
+        if self.policy == 'lru':
+            victims = list(self.table)  # look() remet les entrées consultées à la fin du dictionnaire
+        elif self.policy == 'depth':
+            victims = sorted(self.table, key=self.entry_time.get, reverse=True)
+        else:
+            victims = sorted(self.table, key=lambda hashcode: self.table[hashcode][0])
+        # Les entrées de la descente en cours vont encore être mises à jour (la racine en fait toujours partie) : on ne
+        # les supprime pas. Celles des recherches précédentes passent en premier (le tri garde l'ordre de la politique
+        # à génération égale).
+        victims = [hashcode for hashcode in victims if hashcode not in self.descent]
+        victims = iter(sorted(victims, key=lambda hashcode: self.last_seen[hashcode] == self.generation))
+
+        while ((max_entries is not None and len(self.table) > max_entries) or
+               (max_bytes is not None and self.nb_bytes > max_bytes)):
+            hashcode = next(victims, None)
+            if hashcode is None:
+                break
+            self.remove(hashcode)
+            self.evictions += 1
+
+    def remove(self, hashcode):
+        self.nb_bytes -= self.entry_bytes(self.table.pop(hashcode))
+        del self.last_seen[hashcode]
+        self.entry_time.pop(hashcode, None)
+        self.signatures.pop(hashcode, None)
+
+    def empty_copy(self):
+        """
+        Table sans entrée avec une copie indépendante des statistiques MAST
+        """
+        table = copy.copy(self)
+        table.table = {}
+        table.last_seen = {}
+        table.generation = 0
+        table.descent = set()
+        table.entry_time = {}
+        table.signatures = {}
+        table.nb_bytes = 0
+        table.hits = table.misses = table.evictions = table.collisions = table.book_hits = 0
+        table.moves_cache = {}
+        table.moves_hits = table.moves_misses = 0
+        table.win_MAST = self.win_MAST.copy()
+        table.playouts_MAST = self.playouts_MAST.copy()
+        return table
+
+    def new_search(self, reuse_tree=False, max_age=2):
+        """
+        Prépare la table pour une nouvelle recherche.
+        Sans reuse_tree, toutes les entrées sont supprimées. Sinon, les entrées restent valables (elles sont indexées par
+        le hashcode de l'état) et on ne supprime que celles qui n'ont été ni ajoutées ni consultées pendant les max_age
+        dernières recherches : ce sont des états qui ne sont plus atteints depuis la position de jeu.
+        """
+        self.descent = set()
+        if not reuse_tree:
+            self.table = {}
+            self.last_seen = {}
+            self.entry_time = {}
+            self.signatures = {}
+            self.nb_bytes = 0
+            return
+
+        self.generation += 1
+        oldest = self.generation - max_age
+        for hashcode in [hashcode for hashcode, generation in self.last_seen.items() if generation < oldest]:
+            self.remove(hashcode)
+
+    def start_descent(self):
+        # Début d'une descente : les entrées qu'elle consulte ou ajoute seront protégées de evict jusqu'à la suivante
+        self.descent = set()
+
+    def mast_rates(self, codes, player):
+        """
+        Taux de victoire MAST de player pour chaque code de codes (0 pour les coups jamais joués)
+        """
+        playouts = self.playouts_MAST[codes]
+        return np.divide(self.win_MAST[codes, player], playouts, out=np.zeros(len(codes)), where=playouts > 0)
+
+    def update_MAST(self, winner, played_moves_codes):
+        # Chaque coup n'est compté qu'une fois par playout
+        codes = np.unique(np.asarray(played_moves_codes, dtype=np.int64))
+        self.playouts_MAST[codes] += 1
+        self.win_MAST[codes, winner] += 1
+
+    @staticmethod
+    def key(board, dice_score=None):
+        """
+        Clé de l'entrée : hashcode de l'état seul (dice_score None) ou du noeud de décision (état, lancer de dé).
+        Les coups légaux dépendent du dé : chaque lancer a son propre noeud, dont les statistiques sont indexées par
+        la position du coup dans board.valid_moves(dice_score).
+        """
+        if dice_score is None:
+            return board.hashcode
+        return board.hashcode ^ DICE_KEYS[dice_score]
+
+    def add(self, board, amaf: bool, nb_moves=0, dice_score=None):
+        """
+        Ajoute une entrée pour l'état de board (et le lancer dice_score) : [n, nplayouts, nwins]
+        (+ [amaf_codes, amaf_stats] avec amaf).
+        Les statistiques sont des tableaux NumPy, pour que la sélection calcule le score de tous les coups d'un coup :
+        nplayouts[m] est le nombre de playouts du coup m et nwins[m, couleur] son nombre de victoires pour la couleur
+        (colonnes indexées par la couleur, la colonne 0 n'est pas utilisée). Ils ne sont alloués que pour nb_moves
+        coups et sont agrandis par grow() à la première visite où l'on connaît les coups légaux.
+        Les statistiques AMAF ne contiennent que les coups joués : amaf_codes est le tableau trié de leurs codes et
+        amaf_stats[i] donne, pour le code amaf_codes[i], le nombre de playouts où il a été joué (colonne 0) et les
+        victoires de chaque couleur (voir amaf_stats()).
+        """
+        nplayouts = np.zeros(nb_moves, dtype=np.float64)
+        nwins = np.zeros((nb_moves, self.nb_columns), dtype=np.int64)
+
+        if amaf is True:  # Si on utilise l'algorithme RAVE ou GRAVE, il faut stocker également les statistiques AMAF
+            self.store(board, [0, nplayouts, nwins, np.zeros(0, dtype=np.int64),
+                               np.zeros((0, self.nb_columns), dtype=np.int64)], dice_score)
         else:
-            print("Pas de référence de map connue dans Table.add()")
-            nwins = None
+            self.store(board, [0, nplayouts, nwins], dice_score)
+
+    def store(self, board, entry, dice_score=None):
+        # Range entry comme entrée de l'état de board (et du lancer dice_score)
+        hashcode = self.key(board, dice_score)
+        if hashcode in self.table:  # Collision détectée par look() : l'entrée est remplacée
+            self.remove(hashcode)
+        if self.full():
+            self.evict()
 
-        if amaf is True:
-            self.table[board.hashcode] = [0, nplayouts, nwins, nplayouts_amaf, nwins_amaf]
+        self.table[hashcode] = entry
+        self.last_seen[hashcode] = self.generation
+        self.descent.add(hashcode)
+        self.nb_bytes += self.entry_bytes(entry)
+        if self.policy == 'depth':
+            self.entry_time[hashcode] = board.game_time
+        if self.verify:
+            self.signatures[hashcode] = board.signature() + bytes([dice_score or 0])
+
+    def valid_moves(self, board, dice_score, with_codes=False):
+        """
+        Coups légaux de board pour dice_score (board.valid_moves), calculés une seule fois par noeud de décision.
+        Ils ne dépendent que de l'état et du dé : le cache reste valable d'une recherche à l'autre. Quand il est plein,
+        on oublie le plus ancien huitième des noeuds. Les coups renvoyés sont partagés et ne doivent pas être modifiés.
+        :param with_codes : Si True, retourne (coups, tableau NumPy de leurs codes), les codes étant gardés dans le cache
+        avec les coups
+        """
+        hashcode = self.key(board, dice_score)
+        cached = self.moves_cache.get(hashcode)
+        # Avec verify, les coups sont gardés avec la signature de l'état : en cas de collision de hashcode, ce sont
+        # les coups d'un autre état, qu'on recalcule comme si le noeud était absent du cache
+        signature = board.signature() + bytes([dice_score]) if self.verify else None
+        if cached is not None and cached[2] == signature:
+            self.moves_hits += 1
         else:
-            self.table[board.hashcode] = [0, nplayouts, nwins]
+            self.moves_misses += 1
+            moves = board.valid_moves(dice_score)
+            cached = (moves, np.array([move.code(board.map) for move in moves], dtype=np.int64), signature)
+            if len(self.moves_cache) >= self.max_cached_moves:
+                for old in list(self.moves_cache)[:max(1, self.max_cached_moves // 8)]:
+                    del self.moves_cache[old]
+            self.moves_cache[hashcode] = cached
+        return cached[:2] if with_codes else cached[0]
+
+    def visits(self, board, dice_score=None):
+        # Nombre de simulations passées par l'entrée (celle qui l'a créée et les n suivantes, 0 si elle n'existe pas),
+        # sans toucher aux compteurs ni à l'ordre LRU
+        entry = self.table.get(self.key(board, dice_score))
+        return 0 if entry is None else entry[0] + 1
+
+    def grow(self, entry, nb_moves):
+        # On agrandit les statistiques de l'entrée pour qu'elles couvrent nb_moves coups
+        missing = nb_moves - len(entry[1])
+        if missing > 0:
+            entry[1] = np.concatenate((entry[1], np.zeros(missing)))
+            entry[2] = np.concatenate((entry[2], np.zeros((missing, entry[2].shape[1]), dtype=np.int64)))
+            self.nb_bytes += missing * (entry[1].itemsize + entry[2].itemsize * entry[2].shape[1])
 
-    def look(self, board):  # Retourne None, si l'état n'est pas présent dans la table.
-        return self.table.get(board.hashcode, None)
+    def wins_by_color(self, entry, nb_moves=None):
+        # Victoires de chaque couleur pour les nb_moves premiers coups de l'entrée (dictionnaires couleur -> victoires)
+        return [dict(zip(self.colors, wins)) for wins in entry[2][:nb_moves, self.colors].tolist()]
 
+    @staticmethod
+    def amaf_stats(entry, codes):
+        """
+        Statistiques AMAF de entry pour chaque code de codes (tableau d'entiers) : tableau (len(codes), colonnes) dont
+        la colonne 0 est le nombre de playouts où le coup a été joué et la colonne d'une couleur son nombre de victoires
+        (des zéros pour les codes jamais joués)
+        """
+        amaf_codes, stats = entry[3], entry[4]
+        index = np.searchsorted(amaf_codes, codes)
+        found = index < len(amaf_codes)
+        found[found] = amaf_codes[index[found]] == codes[found]
+        result = np.zeros((len(codes), stats.shape[1]), dtype=np.int64)
+        result[found] = stats[index[found]]
+        return result
 
+    def update_AMAF(self, entry, winner, played_moves_codes):
+        codes = np.sort(np.asarray(played_moves_codes, dtype=np.int64))
+        unique = np.ones(len(codes), dtype=bool)
+        unique[1:] = codes[1:] != codes[:-1]
+        codes = codes[unique]  # Chaque coup n'est compté qu'une fois
+        amaf_codes = entry[3]
+        index = np.searchsorted(amaf_codes, codes)
+        found = index < len(amaf_codes)
+        found[found] = amaf_codes[index[found]] == codes[found]
+        if not found.all():  # Des coups joués pour la première fois : on les insère à leur place
+            amaf_codes = np.concatenate((amaf_codes, codes[~found]))
+            order = np.argsort(amaf_codes)
+            stats = np.concatenate((entry[4], np.zeros((len(codes) - found.sum(), entry[4].shape[1]), dtype=np.int64)))
+            self.nb_bytes += amaf_codes.nbytes + stats.nbytes - entry[3].nbytes - entry[4].nbytes
+            entry[3], entry[4] = amaf_codes[order], stats[order]
+            index = np.searchsorted(entry[3], codes)
+        entry[4][index, 0] += 1  # Nb de fois que le coup a été joué
+        entry[4][index, winner] += 1  # mise à jour du nb de victoires.
 
+    def use_book(self, book, board):
+        """
+        Utilise book (src.book.Book) pour les états absents de la table : leur entrée est lue dans le livre à la première
+        consultation puis rangée dans la table. Retourne False si le livre n'a pas été construit avec les clés de
+        Zobrist de board (ses hashcodes ne correspondraient pas aux mêmes états).
+        """
+        if not book.matches(board):
+            print("Le livre n'a pas été construit avec les clés de Zobrist de ce plateau")
+            return False
+        self.book = book
+        return True
+
+    def look(self, board, dice_score=None):  # Retourne None, si l'état n'est pas présent dans la table.
+        hashcode = self.key(board, dice_score)
+        entry = self.table.get(hashcode, None)
+        if entry is not None and self.verify and \
+                self.signatures[hashcode] != board.signature() + bytes([dice_score or 0]):
+            self.collisions += 1
+            entry = None
+        if entry is None and self.book is not None:
+            entry = self.book.get(hashcode)
+            if entry is not None:
+                self.book_hits += 1
+                self.store(board, entry, dice_score)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.last_seen[hashcode] = self.generation
+            self.descent.add(hashcode)
+            if self.policy == 'lru':  # L'entrée passe à la fin de l'ordre du dictionnaire
+                del self.table[hashcode]
+                self.table[hashcode] = entry
+        return entry
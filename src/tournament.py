@@ -0,0 +1,236 @@
+# Moteur de tournoi : fait jouer des agents (algorithme + paramètres) les uns contre les autres sur un grand nombre de
+# parties réparties entre plusieurs processus, et agrège les taux de victoire avec leurs intervalles de confiance.
+
+import json
+import math
+import queue
+import random
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from src.board import Board
+from src.utils import figs2gif
+from src.algos import flat, UCB, best_move_UCT, best_move_UCT_pas_MAST, best_move_RAVE, best_move_GRAVE
+
+# Fonctions de choix de coup utilisables par un agent. Elles sont toutes appelées avec
+# (board, dice_score, nb_playouts, **params).
+ALGOS = {'flat': flat,
+         'UCB': UCB,
+         'UCT': best_move_UCT,
+         'UCT_pas_MAST': best_move_UCT_pas_MAST,
+         'RAVE': best_move_RAVE,
+         'GRAVE': best_move_GRAVE}
+
+
+class Agent:
+    def __init__(self, algo, nb_playouts, name=None, **params):
+        """
+        Description d'un joueur du tournoi.
+        :param algo : clé de ALGOS (ValueError sinon)
+        :param nb_playouts : nombre de playouts par coup
+        :param name : nom affiché dans les résultats (algo par défaut)
+        :param params : paramètres passés à la fonction de l'algorithme (mode, c, mast_param, beta_param, treshold...)
+        """
+        if algo not in ALGOS:
+            raise ValueError(f"Algorithme inconnu : {algo}")
+        self.algo = algo
+        self.nb_playouts = nb_playouts
+        self.name = algo if name is None else name
+        self.params = params
+
+    def best_move(self, board: Board, dice_score):
+        return ALGOS[self.algo](board, dice_score, self.nb_playouts, **self.params)
+
+    def __repr__(self):
+        return f"{self.name}({self.algo}, {self.nb_playouts} playouts, {self.params})"
+
+
+def seats_order(board: Board):
+    # Couleurs dans l'ordre de jeu à partir du joueur qui a le trait
+    seats = [board.turn]
+    while board.map.next_player[seats[-1]] != seats[0]:
+        seats.append(board.map.next_player[seats[-1]])
+    return seats
+
+
+# Plateau de départ, agents et MastStore du tournoi en cours dans ce processus (voir init_game_worker)
+game_setup = {}
+
+
+def init_game_worker(board: Board, agents, mast_store):
+    """
+    Initialisation d'un processus du pool : le plateau (avec sa table et ses statistiques MAST, qui font près d'1 Mo)
+    et les agents ne sont envoyés qu'une fois par processus au lieu d'une fois par partie.
+    """
+    game_setup['board'] = board
+    game_setup['agents'] = agents
+    game_setup['mast_store'] = mast_store
+
+
+def play_game(job):
+    """
+    Joue une partie du tournoi et renvoie (indice de la partie, vainqueur, couleurs des agents, game_time, durée).
+    Chaque agent utilise sa propre table, dont les statistiques MAST partent de celles de board (ou de celles de
+    mast_store, auquel on ajoute à la fin de la partie ce que les agents ont appris).
+    Doit rester une fonction du module pour pouvoir être envoyée aux processus du pool, initialisés par
+    init_game_worker.
+    """
+    colors, game_index, seed, game_time_limit, gif_name = job
+    board, agents, mast_store = game_setup['board'], game_setup['agents'], game_setup['mast_store']
+    random.seed(seed)
+    np.random.seed(seed)
+    start_time = time.perf_counter()
+
+    board = board.copy()
+    start_table = board.transposition_table.empty_copy()
+    if mast_store is not None:
+        mast_store.load(start_table)
+    # Chaque agent a sa propre table (statistiques MAST et arbre, qu'il peut réutiliser d'un coup à l'autre)
+    tables = {color: start_table.empty_copy() for color in colors}
+    color2agent = dict(zip(colors, agents))
+
+    figures = [board.display('names')] if gif_name is not None else []
+    while not board.over and (game_time_limit is None or board.game_time < game_time_limit):
+        color = board.turn
+        board.transposition_table = tables[color]
+        dice_score = random.randint(1, board.map.max_dice)
+        board.play(color2agent[color].best_move(board, dice_score))
+        if gif_name is not None:
+            figures.append(board.display('names'))
+
+    if gif_name is not None:
+        figs2gif(figures, name=gif_name)
+
+    if mast_store is not None:
+        start_playouts = start_table.playouts_MAST.copy()
+        start_wins = start_table.win_MAST.copy()
+        mast_store.merge(sum(table.playouts_MAST - start_playouts for table in tables.values()),
+                         sum(table.win_MAST - start_wins for table in tables.values()))
+
+    return game_index, board.winner, colors, board.game_time, time.perf_counter() - start_time
+
+
+def imap_bounded(pool, func, jobs, max_pending):
+    """
+    Comme pool.imap_unordered, mais au plus max_pending tâches sont envoyées au pool sans que leur résultat ait été
+    lu : la file des tâches reste courte, et pool.terminate() ne risque pas de rester bloqué sur son envoi.
+    Une exception levée par func est relevée ici.
+    """
+    done = queue.Queue()
+    jobs = iter(jobs)
+    nb_pending = 0
+    for job in jobs:
+        pool.apply_async(func, (job,), callback=done.put, error_callback=done.put)
+        nb_pending += 1
+        if nb_pending < max_pending:
+            continue
+        result = done.get()
+        nb_pending -= 1
+        if isinstance(result, BaseException):
+            raise result
+        yield result
+    while nb_pending > 0:
+        result = done.get()
+        nb_pending -= 1
+        if isinstance(result, BaseException):
+            raise result
+        yield result
+
+
+def wilson_interval(wins, games, z=1.96):
+    """
+    Intervalle de confiance de Wilson (à 95% par défaut) pour un taux de victoire.
+    """
+    if games == 0:
+        return 0.0, 1.0
+    rate = wins / games
+    center = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    half_width = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def run_tournament(board: Board, agents, nb_games, nb_workers=1, rotate_seats=False, game_time_limit=None,
+                   seed=None, results_path=None, save_gif=0, name="tournament", mast_store=None):
+    """
+    Fait jouer nb_games parties entre les agents à partir de board et affiche les résultats au fil des parties.
+    L'agent i joue la i-ème couleur dans l'ordre de jeu (décalée de g pour la partie g si rotate_seats).
+    :param nb_workers : nombre de processus qui jouent les parties (1 : tout est joué dans ce processus)
+    :param game_time_limit : nombre de tours au-delà duquel une partie est arrêtée sans vainqueur
+    :param seed : graine des parties (les graines de chaque partie en sont tirées)
+    :param results_path : fichier auquel on ajoute une ligne JSON par partie terminée
+    :param save_gif : nombre de premières parties dont on enregistre un gif
+    :param mast_store : MastStore dont les agents chargent les statistiques MAST au début de chaque partie et auquel
+    ils ajoutent ce qu'ils ont appris à la fin (None : les statistiques MAST partent de celles de board)
+    :return : dictionnaire nom de l'agent -> {'wins', 'games', 'rate', 'ci'}
+    """
+    seats = seats_order(board)
+    if len(agents) != len(seats):
+        print(f"Il faut {len(seats)} agents pour cette map")
+        return None
+
+    names = [agent.name for agent in agents]
+    if len(set(names)) < len(names):  # Noms en double : on les numérote
+        names = [f"{name}#{i + 1}" for i, name in enumerate(names)]
+
+    if seed is None:
+        seed = random.getrandbits(32)
+    seeds = np.random.SeedSequence(seed).generate_state(nb_games)
+
+    jobs = []
+    for g in range(nb_games):
+        shift = g % len(seats) if rotate_seats else 0
+        colors = [seats[(i + shift) % len(seats)] for i in range(len(agents))]
+        gif_name = f"{name}_game{g + 1}.gif" if g < save_gif else None
+        jobs.append((colors, g, int(seeds[g]), game_time_limit, gif_name))
+
+    wins = [0 for i in range(len(agents))]
+    nb_finished = 0
+    nb_draws = 0
+
+    if nb_workers > 1:
+        pool = Pool(nb_workers, initializer=init_game_worker, initargs=(board, agents, mast_store))
+        results = imap_bounded(pool, play_game, jobs, 2 * nb_workers)
+    else:
+        pool = None
+        init_game_worker(board, agents, mast_store)
+        results = map(play_game, jobs)
+
+    try:
+        for game_index, winner, colors, game_time, duration in results:
+            nb_finished += 1
+            if winner is None:
+                nb_draws += 1
+                winner_name = None
+            else:
+                wins[colors.index(winner)] += 1
+                winner_name = names[colors.index(winner)]
+
+            print(f"Partie {game_index + 1} ({nb_finished}/{nb_games}) : {winner_name} gagne - game_time : {game_time}"
+                  f" ({round(duration, 1)}s) - " + " / ".join(f"{names[i]} {wins[i]}" for i in range(len(agents))))
+
+            if results_path is not None:
+                with open(results_path, "a") as f:
+                    f.write(json.dumps({'tournament': name, 'game': game_index, 'winner': winner_name,
+                                        'colors': {names[i]: int(colors[i]) for i in range(len(agents))},
+                                        'game_time': game_time, 'duration': duration}) + "\n")
+    except BaseException:  # Erreur ou Ctrl-C : on n'attend pas la fin des parties en cours
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    summary = {}
+    for i in range(len(agents)):
+        low, high = wilson_interval(wins[i], nb_finished)
+        summary[names[i]] = {'wins': wins[i], 'games': nb_finished, 'rate': wins[i] / max(nb_finished, 1),
+                             'ci': (low, high)}
+        print(f"{names[i]} : {wins[i]}/{nb_finished} ({round(100 * summary[names[i]]['rate'], 1)}%, "
+              f"IC 95% [{round(100 * low, 1)}%, {round(100 * high, 1)}%])")
+    if nb_draws > 0:
+        print(f"Parties sans vainqueur : {nb_draws}")
+    return summary
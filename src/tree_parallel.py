@@ -0,0 +1,359 @@
+# Parallélisation de UCT dans l'arbre : plusieurs processus descendent le même arbre, stocké en mémoire partagée.
+# Chaque descente pose une perte virtuelle sur les arêtes qu'elle emprunte pour que les autres processus explorent
+# d'autres branches, et la remontée des résultats se fait sous verrou.
+
+import random
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from src.board import Board
+from src.playout import run_playout
+from src.algos import most_simulated_move
+
+NB_LOCKS = 64  # Nombre de verrous qui se partagent les noeuds (le noeud i est protégé par le verrou i % NB_LOCKS)
+
+
+class SharedTree:
+    """
+    Arbre de recherche en mémoire partagée.
+    Un noeud correspond à un état et à un lancer de dé (l'état seul détermine le joueur, le dé détermine les coups).
+    Il est retrouvé par une table de hachage à adressage ouvert (slot_hash, slot_dice, slot_node) et ses arêtes sont
+    allouées d'un bloc dans le pool d'arêtes à sa deuxième visite, une arête par coup légal dans l'ordre de
+    Board.valid_moves.
+    """
+
+    def __init__(self, max_nodes, max_edges, nb_colors, nb_possible_moves, shm_names=None):
+        self.nb_slots = 1 << int(2 * max_nodes).bit_length()
+        self.max_nodes = max_nodes
+        self.max_edges = max_edges
+
+        self.layout = {
+            # compteurs : nombre de noeuds, nombre d'arêtes allouées, nombre de simulations terminées
+            'counters': ((3,), np.int64),
+            'slot_hash': ((self.nb_slots,), np.uint64),
+            'slot_dice': ((self.nb_slots,), np.int8),
+            'slot_node': ((self.nb_slots,), np.int32),
+            'node_visits': ((max_nodes,), np.int64),
+            'node_virtual': ((max_nodes,), np.int32),
+            'node_first_edge': ((max_nodes,), np.int64),
+            'node_nb_edges': ((max_nodes,), np.int32),
+            'edge_visits': ((max_edges,), np.int32),
+            'edge_virtual': ((max_edges,), np.int32),
+            'edge_wins': ((max_edges, nb_colors), np.int32),
+            # int64 comme les statistiques chargées d'un MastStore
+            'win_MAST': ((nb_possible_moves, nb_colors), np.int64),
+            'playouts_MAST': ((nb_possible_moves,), np.int64),
+        }
+
+        self.owner = shm_names is None
+        self.shms = {}
+        for name, (shape, dtype) in self.layout.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if self.owner:
+                shm = SharedMemory(create=True, size=size)
+            else:
+                shm = SharedMemory(name=shm_names[name])
+            self.shms[name] = shm
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+        if self.owner:
+            # Les blocs créés sont remplis de zéros : on n'écrit que ce qui ne vaut pas 0 au départ, les pages du pool
+            # d'arêtes ne sont ainsi réservées qu'au fur et à mesure de l'allocation
+            self.slot_node[:] = -1
+            self.node_nb_edges[:] = -1  # -1 : arêtes pas encore allouées
+
+    def attach_args(self):
+        # Ce qu'il faut envoyer à un processus pour qu'il s'attache aux mêmes blocs de mémoire
+        return (self.max_nodes, self.max_edges, self.edge_wins.shape[1], len(self.playouts_MAST),
+                {name: shm.name for name, shm in self.shms.items()})
+
+    def close(self):
+        for name in self.layout:
+            delattr(self, name)  # Les vues NumPy doivent disparaître avant de fermer les blocs
+        for shm in self.shms.values():
+            shm.close()
+            if self.owner:
+                shm.unlink()
+
+    def slot(self, hashcode, dice_score):
+        # Premier slot à essayer pour la clé (hashcode, dice_score)
+        return (hashcode * 31 + dice_score) & (self.nb_slots - 1)
+
+    def find(self, hashcode, dice_score):
+        """
+        Retourne l'indice du noeud (hashcode, dice_score), ou -1 s'il n'existe pas.
+        Sans verrou : un slot est publié en écrivant slot_node en dernier.
+        """
+        i = self.slot(hashcode, dice_score)
+        while True:
+            node = int(self.slot_node[i])
+            if node == -1:
+                return -1
+            if self.slot_hash[i] == hashcode and self.slot_dice[i] == dice_score:
+                return node
+            i = (i + 1) & (self.nb_slots - 1)
+
+    def insert(self, hashcode, dice_score, lock):
+        """
+        Crée le noeud (hashcode, dice_score) s'il n'existe pas encore et retourne son indice (-1 si l'arbre est plein).
+        """
+        with lock:
+            i = self.slot(hashcode, dice_score)
+            while True:
+                node = int(self.slot_node[i])
+                if node == -1:
+                    break
+                if self.slot_hash[i] == hashcode and self.slot_dice[i] == dice_score:
+                    return node  # Un autre processus l'a créé entre temps
+                i = (i + 1) & (self.nb_slots - 1)
+
+            node = int(self.counters[0])
+            if node >= self.max_nodes:
+                return -1
+            self.counters[0] = node + 1
+            self.slot_hash[i] = hashcode
+            self.slot_dice[i] = dice_score
+            self.slot_node[i] = node
+            return node
+
+    def allocate_edges(self, node, nb_edges, lock):
+        """
+        Réserve nb_edges arêtes pour node. Doit être appelée avec le verrou du noeud.
+        Retourne False si le pool d'arêtes est plein.
+        """
+        if self.node_nb_edges[node] >= 0:
+            return True
+        with lock:
+            first = int(self.counters[1])
+            if first + nb_edges > self.max_edges:
+                return False
+            self.counters[1] = first + nb_edges
+        self.node_first_edge[node] = first
+        self.node_nb_edges[node] = nb_edges
+        return True
+
+
+def select_edge(tree: SharedTree, node, player, c):
+    """
+    Formule UCB sur les arêtes de node, en comptant les pertes virtuelles comme des visites sans victoire.
+    Les arêtes jamais visitées (ni en cours de visite) sont prioritaires. Doit être appelée avec le verrou du noeud.
+    """
+    first = int(tree.node_first_edge[node])
+    edges = slice(first, first + int(tree.node_nb_edges[node]))
+    visits = tree.edge_visits[edges] + tree.edge_virtual[edges]
+    parent_visits = int(tree.node_visits[node]) + int(tree.node_virtual[node])
+
+    scores = np.full(len(visits), 1000000.0)
+    seen = visits > 0
+    scores[seen] = (tree.edge_wins[edges][seen, player] / visits[seen] +
+                    c * np.sqrt(np.log(max(parent_visits, 1)) / visits[seen]))
+    best_moves = np.flatnonzero(scores == scores.max())
+    return int(best_moves[random.randrange(len(best_moves))])
+
+
+def tree_parallel_worker(board: Board, dice_score, nb_playouts, seed, tree_args, locks, alloc_lock, mast_lock,
+                         mode, c, mast_param, virtual_loss, time_budget):
+    """
+    Fait nb_playouts descentes dans l'arbre partagé à partir de board (ou autant que possible en time_budget secondes,
+    le temps qui restait au processus principal quand il a lancé les processus).
+    Comme dans UCT, un noeud est créé à sa première visite (on fait alors un playout depuis l'état), et le dé est
+    relancé au hasard après chaque coup.
+    """
+    # L'échéance est calculée avec l'horloge de ce processus
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    random.seed(seed)
+    np.random.seed(seed)
+    tree = SharedTree(*tree_args)
+    table = board.transposition_table
+    table.win_MAST = tree.win_MAST
+    table.playouts_MAST = tree.playouts_MAST
+
+    nb_simulations = 0
+    while ((nb_playouts is None or nb_simulations < nb_playouts) and
+           (deadline is None or time.perf_counter() < deadline)):
+        played_moves_codes = []
+        path = []  # (noeud, arête) traversés, arête = -1 si le joueur passe son tour
+        undos = []
+        dice = dice_score
+
+        while not board.over:
+            hashcode = int(board.hashcode)
+            node = tree.find(hashcode, dice)
+            if node == -1:
+                node = tree.insert(hashcode, dice, alloc_lock)
+                # Noeud créé (ou arbre plein) : on finit la descente par un playout
+                winner = run_playout(board, played_moves_codes, exploration_parameter=mast_param, mode=mode)
+                if node != -1:
+                    path.append((node, None))
+                break
+
+            moves = board.valid_moves(dice)
+            lock = locks[node % NB_LOCKS]
+            if len(moves) == 0:
+                edge = -1
+                with lock:
+                    tree.node_virtual[node] += virtual_loss
+            else:
+                with lock:
+                    if not tree.allocate_edges(node, len(moves), alloc_lock):
+                        edge = None
+                    else:
+                        choice = select_edge(tree, node, moves[0].player, c)
+                        edge = int(tree.node_first_edge[node]) + choice
+                        tree.node_virtual[node] += virtual_loss
+                        tree.edge_virtual[edge] += virtual_loss
+                if edge is None:  # Plus de place pour les arêtes : on évalue l'état par un playout
+                    winner = run_playout(board, played_moves_codes, exploration_parameter=mast_param, mode=mode)
+                    break
+
+            path.append((node, edge))
+            if edge == -1:
+                undos.append(board.play(None))
+            else:
+                move = moves[choice]
+                undos.append(board.play(move))
+                played_moves_codes.append(move.code(board.map))
+            dice = random.randint(1, board.map.max_dice)
+        else:
+            winner = board.winner
+
+        # Remontée du résultat : on retire les pertes virtuelles et on ajoute la vraie visite
+        for node, edge in path:
+            with locks[node % NB_LOCKS]:
+                if edge is None:  # Le noeud vient d'être créé, on ne compte pas de visite (comme UCT)
+                    continue
+                tree.node_visits[node] += 1
+                tree.node_virtual[node] -= virtual_loss
+                if edge >= 0:
+                    tree.edge_virtual[edge] -= virtual_loss
+                    tree.edge_visits[edge] += 1
+                    tree.edge_wins[edge, winner] += 1
+
+        for undo in reversed(undos):
+            board.unplay(undo)
+
+        with mast_lock:
+            table.update_MAST(winner, played_moves_codes)
+            tree.counters[2] += 1
+        nb_simulations += 1
+
+    table.win_MAST = None
+    table.playouts_MAST = None
+    tree.close()
+
+
+def join_workers(workers):
+    """
+    Attend la fin des processus. Si l'un d'eux s'arrête sur une erreur, les autres sont arrêtés (ils pourraient
+    attendre indéfiniment un verrou qu'il tenait) et on lève une RuntimeError.
+    """
+    running = list(workers)
+    while running:
+        wait([worker.sentinel for worker in running])
+        for worker in [worker for worker in running if worker.exitcode is not None]:
+            running.remove(worker)
+            worker.join()
+            if worker.exitcode != 0:
+                for other in running:
+                    other.terminate()
+                for other in running:
+                    other.join()
+                raise RuntimeError(f"Un processus de la recherche s'est arrêté avec le code {worker.exitcode}")
+
+
+def best_move_UCT_tree_parallel(board: Board, dice_score, nb_playouts, nb_workers, mode=1, c=0.4, mast_param=0.5,
+                                virtual_loss=1, seed=None, max_edges=None, time_budget=None, max_nodes=None,
+                                stats=None):
+    """
+    UCT parallélisé dans l'arbre : nb_workers processus font chacun leur part des nb_playouts descentes dans le même
+    arbre partagé. Retourne le coup le plus simulé de la racine. Les statistiques MAST de board sont mises à jour avec
+    les playouts de tous les processus et l'entrée de la racine est recopiée dans la table de board.
+    :param virtual_loss : nombre de visites perdantes ajoutées à une arête tant qu'une descente l'emprunte
+    :param max_edges : taille du pool d'arêtes (64 arêtes par noeud par défaut)
+    :param time_budget : durée maximale de la recherche, en secondes (None pour ne pas limiter). Le démarrage des
+    processus est pris sur ce temps.
+    :param max_nodes : nombre maximum de noeuds de l'arbre (nb_playouts + 1 par défaut, 2^15 sans nb_playouts).
+    Quand l'arbre est plein, les descentes se terminent par un playout sans créer de noeud.
+    :param stats : dictionnaire rempli comme par most_simulated_move
+    Il faut nb_playouts ou time_budget, sinon la fonction affiche un message et retourne None.
+    """
+    start_time = time.perf_counter()
+    if nb_playouts is None and time_budget is None:  # max_nodes ne fait que borner la taille de l'arbre
+        print("Il faut un budget pour la recherche : nb_playouts ou time_budget")
+        return None
+    board.transposition_table.new_search()
+    moves = board.valid_moves(dice_score)
+    if len(moves) == 0:
+        print("Pas de coups possibles")
+        return None
+    elif len(moves) == 1:
+        return most_simulated_move(board, moves, stats, 0, start_time)
+
+    table = board.transposition_table
+    nb_colors = table.win_MAST.shape[1]
+    if max_nodes is None:
+        max_nodes = nb_playouts + 1 if nb_playouts is not None else 1 << 15
+    if max_edges is None:
+        max_edges = 64 * max_nodes
+    tree = SharedTree(max_nodes, max_edges, nb_colors, len(table.playouts_MAST))
+    workers = []
+    try:
+        tree.win_MAST[:] = table.win_MAST
+        tree.playouts_MAST[:] = table.playouts_MAST
+
+        locks = [mp.Lock() for i in range(NB_LOCKS)]
+        alloc_lock = mp.Lock()
+        mast_lock = mp.Lock()
+
+        # La racine est créée avec ses arêtes pour que tous les processus partent de ses statistiques
+        root = tree.insert(int(board.hashcode), dice_score, alloc_lock)
+        tree.allocate_edges(root, len(moves), alloc_lock)
+
+        if seed is None:
+            seed = random.getrandbits(32)
+        seeds = np.random.SeedSequence(seed).generate_state(nb_workers)
+
+        time_left = None if time_budget is None else max(0.0, start_time + time_budget - time.perf_counter())
+        budgets = [None if nb_playouts is None else nb_playouts // nb_workers + (i < nb_playouts % nb_workers)
+                   for i in range(nb_workers)]
+        workers = [mp.Process(target=tree_parallel_worker,
+                              args=(board, dice_score, budgets[i], int(seeds[i]), tree.attach_args(), locks, alloc_lock,
+                                    mast_lock, mode, c, mast_param, virtual_loss, time_left))
+                   for i in range(nb_workers)]
+        for worker in workers:
+            worker.start()
+        join_workers(workers)
+
+        table.win_MAST[:] = tree.win_MAST
+        table.playouts_MAST[:] = tree.playouts_MAST
+
+        first = int(tree.node_first_edge[root])
+        visits = tree.edge_visits[first:first + len(moves)].tolist()
+        wins = tree.edge_wins[first:first + len(moves)]
+        board.new_table_entry(amaf=False, nb_moves=len(moves), dice_score=dice_score)
+        t = board.look_table(dice_score)
+        t[0] = int(tree.node_visits[root])
+        t[1][:] = visits
+        t[2][:] = wins
+
+        best_value = max(visits)
+        best_moves = [m for m in range(len(moves)) if visits[m] == best_value]
+
+        if stats is not None:
+            stats['simulations'] = int(tree.counters[2])
+            stats['time'] = time.perf_counter() - start_time
+            stats['nodes'] = int(tree.counters[0])
+            stats['visits'] = t[1].tolist()
+            stats['wins'] = table.wins_by_color(t)
+            stats['table'] = table.counters()
+        return moves[random.Random(seed).choice(best_moves)]
+    finally:
+        for worker in workers:  # Arrêt des processus restants si la recherche a été interrompue
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        tree.close()
@@ -1,8 +1,13 @@
+import copy
+import math
+import os
 import pickle
 import time
 import unittest
+from functools import partial
 import random
-from unittest import skip
+import tempfile
+from unittest import mock, skip
 
 import numpy as np
 from matplotlib import pyplot as plt
@@ -11,6 +16,13 @@ from src.map import Map
 from src.move import Move
 from src.board import Board
 from src.table import Table
+from src.book import Book, write_book
+from src.mast_store import MastStore
+from src.playout import run_playout
+from src.algos import best_move_UCT, best_move_RAVE, best_move_GRAVE, select_UCB, select_RAVE, descend, backup, \
+    rave_policy
+from src.tree_parallel import best_move_UCT_tree_parallel
+from src.tournament import Agent, run_tournament, wilson_interval
 from main import generate_hash_structures
 from src.utils import plot_fig
 
@@ -115,6 +127,61 @@ class TestHashcode(unittest.TestCase):
         self.assertEqual(hash1, hash2)
 
 
+    def test_unplay(self):
+        # Jouer puis annuler une suite de coups doit restaurer exactement l'état de départ
+        random.seed(3)
+        b = Board(hash_table=self.hash_table, hash_turn=self.hash_turn, mapp=Map("P22-D3-S34-v1"))
+        for i in range(40):
+            moves = b.valid_moves(random.randint(1, 3))
+            b.play(random.choice(moves) if moves else None)
+
+        state = (list(b.contents), {c: list(p) for c, p in b.piece_pools.items()}, b.turn, b.game_time, b.hashcode)
+        undos = []
+        while not b.over and len(undos) < 300:
+            moves = b.valid_moves(random.randint(1, 3))
+            undos.append(b.play(random.choice(moves) if moves else None))
+
+        for undo in reversed(undos):
+            b.unplay(undo)
+
+        self.assertFalse(b.over)
+        self.assertIsNone(b.winner)
+        self.assertEqual((list(b.contents), b.piece_pools, b.turn, b.game_time, b.hashcode), state)
+
+
+class TestMap(unittest.TestCase):
+
+    def test_adjacency(self):
+        # L'adjacence CSR doit correspondre exactement au graphe de la map
+        for ref in [REF2, REF3]:
+            mapp = Map(ref)
+            for i, node in enumerate(mapp.nodes):
+                neighbours = {mapp.nodes[j] for j in mapp.neighbours(i)}
+                self.assertEqual(neighbours, set(mapp.graph.neighbors(node)))
+
+    def test_dice_paths(self):
+        # Les chemins précalculés doivent être ceux renvoyés par un parcours en largeur sur le graphe
+        import networkx as nx
+        mapp = Map(REF3)
+        for start, node in enumerate(mapp.nodes):
+            for dice in range(1, mapp.max_dice + 1):
+                expected = [path for path in nx.single_source_shortest_path(mapp.graph, node, cutoff=dice).values()
+                            if len(path) == dice + 1]
+                self.assertEqual([list(names) for _, _, names in mapp.dice_paths[start][dice]], expected)
+                for k, (end, path, _) in enumerate(mapp.dice_paths[start][dice]):
+                    self.assertEqual(list(mapp.path_table[start, dice, k, :dice + 1]), list(path))
+                self.assertEqual(mapp.path_counts[start, dice], len(expected))
+
+    def test_board_view(self):
+        # Le graphe renvoyé par Board.board doit refléter le vecteur de contenu
+        b = Board(mapp=Map(REF2))
+        b.change_content('e7', BLOCK)
+        b.change_content('c1', RED)
+        for node, data in b.board.nodes(data=True):
+            self.assertEqual(data['content'], b.get_content(node))
+        self.assertEqual(b.map.graph.nodes['e7']['content'], EMPTY)
+
+
 class TestMove(unittest.TestCase):
 
     def setUp(self):
@@ -171,6 +238,23 @@ class TestMove(unittest.TestCase):
         self.assertEqual(artificial_move.code(self.map), red_code1)
 
 
+    def test_encode_decode(self):
+        # Le code d'un coup ne doit pas dépendre du placement donné après la construction
+        m = Move(RED, 'c4', 'b3', BLOCK, ['c4', 'c3', 'b3'], 2)
+        m.chosen_placement = 'e7'
+        code = m.code(self.map)
+        self.assertEqual(code, self.map.encode_move(RED, 'c4', 'b3', BLOCK, 'e7'))
+        self.assertEqual(self.map.decode_move(code), (RED, 'c4', 'b3', 'e7'))
+
+        m.chosen_placement = 'e8'
+        self.assertEqual(self.map.decode_move(m.code(self.map)), (RED, 'c4', 'b3', 'e8'))
+
+        for move in self.b.valid_moves(1):
+            player, start, end, option = self.map.decode_move(move.code(self.map))
+            self.assertEqual((player, start, end, option), (move.player, move.start_node, move.end_node,
+                                                            self.map.content2code[move.content_end_node]))
+
+
 class TestBoard2Players(unittest.TestCase):
 
     def setUp(self):
@@ -204,6 +288,535 @@ class TestBoard2Players(unittest.TestCase):
         for i in range(len(moves)):
             self.assertEqual(str(moves[i]), str(moves_bis[i]))
 
+    def test_copy(self):
+        # La copie partage la table de transposition mais pas l'état du plateau
+        self.b.change_content('c1', RED)
+        self.b.piece_pools[RED][1] -= 1
+        cop = self.b.copy()
+
+        self.assertIs(cop.transposition_table, self.b.transposition_table)
+        self.assertIs(cop.map, self.b.map)
+        self.assertEqual(cop.hashcode, self.b.hashcode)
+
+        cop.play(cop.valid_moves(1)[0])
+        self.assertEqual(self.b.get_content('c1'), RED)
+        self.assertEqual(self.b.piece_pools[RED][1], 1)
+        self.assertEqual(self.b.turn, RED)
+        self.assertEqual(self.b.game_time, 0)
+
+    def test_run_playout(self):
+        # Rejouer les codes renvoyés par le noyau de playout avec Board.play doit donner le même état final
+        for mode in [1, 2]:
+            played = []
+            b = self.b.copy()
+            winner = run_playout(b, played, exploration_parameter=0.3, mode=mode, apply=True)
+
+            replay = self.b.copy()
+            for code in played:
+                found = None
+                while found is None:
+                    for dice_score in range(1, 4):
+                        for m in replay.valid_moves(dice_score):
+                            if m.code(replay.map) == code:
+                                found = m
+                    if found is None:  # Le joueur a dû passer son tour
+                        replay.play(None)
+                replay.play(found)
+
+            self.assertEqual(winner, replay.winner)
+            self.assertEqual(list(b.contents), list(replay.contents))
+            self.assertEqual(b.piece_pools, replay.piece_pools)
+            self.assertEqual(b.hashcode, replay.hashcode)
+
+    def test_playout_batch(self):
+        self.b.change_content("e5", RED)
+        self.b.piece_pools[RED][1] -= 1
+        state = (list(self.b.contents), self.b.hashcode, self.b.turn)
+
+        for mode in [1, 2]:
+            winners, played_sets = self.b.playout_batch(200, exploration_parameter=0.3, mode=mode)
+            self.assertEqual(len(winners), 200)
+            self.assertEqual(len(played_sets), 200)
+            self.assertTrue(set(winners) <= {RED, BLUE})
+            for played in played_sets:
+                self.assertGreater(len(played), 0)
+                self.assertEqual(len(set(played)), len(played))
+                self.assertTrue(all(0 <= code < self.b.map.nb_possible_moves for code in played))
+
+        # Le board de départ n'est pas modifié
+        self.assertEqual((list(self.b.contents), self.b.hashcode, self.b.turn), state)
+
+    def test_root_parallel(self):
+        # Avec la même graine, la recherche parallèle à la racine donne les mêmes statistiques
+        self.b.change_content("e5", RED)
+        self.b.piece_pools[RED][1] -= 1
+        moves = self.b.valid_moves(3)
+
+        for search, params in [(best_move_UCT, {'mode': 2}),
+                               (best_move_GRAVE, {'treshold': 10, 'mode': 2, 'mast_param': 0.3, 'beta_param': 1e-5})]:
+            results = []
+            for i in range(2):
+                b = self.b.copy()
+                b.transposition_table = copy.deepcopy(self.b.transposition_table)
+                stats = {}
+                move = search(b, 3, 30, nb_workers=3, seed=4, stats=stats, **params)
+                self.assertEqual(stats['table'], b.transposition_table.counters())
+                t = b.look_table(3)
+                self.assertIn(move.code(b.map), [m.code(b.map) for m in moves])
+                self.assertEqual(len(t[1]), len(moves))
+                self.assertGreaterEqual(sum(t[1]), 27)  # Chaque processus a fait 10 simulations
+                self.assertGreater(b.transposition_table.playouts_MAST.sum(),
+                                   self.b.transposition_table.playouts_MAST.sum())
+                results.append((t[1].tolist(), t[2].tolist(), move.code(b.map)))
+            self.assertEqual(results[0], results[1])
+
+    def test_tree_parallel(self):
+        # Toutes les descentes des processus passent par la racine de l'arbre partagé
+        self.b.change_content("e5", RED)
+        self.b.piece_pools[RED][1] -= 1
+        moves = self.b.valid_moves(3)
+        mast_playouts = self.b.transposition_table.playouts_MAST.sum()
+
+        move = best_move_UCT_tree_parallel(self.b, 3, 40, 2, mode=2, seed=1)
+        t = self.b.look_table(3)
+        self.assertIn(move.code(self.b.map), [m.code(self.b.map) for m in moves])
+        self.assertEqual(t[0], 40)
+        self.assertEqual(sum(t[1]), 40)
+        self.assertEqual(t[2].sum(), 40)
+        self.assertGreater(self.b.transposition_table.playouts_MAST.sum(), mast_playouts)
+
+        # Avec un seul coup légal, pas de simulation mais les statistiques sont remplies
+        stats = {}
+        with mock.patch.object(self.b, 'valid_moves', return_value=moves[:1]):
+            self.assertIs(best_move_UCT_tree_parallel(self.b, 3, 40, 2, mode=2, stats=stats), moves[0])
+        self.assertEqual(stats['simulations'], 0)
+        self.assertEqual(len(stats['visits']), 1)
+
+        # Un processus qui plante fait échouer la recherche au lieu de fausser les statistiques, et la mémoire partagée
+        # est libérée
+        shared_blocks = set(os.listdir('/dev/shm'))
+        with mock.patch('src.tree_parallel.run_playout', side_effect=ValueError):
+            self.assertRaises(RuntimeError, best_move_UCT_tree_parallel, self.b, 3, 40, 2, mode=2)
+        self.assertEqual(set(os.listdir('/dev/shm')), shared_blocks)
+
+    def test_time_budget(self):
+        # Sans nombre de playouts, la recherche s'arrête sur le budget de temps ou de noeuds
+        stats = {}
+        start_time = time.perf_counter()
+        best_move_UCT(self.b, 3, None, mode=2, time_budget=0.3, stats=stats)
+        self.assertLess(time.perf_counter() - start_time, 1)
+        self.assertGreater(stats['simulations'], 0)
+        self.assertEqual(len(stats['visits']), len(self.b.valid_moves(3)))
+
+        # En parallèle, le démarrage des processus et la fusion des résultats sont pris sur le même budget
+        for search in [best_move_UCT, best_move_UCT_tree_parallel]:
+            start_time = time.perf_counter()
+            search(self.b, 3, None, nb_workers=2, mode=2, time_budget=0.3)
+            self.assertLess(time.perf_counter() - start_time, 0.45)
+
+        stats = {}
+        best_move_GRAVE(self.b, 3, 1000, 10, 2, 0.3, 1e-5, max_nodes=20, stats=stats)
+        self.assertEqual(stats['nodes'], 20)
+        self.assertLess(stats['simulations'], 1000)
+
+        # Les recherches qui ne s'arrêteraient jamais sont refusées
+        self.assertIsNone(best_move_UCT(self.b, 3, None, mode=2))
+        self.assertIsNone(best_move_UCT_tree_parallel(self.b, 3, None, 2, mode=2, max_nodes=20))
+        self.b.transposition_table = Table(mapp=self.b.map, max_entries=20)
+        self.assertIsNone(best_move_RAVE(self.b, 3, None, 2, 0.3, max_nodes=20))
+        self.assertIsNotNone(best_move_RAVE(self.b, 3, None, 2, 0.3, max_nodes=10))
+
+    def test_reuse_tree(self):
+        table = Table(mapp=self.b.map)
+        self.b.transposition_table = table
+        move = best_move_UCT(self.b, 3, 100, mode=2, reuse_tree=True)
+        first_search = set(table.table)
+        self.b.play(move)
+
+        # Les entrées de la recherche précédente sont conservées et la nouvelle recherche en ajoute
+        best_move_UCT(self.b, 2, 100, mode=2, reuse_tree=True)
+        self.assertTrue(first_search <= set(table.table))
+
+        # Les entrées qui ne sont plus consultées disparaissent au bout de max_age recherches
+        seen = {hashcode for hashcode, generation in table.last_seen.items() if generation == table.generation}
+        table.new_search(reuse_tree=True, max_age=1)
+        self.assertEqual(set(table.table), seen)
+        table.new_search(reuse_tree=True, max_age=1)
+        self.assertEqual(table.table, {})
+
+        best_move_UCT(self.b, 2, 10, mode=2)
+        self.assertLessEqual(len(table.table), 10)
+
+    def test_bounded_table(self):
+        for policy in ['least_visited', 'lru', 'depth']:
+            table = Table(mapp=self.b.map, max_entries=40, policy=policy)
+            self.b.transposition_table = table
+            stats = {}
+            best_move_RAVE(self.b, 3, 200, 2, 0.3, stats=stats)
+            self.assertLessEqual(len(table.table), 40)
+            self.assertEqual(set(table.last_seen), set(table.table))
+            self.assertGreater(stats['table']['evictions'], 0)
+            self.assertEqual(stats['table']['hits'] + stats['table']['misses'], table.hits + table.misses)
+            # Les entrées de la descente en cours, dont la racine, ne sont jamais supprimées : nb_bytes reste exact
+            self.assertEqual(sum(stats['visits']), table.look(self.b, 3)[0])
+            self.assertEqual(table.nb_bytes, sum(Table.entry_bytes(entry) for entry in table.table.values()))
+
+        # Les entrées des recherches précédentes sont supprimées en premier, même plus visitées
+        table = Table(mapp=self.b.map, max_entries=8)
+        for dice_score in [1, 2, 3, 4, 5]:
+            table.add(self.b, False, 1, dice_score)
+            table.look(self.b, dice_score)[0] = 100
+        table.new_search(reuse_tree=True)
+        table.start_descent()
+        table.look(self.b, 1)[0] = 0
+        table.add(self.b, False, 1, 6)
+        table.start_descent()
+        for dice_score in [7, 8, None]:
+            table.add(self.b, False, 1, dice_score)
+        self.assertEqual(table.evictions, 1)
+        self.assertIsNone(table.look(self.b, 2))
+        self.assertTrue(all(table.look(self.b, dice_score) is not None for dice_score in [1, 3, 6, 7, 8, None]))
+
+        self.assertRaises(ValueError, Table, self.b.map, policy='random')
+
+        # Sans borne, cette recherche occupe environ 1,4 Mo
+        table = Table(mapp=self.b.map, max_bytes=500000)
+        self.b.transposition_table = table
+        best_move_RAVE(self.b, 3, 200, 2, 0.3)
+        self.assertLessEqual(sum(Table.entry_bytes(entry) for entry in table.table.values()), 550000)
+        self.assertGreater(table.evictions, 0)
+
+    def test_zobrist(self):
+        hash_table, hash_turn = self.b.map.zobrist_keys()
+        self.assertIs(self.b.map.zobrist_keys()[0], hash_table)  # Tirées une seule fois par map
+        self.assertTrue(all(type(key) is int and 0 <= key < 2 ** 64 for keys in hash_table.values() for key in keys))
+        self.assertTrue(any(key >= 2 ** 32 for keys in hash_table.values() for key in keys))
+        b = Board(mapp=self.b.map)
+        self.assertIs(b.hash_table, hash_table)
+        b.play(b.valid_moves(2)[0])
+        self.assertIs(type(b.hashcode), int)
+
+        # Collision simulée : un autre état avec le même hashcode
+        table = Table(mapp=self.b.map, verify=True)
+        self.b.transposition_table = table
+        self.b.new_table_entry(False, 3)
+        self.assertIsNotNone(self.b.look_table())
+        other = self.b.copy()
+        other.play(other.valid_moves(1)[0])
+        other.hashcode = self.b.hashcode
+        self.assertIsNone(other.look_table())
+        self.assertEqual(table.collisions, 1)
+        other.new_table_entry(False, 5)
+        self.assertEqual(len(other.look_table()[1]), 5)
+        self.assertIsNone(self.b.look_table())
+        self.assertEqual(table.counters()['collisions'], 2)
+        self.assertEqual(table.nb_bytes, Table.entry_bytes(other.look_table()))
+
+        # Le cache des coups légaux ne renvoie pas non plus les coups de l'autre état
+        codes = lambda moves: [move.code(self.b.map) for move in moves]
+        self.assertEqual(codes(table.valid_moves(self.b, 3)), codes(self.b.valid_moves(3)))
+        self.assertEqual(codes(table.valid_moves(other, 3)), codes(other.valid_moves(3)))
+        self.assertEqual(table.valid_moves(other, 3, with_codes=True)[1].tolist(), codes(other.valid_moves(3)))
+        self.assertEqual(table.moves_hits, 1)
+
+    def test_chance_nodes(self):
+        # Chaque lancer de dé a son propre noeud de décision, dimensionné à ses coups légaux
+        table = self.b.transposition_table
+        best_move_UCT(self.b, 3, 200, mode=2, stratified_dice=True)
+        root = self.b.look_table(3)
+        self.assertEqual(len(root[1]), len(self.b.valid_moves(3)))
+        self.assertIsNone(self.b.look_table(1))
+        self.assertEqual(sum(root[1]), 200 - 1)  # La première simulation crée la racine
+
+        # Avec stratified_dice, les lancers sont équilibrés au noeud de hasard qui suit chaque coup de la racine
+        for move, nb_visits in zip(self.b.valid_moves(3), root[1]):
+            if nb_visits >= 3:
+                undo = self.b.play(move)
+                visits = [table.visits(self.b, dice) for dice in range(1, self.b.map.max_dice + 1)]
+                self.b.unplay(undo)
+                self.assertEqual(sum(visits), nb_visits)
+                self.assertLessEqual(max(visits) - min(visits), 1)
+
+    def test_progressive_widening(self):
+        # Deux groupes de 17 placements de block pour un 3
+        self.b.change_content('c1', RED)
+        self.b.piece_pools[RED][1] -= 1
+        moves = self.b.valid_moves(3)
+        stats = {}
+        best_move_UCT(self.b, 3, 60, mode=2, widening=(1.0, 0.5), stats=stats)
+        for start_node, end_node in {(move.start_node, move.end_node) for move in moves if move.block}:
+            group = [m for m, move in enumerate(moves)
+                     if move.block and (move.start_node, move.end_node) == (start_node, end_node)]
+            n = sum(stats['visits'][m] for m in group)
+            tried = sum(1 for m in group if stats['visits'][m] > 0)
+            self.assertLessEqual(tried, max(1, int(n ** 0.5)) + 1)
+        # Les coups sans block sont tous essayés
+        self.assertTrue(all(visits > 0 for move, visits in zip(moves, stats['visits']) if not move.block))
+
+        stats = {}
+        best_move_UCT(self.b, 3, 60, mode=2, stats=stats)
+        self.assertTrue(all(visits > 0 for visits in stats['visits']))
+
+    def test_moves_cache(self):
+        table = Table(mapp=self.b.map, max_cached_moves=16)
+        self.b.transposition_table = table
+        stats = {}
+        best_move_UCT(self.b, 3, 200, mode=2, stats=stats)
+        self.assertGreater(stats['table']['moves_hits'], 0)
+        self.assertLessEqual(len(table.moves_cache), 16)
+
+        # Les coups du cache sont ceux de valid_moves, et un deuxième appel ne les recalcule pas
+        moves = table.valid_moves(self.b, 2)
+        self.assertEqual([move.code(self.b.map) for move in moves],
+                         [move.code(self.b.map) for move in self.b.valid_moves(2)])
+        self.assertIs(table.valid_moves(self.b, 2), moves)
+        self.assertIsNot(table.valid_moves(self.b, 1), moves)
+
+        # Le cache n'est pas envoyé aux autres processus
+        self.assertEqual(pickle.loads(pickle.dumps(table)).moves_cache, {})
+
+    def test_map_registry(self):
+        # Une seule map par référence, y compris après un passage par pickle
+        self.assertIs(Map(REF2), self.b.map)
+        self.assertIs(Board().map, self.b.map)
+        self.assertIs(pickle.loads(pickle.dumps(self.b.map)), self.b.map)
+        self.assertIsNot(Map(REF3), self.b.map)
+
+        # Les données de la map ne peuvent pas être modifiées par un plateau
+        self.assertRaises(ValueError, self.b.map.path_table.__setitem__, 0, 0)
+        g = self.b.map.get_board()
+        g.nodes['c1']['content'] = RED
+        self.assertEqual(self.b.map.get_board().nodes['c1']['content'], EMPTY)
+
+        self.assertEqual([self.b.map.nodes[i] for i in self.b.map.placement_cells],
+                         [node for node in self.b.map.nodes if node[1] not in '01'])
+        self.assertEqual(self.b.piece_pools, {RED: ['a0', 2], BLUE: ['i0', 2]})
+
+    def test_book(self):
+        best_move_UCT(self.b, 3, 100, mode=2)
+        table = self.b.transposition_table
+        root = table.look(self.b, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + "/book.bin"
+            # Seuls les états visités au moins une fois sont enregistrés
+            visited = [hashcode for hashcode, entry in table.table.items() if entry[0] >= 1]
+            self.assertEqual(write_book(table, self.b, path), len(visited))
+            book = Book(path)
+            self.assertEqual(len(book), len(visited))
+            self.assertNotIn(self.b.hashcode, book)  # Seuls les noeuds de décision (état, dé) sont enregistrés
+
+            # Les entrées absentes de la table sont lues dans le livre
+            new_table = Table(mapp=self.b.map)
+            self.assertTrue(new_table.use_book(book, self.b))
+            entry = new_table.look(self.b, 3)
+            self.assertEqual(entry[0], root[0])
+            np.testing.assert_array_equal(entry[1], root[1])
+            np.testing.assert_array_equal(entry[2], root[2])
+            self.assertEqual(new_table.counters()['book_hits'], 1)
+            self.assertIn(Table.key(self.b, 3), new_table.table)
+
+            # Le livre est rouvert (et non copié) quand on l'envoie à un autre processus
+            reopened = pickle.loads(pickle.dumps(book))
+            np.testing.assert_array_equal(reopened.get(Table.key(self.b, 3))[2], book.get(Table.key(self.b, 3))[2])
+
+            # Une recherche peut partir des statistiques du livre
+            self.b.transposition_table = new_table
+            best_move_UCT(self.b, 3, 20, mode=2)
+            self.assertEqual(new_table.look(self.b, 3)[0], root[0] + 20)
+
+            # Un plateau qui utilise d'autres clés de Zobrist ne peut pas utiliser ce livre
+            other = Board(*generate_hash_structures(REF2), mapp=self.b.map)
+            self.assertFalse(Table(mapp=self.b.map).use_book(book, other))
+
+            # Les livres d'avant les noeuds de décision (version 1) sont refusés
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(directory + "/old_book.bin", 'wb') as f:
+                f.write(data.replace(b'"version": 2', b'"version": 1', 1))
+            self.assertRaises(ValueError, Book, directory + "/old_book.bin")
+            del book, reopened
+
+    def test_tournament(self):
+        agents = [Agent('UCT', 10, mode=2, mast_param=0.3), Agent('UCT', 10, mode=2, mast_param=0.3)]
+        mast_playouts = self.b.transposition_table.playouts_MAST.copy()
+        summary = run_tournament(self.b, agents, 4, nb_workers=2, rotate_seats=True, game_time_limit=4, seed=2)
+
+        self.assertEqual(set(summary), {'UCT#1', 'UCT#2'})
+        for result in summary.values():
+            self.assertEqual(result['games'], 4)
+            self.assertLessEqual(result['ci'][0], result['rate'])
+            self.assertGreaterEqual(result['ci'][1], result['rate'])
+        # Les parties ne modifient pas les statistiques MAST du board de départ
+        np.testing.assert_array_equal(self.b.transposition_table.playouts_MAST, mast_playouts)
+
+        # Une erreur pendant le tournoi arrête les processus sans attendre la fin des parties restantes
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertRaises(IsADirectoryError, run_tournament, self.b, agents, 40, nb_workers=2,
+                              game_time_limit=20, seed=2, results_path=directory)
+        self.assertRaises(ValueError, Agent, 'MCTS', 10)
+
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=3)
+        self.assertAlmostEqual(high, 0.5962, places=3)
+
+    def test_mast_store(self):
+        agents = [Agent('UCT', 10, mode=2, mast_param=0.3), Agent('UCT', 10, mode=2, mast_param=0.3)]
+        with tempfile.TemporaryDirectory() as directory:
+            store = MastStore(self.b.map, directory)
+            self.assertIsNone(store.load(self.b.transposition_table))
+
+            # Chaque partie ajoute ses statistiques au fichier, y compris depuis les processus du pool
+            run_tournament(self.b, agents, 4, nb_workers=2, game_time_limit=4, seed=2, mast_store=store)
+            self.assertEqual(store.revision(), 4)
+            table = Table(mapp=self.b.map)
+            self.assertEqual(store.load(table), 4)
+            self.assertGreater(table.playouts_MAST.sum(), 0)
+            self.assertTrue(np.all(table.win_MAST.sum(axis=1) == table.playouts_MAST))
+
+            # Fusion explicite de ce qu'une table a appris
+            start_playouts, start_wins = table.playouts_MAST.copy(), table.win_MAST.copy()
+            table.update_MAST(RED, [0, 1])
+            self.assertEqual(store.merge_table(table, start_playouts, start_wins), 5)
+            new_table = Table(mapp=self.b.map)
+            store.load(new_table)
+            np.testing.assert_array_equal(new_table.playouts_MAST, table.playouts_MAST)
+
+            # Les compteurs du fichier peuvent dépasser la capacité d'un int32
+            playouts = np.zeros(len(table.playouts_MAST), dtype=np.int64)
+            playouts[0] = 2 ** 31
+            store.merge(playouts, np.zeros(table.win_MAST.shape, dtype=np.int64))
+            store.load(new_table)
+            self.assertEqual(new_table.playouts_MAST[0], table.playouts_MAST[0] + 2 ** 31)
+            # ... comme ceux de la table, y compris relue depuis un pickle qui les stockait en int32
+            state = new_table.__getstate__()
+            state['playouts_MAST'] = state['playouts_MAST'].astype(np.int32)
+            reloaded = Table.__new__(Table)
+            reloaded.__setstate__(state)
+            self.assertEqual(reloaded.playouts_MAST.dtype, np.int64)
+            self.assertEqual(Table(mapp=self.b.map).win_MAST.dtype, np.int64)
+
+            # Le fichier d'une autre map n'est pas utilisable
+            other = MastStore(Map(REF3), directory)
+            other.path = store.path
+            self.assertRaises(ValueError, other.load, Table(mapp=Map(REF3)))
+
+    def test_get_policy(self):
+        self.b.change_content("e5", RED)
+        self.b.piece_pools[RED][1] -= 1
+        table = self.b.transposition_table
+
+        def rate(move):
+            code = move.code(self.b.map)
+            return table.win_MAST[code][move.player] / table.playouts_MAST[code] if table.playouts_MAST[code] else 0
+
+        valid_moves = self.b.valid_moves(3)
+        policy = self.b.get_policy(valid_moves, 0.5)
+        expected = np.array([math.exp(rate(m) / 0.5) for m in valid_moves])
+        np.testing.assert_allclose(policy, expected / expected.sum())
+
+        grouped_moves = self.b.get_grouped_moves(valid_moves)
+        policy = self.b.get_policy(grouped_moves, 0.5)
+        expected = [math.exp(rate(m) / 0.5) for m in grouped_moves[0]]
+        expected += [math.exp(sum(rate(m) for m in group) / len(group) / 0.5) for group in grouped_moves[1:]]
+        expected = np.array(expected)
+        np.testing.assert_allclose(policy, expected / expected.sum())
+
+        # Un coup joué plusieurs fois dans un playout n'est compté qu'une fois
+        code = valid_moves[0].code(self.b.map)
+        playouts, wins = table.playouts_MAST[code], table.win_MAST[code][BLUE]
+        self.b.update_MAST(BLUE, [code, code])
+        self.assertEqual(table.playouts_MAST[code], playouts + 1)
+        self.assertEqual(table.win_MAST[code][BLUE], wins + 1)
+
+    def test_table_entries(self):
+        # Les entrées sont dimensionnées au nombre de coups de l'état et les stats AMAF ne contiennent que les coups joués
+        table = Table(mapp=self.b.map)
+        self.b.transposition_table = table
+        moves = self.b.valid_moves(3)
+
+        self.b.new_table_entry(amaf=True)
+        t = self.b.look_table()
+        self.assertEqual(len(t[1]), 0)
+        table.grow(t, len(moves))
+        self.assertEqual(len(t[1]), len(moves))
+        self.assertEqual(len(t[2]), len(moves))
+        table.grow(t, 1)
+        self.assertEqual(len(t[1]), len(moves))
+
+        codes = [moves[0].code(self.b.map), moves[1].code(self.b.map), moves[0].code(self.b.map)]
+        self.b.update_AMAF(t, RED, codes)
+        self.b.update_AMAF(t, BLUE, codes[:1])
+        self.assertEqual(t[3].tolist(), sorted(set(codes)))
+        amaf = table.amaf_stats(t, np.array([codes[0], codes[1], max(codes) + 1]))
+        self.assertEqual(amaf[:, [0, RED, BLUE]].tolist(), [[2, 1, 1], [1, 1, 0], [0, 0, 0]])
+        self.assertEqual(table.nb_bytes, Table.entry_bytes(t))
+
+    def test_old_table(self):
+        # Les tables du format d'origine (statistiques MAST appelées win_amaf / playouts_amaf) restent lisibles
+        with open('../big_transposition_table.pkl', 'rb') as f:
+            table = pickle.load(f)
+        self.assertEqual(table.win_MAST.shape, (self.b.map.nb_possible_moves, 3))
+        self.assertTrue(np.all(table.win_MAST.sum(axis=1) <= table.playouts_MAST))
+        self.b.transposition_table = table
+        move = best_move_UCT(self.b, 3, 5, mode=2, mast_param=0.3)
+        self.assertIn(move.code(self.b.map), [m.code(self.b.map) for m in self.b.valid_moves(3)])
+
+        state = Table(mapp=self.b.map).__getstate__()
+        del state['win_MAST']
+        self.assertRaises(ValueError, Table.__new__(Table).__setstate__, state)
+
+    def test_iterative_descent(self):
+        # La descente enregistre son chemin sans modifier le plateau, la remontée met à jour chaque noeud du chemin
+        self.b.change_content("e5", RED)
+        self.b.piece_pools[RED][1] -= 1
+        best_move_RAVE(self.b, 3, 50, 2, 0.3)
+        table = self.b.transposition_table
+        root = self.b.look_table(3)
+        hashcode, visits = self.b.hashcode, root[0]
+
+        played_moves_codes = []
+        winner, path = descend(self.b, 3, played_moves_codes, partial(rave_policy), True, 2, 0.3)
+        self.assertEqual(self.b.hashcode, hashcode)
+        self.assertIs(path[0][0], root)
+        path_codes = [code for t, choice, code in path if code is not None]
+        self.assertEqual(path_codes, played_moves_codes[:len(path_codes)])  # Puis les coups du playout
+        choice = path[0][1]
+        played, wins = root[1][choice], root[2][choice, winner]
+        backup(table, path, winner, played_moves_codes, True)
+        self.assertEqual(root[0], visits + 1)
+        self.assertEqual(root[1][choice], played + 1)
+        self.assertEqual(root[2][choice, winner], wins + 1)
+        self.assertGreaterEqual(table.amaf_stats(root, np.array([path[0][2]]))[0, 0], root[1][choice])
+
+    def test_vectorized_selection(self):
+        # La sélection vectorisée donne les mêmes scores que la formule coup par coup et départage au hasard
+        t = [10, np.array([0.0, 4.0, 4.0, 2.0]), np.zeros((4, 3), dtype=np.int64)]
+        t[2][:, RED] = [0, 3, 3, 0]
+        self.assertEqual(select_UCB(t, np.arange(4), RED, 0.4), 0)  # Coup jamais essayé
+        self.assertEqual({select_UCB(t, np.array([1, 2, 3]), RED, 0.4) for i in range(50)}, {1, 2})
+        self.assertEqual(select_UCB(t, np.array([1, 3]), BLUE, 0.4), 3)
+
+        n_amaf, win_amaf = np.array([0, 5, 5, 1]), np.array([0, 1, 4, 1])
+        self.assertEqual(select_RAVE(t, np.arange(4), RED, 1e-5, n_amaf, win_amaf), 0)  # Pas de stats AMAF
+        self.assertEqual(select_RAVE(t, np.array([1, 2, 3]), RED, 1e-5, n_amaf[1:], win_amaf[1:]), 2)
+
+        def rave_score(m, n_amaf, win_amaf):  # Formule de RAVE coup par coup
+            if n_amaf == 0:
+                return 100000
+            beta = n_amaf / (t[1][m] + n_amaf + 1e-5 * t[1][m] * n_amaf)
+            Q = t[2][m][RED] / t[1][m] if t[1][m] > 0 else 1
+            return (1.0 - beta) * Q + beta * (win_amaf / n_amaf)
+
+        rng = np.random.default_rng(0)
+        for i in range(20):
+            t[1] = rng.integers(1, 20, 4).astype(np.float64)
+            t[2][:, RED] = rng.integers(0, t[1] + 1)
+            n_amaf = rng.integers(1, 20, 4)
+            win_amaf = rng.integers(0, n_amaf + 1)
+            scores = [rave_score(m, n_amaf[m], win_amaf[m]) for m in range(4)]
+            choice = select_RAVE(t, np.arange(4), RED, 1e-5, n_amaf, win_amaf)
+            self.assertEqual(scores[choice], max(scores))
+
     def test_playout_policy_2(self):
         # La on essaie d'observer les probas pour la deuxième méthode de playout
         self.b.change_content("e5", RED)